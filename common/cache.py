@@ -0,0 +1,128 @@
+"""
+Helpers for the site's caches.
+
+settings.CACHES["default"] is shared by all processes (memcached in
+production). An optional "local" cache is kept in each process, in front of it,
+for hot entries that are safe to hold on to: values stored under a versioned
+key never change, because changing the data bumps the version instead.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+
+LOCAL_CACHE_ALIAS = "local"
+# Seconds that values are kept in the local cache
+LOCAL_CACHE_TIMEOUT = 60
+# Seconds that a process building a missing value holds the build lock for,
+# and that other processes wait for it before building the value themselves
+BUILD_LOCK_TIMEOUT = 10
+BUILD_WAIT = 2
+BUILD_POLL_INTERVAL = 0.05
+
+_missing = object()
+
+
+def _version_key(name):
+    return f"version:{name}"
+
+
+def get_version(name):
+    """
+    Current value of a named version counter. Include it in cache keys so that
+    bumping the counter invalidates every key built from it.
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock, so a counter that has been evicted never restarts
+        # at a value that was used before
+        seed = time.time_ns()
+        cache.add(key, seed, timeout=None)
+        version = cache.get(key)
+        if version is None:
+            # The cache is unavailable (memcached errors are ignored); a fresh
+            # value misses any keys cached before the outage
+            version = seed
+    return version
+
+
+def get_versions(*names):
+    keys = {_version_key(name): name for name in names}
+    versions = cache.get_many(keys)
+    return tuple(
+        versions[key] if key in versions else get_version(name)
+        for key, name in keys.items()
+    )
+
+
+def bump_version(name):
+    try:
+        return cache.incr(_version_key(name))
+    except ValueError:
+        # Not set yet (or evicted)
+        return get_version(name)
+
+
+def get_local_cache():
+    if LOCAL_CACHE_ALIAS in settings.CACHES:
+        return caches[LOCAL_CACHE_ALIAS]
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + BUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_POLL_INTERVAL)
+        value = cache.get(key, _missing)
+        if value is not _missing:
+            return value
+    return _missing
+
+
+def get_or_build(key, build, timeout=DEFAULT_TIMEOUT, local=False):
+    """
+    Get a value from the cache, or build it with build() and cache it.
+
+    Only one process builds a missing value at a time; the others wait for it
+    to be cached (for up to BUILD_WAIT seconds) rather than all building it at
+    once. If the cache is unavailable, the value is built without waiting.
+
+    If local, the value is also kept in the process's local cache. Only use
+    this for versioned keys, as deleting the key doesn't clear local copies.
+    """
+    local_cache = get_local_cache() if local else None
+    if local_cache is not None:
+        value = local_cache.get(key, _missing)
+        if value is not _missing:
+            return value
+
+    value = cache.get(key, _missing)
+    if value is _missing:
+        lock_key = f"lock:{key}"
+        if cache.add(lock_key, 1, BUILD_LOCK_TIMEOUT):
+            try:
+                value = build()
+                cache.set(key, value, timeout)
+            finally:
+                cache.delete(lock_key)
+        else:
+            if cache.get(lock_key) is None:
+                # The lock isn't held, so add() failed because the cache is
+                # unavailable (memcached errors are ignored); there's nothing
+                # to wait for
+                value = _missing
+            else:
+                value = _wait_for(key)
+            if value is _missing:
+                # Still building elsewhere (or that process failed)
+                value = build()
+                cache.set(key, value, timeout)
+
+    if local_cache is not None:
+        local_timeout = LOCAL_CACHE_TIMEOUT
+        if timeout not in (None, DEFAULT_TIMEOUT):
+            local_timeout = min(timeout, LOCAL_CACHE_TIMEOUT)
+        local_cache.set(key, value, local_timeout)
+    return value
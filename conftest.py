@@ -1,5 +1,9 @@
+from datetime import timedelta
 from unittest.mock import patch
 
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils import timezone
 from model_bakery import baker
 from wagtail.models import Site
 
@@ -7,6 +11,8 @@ import pytest
 
 import wagtail_factories
 
+from fundraising.models import AuctionCategory, Bid
+from fundraising.tests.conftest import AuctionFactory, AuctionItemFactory, AuctionsPageFactory
 from home.tests.conftest import (
     FormPageFactory, OrderFormPageFactory, PDFFormPageFactory
 )
@@ -29,6 +35,25 @@ class HomePageFactory(wagtail_factories.PageFactory):
         model = "home.HomePage"
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # cached data is keyed on ids, which can be reused between tests
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    # keep files saved to default storage out of the project
+    settings.MEDIA_ROOT = tmp_path / "media"
+
+
+@pytest.fixture(autouse=True)
+def fb_access_token_path(settings, tmp_path):
+    # the token manager seeds this file from FB_ACCESS_TOKEN on first use
+    settings.FB_ACCESS_TOKEN_PATH = tmp_path / ".fb_access_token"
+
+
 @pytest.fixture(autouse=True)
 def root_page():
     page = wagtail_factories.PageFactory(parent=None)
@@ -161,3 +186,36 @@ def pdf_form_pre_submission(pdf_form_page):
             PDFFormSubmission, page=pdf_form_page, form_data=data
         )
     return _submission
+
+
+@pytest.fixture
+def auction(home_page):
+    auctions_page = AuctionsPageFactory(parent=home_page)
+    yield AuctionFactory(
+        parent=auctions_page,
+        open_at=timezone.now() - timedelta(days=1),
+        close_at=timezone.now() + timedelta(days=1),
+    )
+
+
+@pytest.fixture
+def auction_item(auction):
+    category = baker.make(AuctionCategory, name="Test category")
+
+    def _auction_item(**kwargs):
+        return AuctionItemFactory(parent=auction, category=category, **{"title": "Test item", **kwargs})
+    return _auction_item
+
+
+@pytest.fixture
+def bid():
+    def _bid(auction_item, amount, **kwargs):
+        if "user" not in kwargs:
+            kwargs["user"] = baker.make(User, email=f"bidder{User.objects.count()}@test.com")
+        return baker.make(
+            Bid, 
+            auction_item=auction_item, 
+            amount=amount, 
+            **{"name": "Mickey Mouse", "address_line_1": "1 Test St", "town_city": "Test", "county": "Test", "postcode": "T1", **kwargs}
+        )
+    return _bid
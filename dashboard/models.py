@@ -1,12 +1,39 @@
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from modelcluster.models import ClusterableModel
 from wagtail.admin.panels import FieldPanel, MultiFieldPanel
 from wagtail.contrib.settings.models import BaseGenericSetting, BaseSiteSetting, register_setting
 
+from common.cache import get_or_build
+
+
+class CachedSettingMixin:
+    """
+    Settings are read on every page, so cache them rather than querying for
+    each request. Saving a setting clears its cache; the timeout limits how
+    long other processes can use an old value if the cache isn't shared
+    between them.
+    """
+    cache_timeout = 60 * 10
+
+    @classmethod
+    def get_cache_key(cls, site_id=None):
+        return f"setting:{cls._meta.label_lower}:{site_id}"
+
+    @classmethod
+    def get_cached(cls, load, site_id=None):
+        return get_or_build(cls.get_cache_key(site_id), load, cls.cache_timeout)
+
+    def invalidate_cache(self):
+        key = self.get_cache_key(getattr(self, "site_id", None))
+        transaction.on_commit(lambda: cache.delete(key))
+
 
 @register_setting
-class SiteSettings(BaseSiteSetting):
+class SiteSettings(CachedSettingMixin, BaseSiteSetting):
     title_suffix = models.CharField(
         verbose_name="Title suffix",
         max_length=255,
@@ -18,9 +45,15 @@ class SiteSettings(BaseSiteSetting):
         FieldPanel("title_suffix"),
     ]
 
+    @classmethod
+    def for_site(cls, site):
+        if site is None:
+            return super().for_site(site)
+        return cls.get_cached(lambda: super(SiteSettings, cls).for_site(site), site_id=site.id)
+
 
 @register_setting
-class SocialSettings(ClusterableModel, BaseGenericSetting):
+class SocialSettings(CachedSettingMixin, ClusterableModel, BaseGenericSetting):
     twitter_url = models.URLField(verbose_name="Twitter URL", blank=True)
     facebook_url = models.URLField(verbose_name="Facebook URL", blank=True)
     instagram_url = models.URLField(verbose_name="Instagram URL", blank=True)
@@ -35,3 +68,15 @@ class SocialSettings(ClusterableModel, BaseGenericSetting):
             "Social settings",
         )
     ]
+
+    @classmethod
+    def _get_or_create(cls):
+        return cls.get_cached(super()._get_or_create)
+
+
+@receiver(post_save, sender=SiteSettings, dispatch_uid="sitesettings_save_cache")
+@receiver(post_delete, sender=SiteSettings, dispatch_uid="sitesettings_delete_cache")
+@receiver(post_save, sender=SocialSettings, dispatch_uid="socialsettings_save_cache")
+@receiver(post_delete, sender=SocialSettings, dispatch_uid="socialsettings_delete_cache")
+def invalidate_setting_cache(sender, instance, **kwargs):
+    instance.invalidate_cache()
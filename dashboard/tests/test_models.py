@@ -0,0 +1,32 @@
+import pytest
+
+from wagtail.models import Site
+
+from ..models import SiteSettings, SocialSettings
+
+pytestmark = pytest.mark.django_db
+
+
+def test_site_settings_cached(root_page, django_assert_num_queries, django_capture_on_commit_callbacks):
+    site = Site.objects.get(root_page=root_page)
+    SiteSettings.for_site(site)
+    with django_assert_num_queries(0):
+        assert SiteSettings.for_site(site).title_suffix == "Podencos In Need (PINS)"
+
+    settings = SiteSettings.for_site(site)
+    settings.title_suffix = "PINS"
+    with django_capture_on_commit_callbacks(execute=True):
+        settings.save()
+    assert SiteSettings.for_site(site).title_suffix == "PINS"
+
+
+def test_social_settings_cached(django_assert_num_queries, django_capture_on_commit_callbacks):
+    SocialSettings.load()
+    with django_assert_num_queries(0):
+        assert SocialSettings.load().twitter_url == ""
+
+    settings = SocialSettings.load()
+    settings.twitter_url = "https://twitter.com/pins"
+    with django_capture_on_commit_callbacks(execute=True):
+        settings.save()
+    assert SocialSettings.load().twitter_url == "https://twitter.com/pins"
@@ -0,0 +1,95 @@
+"""
+HTTP client for the Facebook integration.
+
+A single requests Session is shared by the Graph API client, the token manager
+and the album sync, so connections to each host are kept alive and reused
+(the pool holds enough for settings.FB_SYNC_WORKERS threads). Requests time
+out after settings.FB_HTTP_TIMEOUT (connect, read) seconds, and GETs that get a
+429 or 5xx response are retried up to settings.FB_HTTP_RETRIES times, with
+exponential backoff (or as long as the response's Retry-After asks).
+
+get(url, conditional=True) keeps the response's ETag and Last-Modified
+headers in the "facebook" cache (on disk in production, apart from the shared
+default cache), with its content, and sends them with the next request for
+the url; a 304 Not Modified response is answered from the cache. This is for
+Graph API responses: streamed responses (e.g. image downloads) are never kept,
+so they're never read into memory.
+"""
+import functools
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.core.cache import caches
+from requests import Session
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF_FACTOR = 0.5
+CONDITIONAL_CACHE_ALIAS = "facebook"
+# Responses are only kept for conditional requests if they're small enough
+# to hold in memory
+CONDITIONAL_MAX_BYTES = 5 * 1024 * 1024
+CONDITIONAL_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+@functools.cache
+def get_session():
+    retry = Retry(
+        total=settings.FB_HTTP_RETRIES,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        # Return the last response once retries run out, so Graph API errors
+        # can be read from it
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_maxsize=max(settings.FB_SYNC_WORKERS, DEFAULT_POOLSIZE),
+        max_retries=retry,
+    )
+    session = Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def conditional_cache_key(url):
+    # Leave out the access token, which changes when it's extended
+    scheme, netloc, path, query, _ = urlsplit(url)
+    query = urlencode([(key, value) for key, value in parse_qsl(query) if key != "access_token"])
+    url = urlunsplit((scheme, netloc, path, query, ""))
+    return f"fb_http:{hashlib.sha256(url.encode()).hexdigest()}"
+
+
+def get(url, conditional=False, **kwargs):
+    kwargs.setdefault("timeout", settings.FB_HTTP_TIMEOUT)
+    if not conditional or kwargs.get("stream"):
+        return get_session().get(url, **kwargs)
+
+    cache = caches[CONDITIONAL_CACHE_ALIAS]
+    key = conditional_cache_key(url)
+    cached = cache.get(key)
+    headers = dict(kwargs.pop("headers", None) or {})
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    response = get_session().get(url, headers=headers, **kwargs)
+
+    if cached and response.status_code == 304:
+        response._content = cached["content"]
+        response._content_consumed = True
+        response.from_cache = True
+    elif response.status_code == 200:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if (etag or last_modified) and len(response.content) <= CONDITIONAL_MAX_BYTES:
+            cache.set(
+                key,
+                {"etag": etag, "last_modified": last_modified, "content": response.content},
+                CONDITIONAL_CACHE_TIMEOUT,
+            )
+    return response
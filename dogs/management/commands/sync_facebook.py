@@ -5,7 +5,8 @@ from django.core.management.base import BaseCommand
 from django.core.mail import send_mail
 from django.urls import reverse
 
-from dogs.models import FacebookAlbumTracker, FacebookTokenManager, DogPage
+from dogs.models import FacebookAlbumTracker, FacebookRateLimited, FacebookTokenManager, DogPage
+from dogs.renditions import warm_page_renditions
 
 
 class Command(BaseCommand):
@@ -43,8 +44,13 @@ class Command(BaseCommand):
             action="store_true",
             help="Force all album photos to be re-fetched from Facebook, ignoring last_fetched",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of threads fetching photos and images (defaults to settings.FB_SYNC_WORKERS)",
+        )
 
-    def handle(self, email, album_ids, from_ix, to_ix, check, force_update, **kwargs):
+    def handle(self, email, album_ids, from_ix, to_ix, check, force_update, workers=None, **kwargs):
         token_manager = FacebookTokenManager()
         token = token_manager.get_current_access_token()
         status = token_manager.get_token_status(token)
@@ -83,7 +89,7 @@ class Command(BaseCommand):
             self._run_check()
             return
 
-        tracker = FacebookAlbumTracker()
+        tracker = FacebookAlbumTracker(workers=workers)
 
         if album_ids or from_ix is not None or to_ix is not None:
             if not album_ids:
@@ -93,15 +99,23 @@ class Command(BaseCommand):
                 to_ix = to_ix if to_ix is not None and to_ix <= len(all_ids) else len(all_ids)
                 album_ids = all_ids[from_ix:to_ix]
             tracker.update_albums(album_ids, force_update=True)
+            warm_page_renditions(DogPage.objects.live().filter(facebook_album_id__in=album_ids))
             return
 
         self._run_full_sync(tracker, email, force_update=force_update)
+        # Generate renditions of new images now, rather than on their first view
+        warm_page_renditions(DogPage.objects.live())
 
     def _run_full_sync(self, tracker, send_email, force_update=False):
         now = datetime.now(UTC)
         mail_content = [f"Facebook album changes as of {now}"]
 
-        changes = tracker.update_all(force_update=force_update)
+        try:
+            changes = tracker.update_all(force_update=force_update)
+        except FacebookRateLimited as e:
+            # Albums fetched so far are checkpointed; the next sync carries on from them
+            self.stderr.write(f"Rate limited by Facebook, sync incomplete: {e}. Run again later to resume.")
+            return
         failed_to_delete = changes.pop("failed_to_delete")
 
         # Albums whose title changed AND whose page was moved belong in one section only.
@@ -172,17 +186,17 @@ class Command(BaseCommand):
 
     def _run_check(self):
         from dogs.models import DogStatusPage, FacebookAlbums
-        tracker_albums = FacebookAlbums.instance()
+        album_names = FacebookAlbums.instance().album_names()
         message = []
         for status_page in DogStatusPage.objects.all():
             message.append(f"============{status_page.title}===========")
             for page in status_page.get_children():
-                saved_data = tracker_albums.get_album(page.specific.facebook_album_id)
-                if not saved_data:
+                album_name = album_names.get(page.specific.facebook_album_id)
+                if album_name is None:
                     message.append(f"Site: {page} - {page.get_parent().title} / Facebook: removed")
                 else:
                     message.append(
                         f"Site: {page.title} - {page.get_parent().title} "
-                        f"({page.specific.location}) / Facebook: {saved_data['name']}"
+                        f"({page.specific.location}) / Facebook: {album_name}"
                     )
         self.stdout.write('\n'.join(message))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from dogs.models import DogPage, DogsIndexPage, DogStatusPage
+from dogs.renditions import warm_page_renditions
+
+
+class Command(BaseCommand):
+    help = "Generate any missing renditions of the images shown on dog pages and their index pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--album-ids",
+            nargs='+',
+            default=[],
+            help="Only generate renditions for the pages of these album IDs",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of processes generating renditions (defaults to settings.RENDITION_WORKERS)",
+        )
+
+    def handle(self, album_ids, workers=None, **kwargs):
+        pages = DogPage.objects.live()
+        if album_ids:
+            pages = pages.filter(facebook_album_id__in=album_ids)
+        else:
+            pages = [*DogsIndexPage.objects.live(), *DogStatusPage.objects.live(), *pages]
+        generated = warm_page_renditions(pages, workers=workers)
+        self.stdout.write(f"Generated {generated} renditions")
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0015_rename_previous_albums_consolidate_singleton'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facebookalbums',
+            name='sync_progress',
+            field=models.JSONField(default=dict),
+        ),
+    ]
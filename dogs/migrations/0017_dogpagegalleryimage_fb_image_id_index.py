@@ -0,0 +1,18 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0016_facebookalbums_sync_progress'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dogpagegalleryimage',
+            name='fb_image_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+    ]
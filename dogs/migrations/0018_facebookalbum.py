@@ -0,0 +1,70 @@
+# Generated by Django 6.0.6 on 2026-10-18 08:05
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def split_albums_into_rows(apps, schema_editor):
+    FacebookAlbums = apps.get_model("dogs", "FacebookAlbums")
+    FacebookAlbum = apps.get_model("dogs", "FacebookAlbum")
+    albums_obj = FacebookAlbums.objects.filter(pk=1).first()
+    if albums_obj is None:
+        return
+    current = albums_obj.albums or {}
+    baseline = albums_obj.reporting_baseline or {}
+    sync_progress = albums_obj.sync_progress or {}
+    rows = []
+    for album_id in set(current) | set(baseline) | set(sync_progress):
+        data = current.get(album_id)
+        row = FacebookAlbum(
+            album_id=album_id,
+            data=data,
+            acknowledged_name=baseline[album_id].get("name", "") if album_id in baseline else None,
+            sync_progress=sync_progress.get(album_id),
+        )
+        if data is not None:
+            row.name = data.get("name", "")
+            row.updated_time = data.get("updated_time") or ""
+            row.fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        elif album_id in baseline:
+            row.name = row.acknowledged_name
+        rows.append(row)
+    FacebookAlbum.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dogs', '0017_dogpagegalleryimage_fb_image_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacebookAlbum',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('album_id', models.CharField(max_length=255, unique=True)),
+                ('data', models.JSONField(null=True)),
+                ('name', models.TextField(blank=True)),
+                ('updated_time', models.CharField(blank=True, max_length=255)),
+                ('fingerprint', models.CharField(blank=True, max_length=64)),
+                ('acknowledged_name', models.TextField(null=True)),
+                ('sync_progress', models.JSONField(null=True)),
+            ],
+        ),
+        migrations.RunPython(split_albums_into_rows, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='facebookalbums',
+            name='albums',
+        ),
+        migrations.RemoveField(
+            model_name='facebookalbums',
+            name='reporting_baseline',
+        ),
+        migrations.RemoveField(
+            model_name='facebookalbums',
+            name='sync_progress',
+        ),
+    ]
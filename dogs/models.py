@@ -1,28 +1,41 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from io import BytesIO
+from functools import partial
+import hashlib
+import json
 import logging
 import re
-import requests
-from time import sleep
+from tempfile import TemporaryFile
+import threading
+from time import monotonic, sleep
+from urllib.parse import urlsplit
 
 from django.conf import settings
 from django.core.files.images import ImageFile
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db import models
-from django.db.models.signals import pre_delete
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import ExpressionWrapper, F, Q
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from facebook import GraphAPI, GraphAPIError
+from requests import HTTPError
 
 from modelcluster.fields import ParentalKey
 from wagtail.models.media import Collection
-from wagtail.models import Orderable, Page
+from wagtail.models import Orderable, Page, Site
 from wagtail.fields import RichTextField
 from wagtail.admin.panels import FieldPanel, InlinePanel, HelpPanel, Panel
 from wagtail.images.models import Image
+from wagtail.signals import page_published, page_unpublished, post_page_move
+
+from . import facebook_http
+from .navigation import invalidate_menu
+from .renditions import warm_page_renditions_in_background
 
 
 logger = logging.getLogger(__name__)
@@ -37,6 +50,7 @@ STATUS_ROUTING = [
 ]
 
 RECENTLY_FETCHED_THRESHOLD_HOURS = 1
+IMAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 def get_target_status_title(album_title):
@@ -61,7 +75,20 @@ class DogIndexPageStatuses(Orderable):
     panels = [FieldPanel("status_page")]
 
 
-class DogsIndexPage(Page):
+class HeaderImageRenditionsMixin:
+    """
+    For pages with a header image; generates its renditions when the page is
+    saved, rather than on its first view
+    """
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if self.image_id and (update_fields is None or "image" in update_fields):
+            transaction.on_commit(partial(warm_page_renditions_in_background, [self.id]))
+        return result
+
+
+class DogsIndexPage(HeaderImageRenditionsMixin, Page):
 
     image = models.ForeignKey(
         "wagtailimages.Image",
@@ -101,7 +128,7 @@ class DogsIndexPage(Page):
         return [page.status_page for page in self.dog_status_pages.all() if page.status_page.live]
 
 
-class DogStatusPage(Page):
+class DogStatusPage(HeaderImageRenditionsMixin, Page):
 
     image = models.ForeignKey(
         "wagtailimages.Image",
@@ -243,36 +270,80 @@ class RateLimitedPanel(Panel):
             return ""
         
 
-class FacebookAlbums(models.Model):
+class FacebookAlbumQuerySet(models.QuerySet):
+
+    def current(self):
+        """Albums that were on Facebook at the last sync"""
+        return self.filter(data__isnull=False)
 
-    # dict representing current state of albums for page
+
+class FacebookAlbum(models.Model):
+    """
+    The current state of a Facebook album, one row per album so that syncs
+    only write the albums that changed
+    """
+    album_id = models.CharField(max_length=255, unique=True)
     # {
-    #     "<album_id>": {
-    #         "name": "",
-    #         "count": 10,
-    #         "description": "",
-    #         "link": "",
-    #         "images": [<list of image urls>],
-    #         "updated_time": "",
-    #         "last_fetched": "",
-    #         }
-    #     },
+    #     "name": "",
+    #     "count": 10,
+    #     "description": "",
+    #     "link": "",
+    #     "images": [<list of image urls>],
+    #     "updated_time": "",
+    #     "last_fetched": "",
     # }
-    albums = models.JSONField()
-    # Snapshot of albums at the last acknowledgement. The nightly sync diffs
-    # new data against this baseline so that changes are reported until
-    # explicitly acknowledged, even if a report email is missed.
-    reporting_baseline = models.JSONField(default=dict)
+    # or None if the album has been removed from Facebook since changes were
+    # last acknowledged
+    data = models.JSONField(null=True)
+    name = models.TextField(blank=True)
+    updated_time = models.CharField(max_length=255, blank=True)
+    # Hash of data, so that unchanged albums aren't written again
+    fingerprint = models.CharField(max_length=64, blank=True)
+    # The album's name at the last acknowledgement, or None if it's been added
+    # since. The nightly sync reports changes since then, so that they're
+    # reported until explicitly acknowledged, even if a report email is missed.
+    acknowledged_name = models.TextField(null=True)
+    # Data fetched by a full sync that hasn't finished yet (e.g. because it
+    # was rate limited), so the next sync can resume from there. Cleared when
+    # a full sync completes.
+    sync_progress = models.JSONField(null=True)
+
+    objects = FacebookAlbumQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name or self.album_id
+
+    @staticmethod
+    def get_fingerprint(album_data):
+        return hashlib.sha256(
+            json.dumps(album_data, sort_keys=True, cls=DjangoJSONEncoder).encode()
+        ).hexdigest()
+
+    @classmethod
+    def fields_for(cls, album_data):
+        return {
+            "data": album_data,
+            "name": album_data.get("name", ""),
+            "updated_time": album_data.get("updated_time") or "",
+            "fingerprint": cls.get_fingerprint(album_data),
+        }
+
+
+class FacebookAlbums(models.Model):
+    """
+    Singleton holding the state of the Facebook sync; the albums themselves
+    are FacebookAlbum rows
+    """
     # Site-level changes that don't show up in the album diff (pages moved
     # between status pages, or pages recreated after manual deletion).
-    # Cleared on acknowledge alongside reporting_baseline.
+    # Cleared on acknowledge.
     pending_site_changes = models.JSONField(default=dict)
     date_updated = models.DateTimeField(default=timezone.now)
     rate_limited_at = models.DateTimeField(null=True)
 
     @classmethod
     def instance(cls):
-        obj, _ = cls.objects.get_or_create(pk=1, defaults={"albums": {}})
+        obj, _ = cls.objects.get_or_create(pk=1)
         return obj
 
     @property
@@ -289,24 +360,81 @@ class FacebookAlbums(models.Model):
         self.rate_limited_at = None
         self.save()
 
+    @property
+    def albums(self):
+        """Data for all current albums, by album id"""
+        return dict(FacebookAlbum.objects.current().values_list("album_id", "data"))
+
     def get_album(self, album_id):
-        return self.albums.get(album_id, {})
+        return FacebookAlbum.objects.current().filter(album_id=album_id).values_list("data", flat=True).first() or {}
+
+    def get_albums(self, album_ids):
+        return dict(FacebookAlbum.objects.current().filter(album_id__in=album_ids).values_list("album_id", "data"))
+
+    def album_names(self):
+        return dict(FacebookAlbum.objects.current().values_list("album_id", "name"))
+
+    def updated_times(self):
+        return dict(FacebookAlbum.objects.current().values_list("album_id", "updated_time"))
+
+    def acknowledged_names(self):
+        return dict(
+            FacebookAlbum.objects.filter(acknowledged_name__isnull=False).values_list("album_id", "acknowledged_name")
+        )
+
+    @property
+    def sync_progress(self):
+        return dict(FacebookAlbum.objects.filter(sync_progress__isnull=False).values_list("album_id", "sync_progress"))
 
     def update_album(self, album_id, album_data):
-        if self.albums is None:
-            self.albums = {}
-        self.albums[album_id] = album_data
-        self.save()
+        FacebookAlbum.objects.update_or_create(album_id=album_id, defaults=FacebookAlbum.fields_for(album_data))
 
     def update_all(self, all_album_data):
-        self.albums = all_album_data
-        self.date_updated = timezone.now()
-        self.save()
+        """
+        Replace the current albums with all_album_data, writing only the
+        albums that have changed
+        """
+        existing = {
+            album.album_id: album
+            for album in FacebookAlbum.objects.only("album_id", "fingerprint")
+        }
+        to_create = []
+        to_update = []
+        for album_id, album_data in all_album_data.items():
+            fields = FacebookAlbum.fields_for(album_data)
+            album = existing.pop(album_id, None)
+            if album is None:
+                to_create.append(FacebookAlbum(album_id=album_id, **fields))
+            elif album.fingerprint != fields["fingerprint"]:
+                for field, value in fields.items():
+                    setattr(album, field, value)
+                to_update.append(album)
+
+        with transaction.atomic():
+            FacebookAlbum.objects.bulk_create(to_create, batch_size=500)
+            FacebookAlbum.objects.bulk_update(
+                to_update, ["data", "name", "updated_time", "fingerprint"], batch_size=500
+            )
+            # Removed albums are kept (without their data) until the removal
+            # is acknowledged
+            removed = FacebookAlbum.objects.filter(album_id__in=existing)
+            removed.filter(acknowledged_name__isnull=True).delete()
+            removed.update(data=None, fingerprint="")
+            FacebookAlbum.objects.filter(sync_progress__isnull=False).update(sync_progress=None)
+            self.date_updated = timezone.now()
+            self.save()
+
+    def checkpoint_album(self, album_id, album_data):
+        FacebookAlbum.objects.update_or_create(album_id=album_id, defaults={"sync_progress": album_data})
 
     def acknowledge(self):
-        self.reporting_baseline = self.albums
-        self.pending_site_changes = {}
-        self.save()
+        with transaction.atomic():
+            removed = FacebookAlbum.objects.filter(data__isnull=True)
+            removed.filter(sync_progress__isnull=True).delete()
+            removed.update(acknowledged_name=None)
+            FacebookAlbum.objects.current().exclude(acknowledged_name=F("name")).update(acknowledged_name=F("name"))
+            self.pending_site_changes = {}
+            self.save()
 
     def album_recently_fetched(self, album_id):
         # Prevents redundant API calls when an admin saves a DogPage shortly
@@ -319,25 +447,33 @@ class FacebookAlbums(models.Model):
         return timezone.now() - last_fetched < delta
 
     def pending_changes(self):
-        """Return changes between reporting_baseline and current albums."""
-        baseline = self.reporting_baseline
-        current = self.albums
-        added = {
-            album_id: current[album_id]["name"]
-            for album_id in set(current) - set(baseline)
-        }
-        removed = {
-            album_id: baseline[album_id]["name"]
-            for album_id in set(baseline) - set(current)
-        }
-        changed = {
-            album_id: f"{current[album_id]['name']} (previously {baseline[album_id]['name']})"
-            for album_id in set(current) & set(baseline)
-            if current[album_id].get("name") != baseline[album_id].get("name")
-        }
+        """Return changes to albums since they were last acknowledged."""
+        added = {}
+        removed = {}
+        changed = {}
+        # Only albums whose name has changed, or that have been added or
+        # removed, are loaded
+        pending_albums = (
+            FacebookAlbum.objects.filter(Q(data__isnull=True) | ~Q(acknowledged_name=F("name")))
+            .annotate(is_removed=ExpressionWrapper(Q(data__isnull=True), output_field=models.BooleanField()))
+            .values_list("album_id", "name", "acknowledged_name", "is_removed")
+        )
+        for album_id, name, acknowledged_name, is_removed in pending_albums:
+            if is_removed:
+                if acknowledged_name is not None:
+                    removed[album_id] = acknowledged_name
+            elif acknowledged_name is None:
+                added[album_id] = name
+            else:
+                changed[album_id] = f"{name} (previously {acknowledged_name})"
         site = self.pending_site_changes or {}
+        moved_names = dict(
+            FacebookAlbum.objects.current()
+            .filter(album_id__in=site.get("moved", {}))
+            .values_list("album_id", "name")
+        )
         moved = {
-            album_id: {**val, "album_name": self.albums.get(album_id, {}).get("name", "")}
+            album_id: {**val, "album_name": moved_names.get(album_id, "")}
             for album_id, val in site.get("moved", {}).items()
         }
         changed_and_moved_ids = set(changed) & set(moved)
@@ -355,6 +491,31 @@ class FacebookAlbums(models.Model):
         }
 
 
+class FacebookRateLimited(Exception):
+    """The Graph API rate limited a sync; albums fetched so far are checkpointed"""
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests to each host, so that there are no more than
+    per_second of them across all threads
+    """
+
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second else 0
+        self.lock = threading.Lock()
+        self.next_request_at = {}
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = monotonic()
+            request_at = max(now, self.next_request_at.get(host, now))
+            self.next_request_at[host] = request_at + self.interval
+        if request_at > now:
+            sleep(request_at - now)
+
+
 class FacebookTokenManager:
 
     def __init__(self):
@@ -384,7 +545,7 @@ class FacebookTokenManager:
             f"https://graph.facebook.com/debug_token?input_token={token}"
             f"&access_token={token}"
         )
-        token_resp = requests.get(url).json()
+        token_resp = facebook_http.get(url).json()
         if token_resp.get("error"):
             error_msg = token_resp["error"].get("message", "")
             if "Session has expired" in error_msg:
@@ -410,10 +571,30 @@ class FacebookTokenManager:
 
 class FacebookAlbumTracker:
 
-    def __init__(self):
+    def __init__(self, workers=None):
         self._api = None
         self.token_manager = FacebookTokenManager()
         self.albums_obj = FacebookAlbums.instance()
+        # Threads used to fetch photos and images in fetch_all
+        self.workers = workers or settings.FB_SYNC_WORKERS
+        self.rate_limiter = HostRateLimiter(settings.FB_SYNC_REQUESTS_PER_SECOND)
+
+    def get(self, url, **kwargs):
+        # Graph API responses are revalidated with a conditional request;
+        # streamed image downloads aren't cached
+        self.rate_limiter.wait(url)
+        return facebook_http.get(url, conditional=True, **kwargs)
+
+    def check_response(self, resp_json):
+        error = resp_json.get("error")
+        if error:
+            if "limit" in error.get("message", ""):
+                raise FacebookRateLimited(error["message"])
+            raise GraphAPIError(resp_json)
+        return resp_json
+
+    def graph_api(self, token):
+        return GraphAPI(access_token=token, timeout=settings.FB_HTTP_TIMEOUT, session=facebook_http.get_session())
 
     @property
     def api(self):
@@ -431,10 +612,10 @@ class FacebookAlbumTracker:
                     raise Exception("Access token session has expired.")
             elif token_status == "expires_soon":
                 # Extend before it lapses and persist the new long-lived token.
-                self._api = GraphAPI(access_token=token)
+                self._api = self.graph_api(token)
                 token = self.token_manager.extend_token(self._api)
                 settings.FB_ACCESS_TOKEN_PATH.write_text(token)
-            self._api = GraphAPI(access_token=token)
+            self._api = self.graph_api(token)
         return self._api
 
     def get_all_albums(self):
@@ -458,24 +639,80 @@ class FacebookAlbumTracker:
 
     def get_album_images(self, album_id):
         url = f"https://graph.facebook.com/v18.0/{album_id}/photos/?fields=images&access_token={self.api.access_token}"
-        resp_json = requests.get(url).json()
+        resp_json = self.check_response(self.get(url).json())
         while True:
             yield from resp_json["data"]
             if 'next' not in resp_json.get('paging', {}):
                 break
-            resp_json = requests.get(resp_json["paging"]["next"]).json()
+            resp_json = self.check_response(self.get(resp_json["paging"]["next"]).json())
 
-    def create_gallery_image(self, page, collection, image_id, image_url):
-        image_resp = requests.get(image_url, allow_redirects=True)
-        photo_name = f"{page.slug}_{image_id}"
-        image = Image(
-            title=photo_name,
-            file=ImageFile(BytesIO(image_resp.content), name=f"{photo_name}.jpg"),
-            collection=collection,
+    def get_album_photos(self, album_id):
+        """The album's photos, each with the url of its largest image"""
+        photos = []
+        for photo in self.get_album_images(album_id):
+            images = photo.pop("images")
+            photo["image_url"] = images[0]["source"]
+            photos.append(photo)
+        return photos
+
+    def download_image(self, image_url):
+        """
+        Download an image to a temporary file, in chunks, and return the file
+        with the hash of its contents (as Image.file_hash, which Wagtail
+        computes with SHA-1 to find duplicate uploads)
+        """
+        response = self.get(image_url, allow_redirects=True, stream=True)
+        response.raise_for_status()
+        file = TemporaryFile()
+        file_hash = hashlib.sha1()
+        for chunk in response.iter_content(IMAGE_DOWNLOAD_CHUNK_SIZE):
+            file.write(chunk)
+            file_hash.update(chunk)
+        file.seek(0)
+        return file, file_hash.hexdigest()
+
+    def get_imported_images(self, image_ids):
+        """Images already imported for any page, by Facebook photo id"""
+        return dict(
+            DogPageGalleryImage.objects.filter(fb_image_id__in=image_ids).values_list("fb_image_id", "image_id")
         )
-        image.save()
+
+    def save_gallery_image(self, page, collection, image_id, file, file_hash):
+        # Photos reposted in other albums are downloaded again, but they're
+        # stored once. Only images imported by the sync are reused, so other
+        # images in the library are never added to (or moved with) galleries.
+        with file:
+            image = (
+                Image.objects.filter(
+                    file_hash=file_hash,
+                    id__in=DogPageGalleryImage.objects.filter(fb_image_id__isnull=False).values("image_id"),
+                )
+                .order_by("id")
+                .first()
+            )
+            if image is None:
+                photo_name = f"{page.slug}_{image_id}"
+                image = Image(
+                    title=photo_name,
+                    file=ImageFile(file, name=f"{photo_name}.jpg"),
+                    collection=collection,
+                    file_hash=file_hash,
+                )
+                image.save()
         DogPageGalleryImage.objects.create(page=page, image=image, fb_image_id=image_id)
 
+    def create_gallery_image(self, page, collection, image_id, image_url):
+        imported_image_id = self.get_imported_images([image_id]).get(image_id)
+        if imported_image_id:
+            DogPageGalleryImage.objects.create(page=page, image_id=imported_image_id, fb_image_id=image_id)
+        else:
+            try:
+                download = self.download_image(image_url)
+            except HTTPError as e:
+                logger.warning("Could not download image %s: %s", image_id, e)
+                return
+            self.save_gallery_image(page, collection, image_id, *download)
+
     def get_collection(self, page, album_id):
         collection_name = f"{page.slug}_{album_id}"
         try:
@@ -512,14 +749,11 @@ class FacebookAlbumTracker:
 
         del album_metadata["id"]
 
-        album_metadata["images"] = []
-        for photo in self.get_album_images(album_id):
-            images = photo.pop("images")
-            photo["image_url"] = images[0]["source"]
-            album_metadata["images"].append(photo)
-
-            if page and (photo["id"] not in page_image_ids):
-                self.create_gallery_image(page, collection, photo["id"], photo["image_url"])
+        album_metadata["images"] = self.get_album_photos(album_id)
+        if page:
+            for photo in album_metadata["images"]:
+                if photo["id"] not in page_image_ids:
+                    self.create_gallery_image(page, collection, photo["id"], photo["image_url"])
 
         album_metadata["last_fetched"] = timezone.now().isoformat()
         return album_metadata
@@ -551,13 +785,103 @@ class FacebookAlbumTracker:
             sleep(5)
     
         assert total > 0, "Error fetching albums"
+        pages = {
+            page.facebook_album_id: page
+            for page in DogPage.objects.filter(
+                facebook_album_id__in=[album_metadata["id"] for album_metadata in all_current_albums]
+            )
+        }
+        checkpoint = self.albums_obj.sync_progress
+        updated_times = self.albums_obj.updated_times()
         albums_data = {}
-        for i, album_metadata in enumerate(all_current_albums, start=1):
+        unchanged = []
+        to_fetch = {}
+        for album_metadata in all_current_albums:
             album_id = album_metadata["id"]
-            logger.info("Fetching album %d of %d (%s)", i, total, album_id)
-            album_data = self.get_album_data(album_id, force_update=force_update)
-            if album_data is not None:
-                albums_data[album_id] = album_data
+            updated_time = album_metadata.get("updated_time")
+            if checkpoint.get(album_id, {}).get("updated_time") == updated_time:
+                # Fetched by an earlier sync that didn't finish
+                albums_data[album_id] = checkpoint[album_id]
+            elif not force_update and album_id in pages and updated_times.get(album_id) == updated_time:
+                unchanged.append(album_id)
+            elif album_id in settings.FB_ALBUM_IDS_TO_IGNORE:
+                logger.info("Ignoring album '%s'", album_metadata["name"])
+            else:
+                to_fetch[album_id] = album_metadata
+
+        albums_data.update(self.albums_obj.get_albums(unchanged))
+        logger.info("Fetching %d of %d albums", len(to_fetch), total)
+        albums_data.update(self.fetch_albums(to_fetch, pages))
+        return albums_data
+
+    def fetch_albums(self, albums_metadata, pages):
+        """
+        Fetch the photos for albums ({album id: metadata from the albums list}),
+        and add new ones to the albums' pages.
+
+        Photo lists and image downloads are fetched by a pool of self.workers
+        threads; database changes are all made in this thread. Each album's
+        data is checkpointed once its images are saved. If the Graph API rate
+        limits the sync, it stops and raises FacebookRateLimited; running it
+        again resumes from the checkpoint.
+        """
+        albums_data = {}
+        new_images = {}
+        collections = {}
+        fetched = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fb-sync")
+        pending = {
+            executor.submit(self.get_album_photos, album_id): (album_id, None)
+            for album_id in albums_metadata
+        }
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    album_id, image_id = pending.pop(future)
+                    page = pages.get(album_id)
+                    if image_id is None:
+                        photos = future.result()
+                        album_data = {key: value for key, value in albums_metadata[album_id].items() if key != "id"}
+                        album_data["images"] = photos
+                        albums_data[album_id] = album_data
+                        new_images[album_id] = set()
+                        if page:
+                            collections[album_id] = self.get_collection(page, album_id)
+                            page_image_ids = set(page.gallery_images.values_list("fb_image_id", flat=True))
+                            photos = [photo for photo in photos if photo["id"] not in page_image_ids]
+                            # Photos imported for other pages are added without downloading them again
+                            imported = self.get_imported_images([photo["id"] for photo in photos])
+                            DogPageGalleryImage.objects.bulk_create([
+                                DogPageGalleryImage(page=page, image_id=imported[photo["id"]], fb_image_id=photo["id"])
+                                for photo in photos if photo["id"] in imported
+                            ])
+                            for photo in photos:
+                                if photo["id"] not in imported:
+                                    new_images[album_id].add(photo["id"])
+                                    download = executor.submit(self.download_image, photo["image_url"])
+                                    pending[download] = (album_id, photo["id"])
+                    else:
+                        try:
+                            download = future.result()
+                        except HTTPError as e:
+                            # Left out until the album is fetched again
+                            logger.warning("Could not download image %s for album %s: %s", image_id, album_id, e)
+                        else:
+                            self.save_gallery_image(page, collections[album_id], image_id, *download)
+                        new_images[album_id].discard(image_id)
+
+                    if not new_images[album_id]:
+                        albums_data[album_id]["last_fetched"] = timezone.now().isoformat()
+                        self.albums_obj.checkpoint_album(album_id, albums_data[album_id])
+                        fetched += 1
+                        logger.info("Album %s fetched (%d of %d)", album_id, fetched, len(albums_metadata))
+        except FacebookRateLimited as e:
+            logger.error("Rate limited after fetching %d of %d albums: %s", fetched, len(albums_metadata), e)
+            self.albums_obj.set_rate_limit()
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
         return albums_data
 
     def update_all(self, new_data=None, force_update=False):
@@ -645,6 +969,9 @@ class FacebookAlbumTracker:
             dog_page = DogPage(title=dog_name, location="Spain", facebook_album_id=album_id)
             new_pages[album_id] = {"facebook_album_name": album_name, "page_title": dog_name}
             parent_page.add_child(instance=dog_page)
+        if new_pages:
+            # add_child() doesn't send page_published
+            invalidate_menu()
         return new_pages
 
     def apply_title_routing(self, changed_titles):
@@ -698,26 +1025,21 @@ class FacebookAlbumTracker:
             self.create_or_update_album(album_id, force_update=force_update)
 
     def report_changes(self, new_data):
-        baseline = self.albums_obj.reporting_baseline
-        changes = {"added": {}, "removed": {}, "changed": {}}
-        if new_data != baseline:
-            new_albums = set(new_data) - set(baseline)
-            removed_albums = set(baseline) - set(new_data)
-            changes["added"] = {
-                album_id: new_data[album_id]["name"] for album_id in new_albums
-            }
-            changes["removed"] = {
-                album_id: baseline[album_id]["name"] for album_id in removed_albums
-            }
-            same_albums = set(new_data) & set(baseline)
+        baseline = self.albums_obj.acknowledged_names()
+        new_albums = set(new_data) - set(baseline)
+        removed_albums = set(baseline) - set(new_data)
+        same_albums = set(new_data) & set(baseline)
+        return {
+            "added": {album_id: new_data[album_id]["name"] for album_id in new_albums},
+            "removed": {album_id: baseline[album_id] for album_id in removed_albums},
             # Only title changes are reported; description and image updates
             # are applied automatically without requiring manual action.
-            changes["changed"] = {
-                album_id: f"{new_data[album_id]['name']} (previously {baseline[album_id]['name']})"
+            "changed": {
+                album_id: f"{new_data[album_id]['name']} (previously {baseline[album_id]})"
                 for album_id in same_albums
-                if new_data[album_id]["name"] != baseline[album_id]["name"]
-            }
-        return changes
+                if new_data[album_id]["name"] != baseline[album_id]
+            },
+        }
 
 
 class DogPageGalleryImage(Orderable):
@@ -725,7 +1047,7 @@ class DogPageGalleryImage(Orderable):
     Related images for DogPage; hidden on admin
     """
     page = ParentalKey("DogPage", on_delete=models.CASCADE, related_name='gallery_images')
-    fb_image_id = models.CharField(null=True, blank=True, max_length=255)
+    fb_image_id = models.CharField(null=True, blank=True, max_length=255, db_index=True)
     image = models.ForeignKey(
         'wagtailimages.Image', on_delete=models.CASCADE, related_name='+'
     )
@@ -870,6 +1192,12 @@ class DogPage(Page):
         try:
             logger.info("Checking fb info for album id %s, dog %s", self.facebook_album_id, self.title)
             self.update_facebook_info(new=_is_new)
+            # Generate renditions of any new images now, rather than on their
+            # first view
+            transaction.on_commit(partial(warm_page_renditions_in_background, [self.id]))
+        except FacebookRateLimited as e:
+            logger.error(e)
+            FacebookAlbums.instance().set_rate_limit()
         except GraphAPIError as e:
             logger.error(e)
             if "Unsupported get request" in str(e):
@@ -882,4 +1210,23 @@ class DogPage(Page):
 def delete_page_collection(sender, instance, using, **kwargs):
     album_tracker = FacebookAlbumTracker()
     collection = album_tracker.get_collection(instance, instance.facebook_album_id)
+    # Images are shared by pages with the same photos; move any that other
+    # pages still use to one of their collections, so they aren't deleted
+    shared_gallery_images = DogPageGalleryImage.objects.filter(
+        image__collection=collection
+    ).exclude(page=instance).select_related("page")
+    for gallery_image in shared_gallery_images:
+        Image.objects.filter(id=gallery_image.image_id, collection=collection).update(
+            collection=album_tracker.get_collection(gallery_image.page, gallery_image.page.facebook_album_id)
+        )
     collection.delete()
+
+
+@receiver(page_published, dispatch_uid="page_publish_menu")
+@receiver(page_unpublished, dispatch_uid="page_unpublish_menu")
+@receiver(post_page_move, dispatch_uid="page_move_menu")
+@receiver(post_delete, sender=Page, dispatch_uid="page_delete_menu")
+@receiver(post_save, sender=Site, dispatch_uid="site_save_menu")
+@receiver(post_delete, sender=Site, dispatch_uid="site_delete_menu")
+def invalidate_menu_on_page_change(sender, **kwargs):
+    invalidate_menu()
@@ -0,0 +1,106 @@
+"""
+The site's navigation menu and breadcrumbs, built from the page tree and
+cached until pages are published, unpublished, moved or deleted (or for
+MENU_TIMEOUT, in case a page changes without sending one of those signals).
+
+Cached items are plain objects holding just what the templates need (title,
+url and url_path), with urls built for the site, so a warm cache renders the
+header without any queries.
+"""
+from wagtail.models import Page
+
+from common.cache import bump_version, get_or_build, get_version
+
+
+MENU_VERSION = "site_menu"
+# Levels of in-menu pages below the root: top menu items, their dropdown items,
+# and enough below those to know whether a dropdown item has children itself
+MENU_DEPTH = 3
+# Seconds that the menu and breadcrumbs are cached for
+MENU_TIMEOUT = 60 * 60
+
+
+class MenuItem:
+
+    def __init__(self, page, site):
+        self.id = page.id
+        self.title = page.title
+        self.url_path = page.url_path
+        self.url = page.get_url(current_site=site)
+        self.children = []
+
+    def __str__(self):
+        return self.title
+
+    @property
+    def has_children(self):
+        return bool(self.children)
+
+    def is_active(self, calling_page):
+        # We don't directly check if calling_page is None since the template
+        # engine can pass an empty string to calling_page
+        # if the variable passed as calling_page does not exist.
+        return calling_page.url_path.startswith(self.url_path) if calling_page else False
+
+
+def build_menu(root_page, site):
+    """
+    Returns MenuItems for the live, in-menu children of root_page, each with
+    its live, in-menu children, loaded in one query
+    """
+    pages = (
+        Page.objects.descendant_of(root_page)
+        .live()
+        .in_menu()
+        .filter(depth__lte=root_page.depth + MENU_DEPTH)
+        .only("id", "title", "slug", "path", "depth", "url_path")
+        .order_by("path")
+    )
+    root = MenuItem(root_page, site)
+    items_by_path = {root_page.path: root}
+    for page in pages:
+        parent = items_by_path.get(page.path[:-Page.steplen])
+        # Pages under a page that isn't in the menu aren't shown
+        if parent is not None:
+            item = MenuItem(page, site)
+            parent.children.append(item)
+            items_by_path[page.path] = item
+    return root.children
+
+
+def get_menu(site, root_page=None):
+    """The cached menu for the site (or for root_page, if given)"""
+    if site is None and root_page is None:
+        # No site matches the request
+        return []
+    root_page_id = root_page.id if root_page else site.root_page_id
+    site_id = site.id if site else None
+    key = f"site_menu:{site_id}:{root_page_id}:{get_version(MENU_VERSION)}"
+    return get_or_build(
+        key, lambda: build_menu(root_page or Page.objects.get(id=root_page_id), site), MENU_TIMEOUT, local=True
+    )
+
+
+def get_breadcrumbs(page, site):
+    """
+    Cached MenuItems for the page's ancestors (below the tree root) and the
+    page itself
+    """
+    def ancestors():
+        return [
+            MenuItem(ancestor, site)
+            for ancestor in Page.objects.ancestor_of(page, inclusive=True)
+            .filter(depth__gt=1)
+            .only("id", "title", "slug", "path", "depth", "url_path")
+        ]
+
+    if page.id is None:
+        # e.g. a preview of a new page
+        return ancestors()
+    site_id = site.id if site else None
+    key = f"breadcrumbs:{site_id}:{page.id}:{get_version(MENU_VERSION)}"
+    return get_or_build(key, ancestors, MENU_TIMEOUT, local=True)
+
+
+def invalidate_menu():
+    bump_version(MENU_VERSION)
@@ -0,0 +1,115 @@
+"""
+Renditions of dog page images, generated ahead of time so that page requests
+don't have to resize large Facebook images on first view.
+
+The filter specs match the ones the templates use: gallery images are shown
+as "original" renditions (dogs/dog_page.html), and each page's cover image on
+listing cards (includes/card/listing-card.html) and in the page's hero
+(dogs/includes/header-hero.html), which is square for portrait images. Pages
+without a cover image (e.g. dog status pages) show their header image in the
+hero instead.
+
+Missing renditions are generated by a pool of settings.RENDITION_WORKERS
+processes, as resizing is CPU bound.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import threading
+
+import django
+from django.conf import settings
+from django.core.cache import close_caches
+from django.db import connection, connections
+from wagtail.images.models import Filter, Image, SourceImageIOError
+
+
+logger = logging.getLogger(__name__)
+
+GALLERY_IMAGE_FILTERS = ("original",)
+CARD_IMAGE_FILTER = "fill-180x180-c100"
+HERO_IMAGE_FILTER = "fill-1920x600"
+PORTRAIT_HERO_IMAGE_FILTER = "fill-600x600"
+
+
+def get_cover_image_filters(image):
+    hero_filter = PORTRAIT_HERO_IMAGE_FILTER if image.height > image.width else HERO_IMAGE_FILTER
+    return (CARD_IMAGE_FILTER, hero_filter)
+
+
+def get_page_image_filters(pages):
+    """{image id: filter specs} for the images shown on the pages"""
+    image_filters = {}
+    for page in pages:
+        if hasattr(page, "gallery_images"):
+            for image_id in page.gallery_images.values_list("image_id", flat=True):
+                image_filters.setdefault(image_id, set()).update(GALLERY_IMAGE_FILTERS)
+        cover_image = page.cover_image() if hasattr(page, "cover_image") else None
+        if cover_image:
+            image_filters.setdefault(cover_image.id, set()).update(get_cover_image_filters(cover_image))
+        elif getattr(page, "image_id", None):
+            image_filters.setdefault(page.image_id, set()).add(HERO_IMAGE_FILTER)
+    return image_filters
+
+
+def get_missing_renditions(image_filters):
+    """{image id: filter specs} for the renditions that don't exist yet"""
+    all_filter_specs = set().union(*image_filters.values()) if image_filters else set()
+    missing = {}
+    images = Image.objects.filter(id__in=image_filters).prefetch_renditions(*all_filter_specs)
+    for image in images:
+        filters = [Filter(spec=spec) for spec in sorted(image_filters[image.id])]
+        existing = image.find_existing_renditions(*filters)
+        missing_specs = [filter.spec for filter in filters if filter not in existing]
+        if missing_specs:
+            missing[image.id] = missing_specs
+    return missing
+
+
+def generate_renditions(image_id, filter_specs):
+    """Returns the number of renditions generated"""
+    try:
+        image = Image.objects.get(id=image_id)
+        image.get_renditions(*filter_specs)
+    except (Image.DoesNotExist, SourceImageIOError) as e:
+        logger.warning("Could not generate renditions for image %s: %s", image_id, e)
+        return 0
+    return len(filter_specs)
+
+
+def warm_renditions(image_filters, workers=None):
+    """
+    Generate any missing renditions for {image id: filter specs}. Returns the
+    number generated.
+    """
+    missing = get_missing_renditions(image_filters)
+    if not missing:
+        return 0
+    workers = settings.RENDITION_WORKERS if workers is None else workers
+    if workers <= 1:
+        return sum(generate_renditions(image_id, specs) for image_id, specs in missing.items())
+
+    # Worker processes open their own database and cache connections; don't
+    # share ours (e.g. pooled memcached sockets, used by the renditions cache)
+    connections.close_all()
+    close_caches()
+    with ProcessPoolExecutor(max_workers=min(workers, len(missing)), initializer=django.setup) as executor:
+        return sum(executor.map(generate_renditions, missing.keys(), missing.values()))
+
+
+def warm_page_renditions(pages, workers=None):
+    return warm_renditions(get_page_image_filters(pages), workers=workers)
+
+
+def warm_page_renditions_in_background(page_ids):
+    """Generate renditions for the pages' images in a thread in this process"""
+    from wagtail.models import Page
+
+    def warm():
+        try:
+            warm_page_renditions(Page.objects.filter(id__in=page_ids).specific(), workers=0)
+        except Exception:
+            logger.exception("Could not generate renditions for pages %s", page_ids)
+        finally:
+            connection.close()
+
+    threading.Thread(target=warm, name="warm-renditions", daemon=True).start()
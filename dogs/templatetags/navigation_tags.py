@@ -1,6 +1,7 @@
 from django import template
-from wagtail.models import Page, Site
+from wagtail.models import Site
 
+from dogs.navigation import get_breadcrumbs, get_menu
 from home.models import FooterText
 
 register = template.Library()
@@ -15,13 +16,6 @@ def get_site_root(context):
     return Site.find_for_request(context["request"]).root_page
 
 
-def has_menu_children(page):
-    # This is used by the top_menu property
-    # get_children is a Treebeard API thing
-    # https://tabo.pe/projects/django-treebeard/docs/4.0.1/api.html
-    return page.get_children().live().in_menu().exists()
-
-
 def has_children(page):
     # Generically allow index pages to list their children
     return page.get_children().live().exists()
@@ -33,49 +27,33 @@ def is_active(page, current_page):
 
 
 # Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the Foundation menu requires
-# a dropdown class to be applied to a parent
+# (the site root by default), from the cached menu tree.
+# show_dropdown is needed because the Foundation menu requires a dropdown
+# class to be applied to a parent
 @register.inclusion_tag("tags/top_menu.html", takes_context=True)
-def top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
+def top_menu(context, parent=None, calling_page=None):
+    request = context["request"]
+    menuitems = get_menu(Site.find_for_request(request), root_page=parent)
     for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (
-            calling_page.url_path.startswith(menuitem.url_path)
-            if calling_page
-            else False
-        )
+        menuitem.show_dropdown = menuitem.has_children
+        menuitem.active = menuitem.is_active(calling_page)
     return {
         "calling_page": calling_page,
         "menuitems": menuitems,
-        # required by the pageurl tag that we want to use within this template
-        "request": context["request"],
+        "request": request,
     }
 
 
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag("tags/top_menu_children.html", takes_context=True)
 def top_menu_children(context, parent, calling_page=None):
-    menuitems_children = parent.get_children()
-    menuitems_children = menuitems_children.live().in_menu()
+    menuitems_children = parent.children
     for menuitem in menuitems_children:
-        menuitem.has_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (
-            calling_page.url_path.startswith(menuitem.url_path)
-            if calling_page
-            else False
-        )
-        menuitem.children = menuitem.get_children().live().in_menu()
+        menuitem.has_dropdown = menuitem.has_children
+        menuitem.active = menuitem.is_active(calling_page)
     return {
         "parent": parent,
         "menuitems_children": menuitems_children,
-        # required by the pageurl tag that we want to use within this template
         "request": context["request"],
     }
 
@@ -87,7 +65,7 @@ def breadcrumbs(context):
         # When on the home page, displaying breadcrumbs is irrelevant.
         ancestors = ()
     else:
-        ancestors = Page.objects.ancestor_of(self, inclusive=True).filter(depth__gt=1)
+        ancestors = get_breadcrumbs(self, Site.find_for_request(context["request"]))
     return {
         "ancestors": ancestors,
         "request": context["request"],
@@ -103,8 +81,7 @@ def get_footer_text(context):
 
     # If the context doesn't have footer_text defined, get one that's live
     if not footer_text:
-        instances = FooterText.objects.filter(live=True)
-        footer_text = instances.latest("id").body if instances.exists() else ""
+        footer_text = FooterText.live_body()
 
     return {
         "footer_text": footer_text,
@@ -1,22 +1,36 @@
+import copy
+import hashlib
+import threading
 from datetime import timedelta
-from unittest.mock import patch
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+from PIL import Image as PILImage
+from requests import HTTPError
 
 import pytest
 from django.utils import timezone
 
 import wagtail_factories
+from wagtail.images.models import Image
 
+from common.cache import get_version
+from dogs.facebook_http import get_session
 from dogs.models import (
     DogsIndexPage,
     DogStatusPage,
     DogPage,
+    FacebookAlbum,
     FacebookAlbums,
     FacebookAlbumTracker,
+    FacebookRateLimited,
     FacebookTokenManager,
+    HostRateLimiter,
     FOSTER_RE,
     HAPPILY_HOMED_RE,
     get_target_status_title,
 )
+from dogs.navigation import MENU_VERSION
 
 
 pytestmark = pytest.mark.django_db
@@ -79,6 +93,12 @@ def albums_obj():
     return FacebookAlbums.instance()
 
 
+def set_acknowledged_names(names):
+    """Set albums' names at the last acknowledgement ({album id: name})"""
+    for album_id, name in names.items():
+        FacebookAlbum.objects.update_or_create(album_id=album_id, defaults={"acknowledged_name": name})
+
+
 # ---------------------------------------------------------------------------
 # FacebookAlbums.instance() singleton
 # ---------------------------------------------------------------------------
@@ -128,31 +148,47 @@ class TestFacebookAlbumsRateLimit:
 
 
 # ---------------------------------------------------------------------------
-# FacebookAlbums reporting_baseline / acknowledge
+# FacebookAlbums acknowledged names / acknowledge
 # ---------------------------------------------------------------------------
 
-class TestFacebookAlbumsReportingBaseline:
-    def test_reporting_baseline_starts_empty(self, albums_obj):
-        assert albums_obj.reporting_baseline == {}
+class TestFacebookAlbumsAcknowledgedNames:
+    def test_acknowledged_names_start_empty(self, albums_obj):
+        assert albums_obj.acknowledged_names() == {}
 
     def test_update_all_does_not_advance_baseline(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
-        albums_obj.refresh_from_db()
-        assert albums_obj.reporting_baseline == {}
+        assert albums_obj.acknowledged_names() == {}
 
     def test_acknowledge_sets_baseline_to_current_albums(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
         albums_obj.acknowledge()
-        albums_obj.refresh_from_db()
-        assert albums_obj.reporting_baseline == {"1": {"name": "dog 1"}}
+        assert albums_obj.acknowledged_names() == {"1": "dog 1"}
 
     def test_acknowledge_after_further_update(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
         albums_obj.acknowledge()
         albums_obj.update_all({"1": {"name": "dog 1 updated"}})
         albums_obj.acknowledge()
-        albums_obj.refresh_from_db()
-        assert albums_obj.reporting_baseline == {"1": {"name": "dog 1 updated"}}
+        assert albums_obj.acknowledged_names() == {"1": "dog 1 updated"}
+
+    def test_acknowledge_removes_removed_albums(self, albums_obj):
+        albums_obj.update_all({"1": {"name": "dog 1"}, "2": {"name": "dog 2"}})
+        albums_obj.acknowledge()
+        albums_obj.update_all({"1": {"name": "dog 1"}})
+        assert albums_obj.pending_changes()["removed"] == {"2": "dog 2"}
+        albums_obj.acknowledge()
+        assert albums_obj.acknowledged_names() == {"1": "dog 1"}
+        assert list(FacebookAlbum.objects.values_list("album_id", flat=True)) == ["1"]
+
+
+    def test_update_all_only_writes_changed_albums(self, albums_obj):
+        albums_obj.update_all({"1": {"name": "dog 1"}, "2": {"name": "dog 2"}})
+        # Unchanged albums are matched by fingerprint, so aren't written again
+        FacebookAlbum.objects.update(data={"name": "not rewritten"})
+        albums_obj.update_all({"1": {"name": "dog 1"}, "2": {"name": "dog 2a"}, "3": {"name": "dog 3"}})
+        assert albums_obj.albums == {
+            "1": {"name": "not rewritten"}, "2": {"name": "dog 2a"}, "3": {"name": "dog 3"}
+        }
 
 
 # ---------------------------------------------------------------------------
@@ -191,35 +227,31 @@ class TestFacebookAlbumsPendingChanges:
 
     def test_detects_added(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}, "2": {"name": "dog 2"}})
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "dog 1"})
         changes = albums_obj.pending_changes()
         assert "2" in changes["added"]
 
     def test_detects_removed(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}, "2": {"name": "dog 2"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "dog 1", "2": "dog 2"})
         changes = albums_obj.pending_changes()
         assert "2" in changes["removed"]
 
     def test_detects_changed_title(self, albums_obj):
         albums_obj.update_all({"1": {"name": "Bella - happily homed"}})
-        albums_obj.reporting_baseline = {"1": {"name": "Bella - in Spain"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "Bella - in Spain"})
         changes = albums_obj.pending_changes()
         assert "1" in changes["changed"]
 
 
 # ---------------------------------------------------------------------------
-# FacebookAlbumTracker.report_changes (diffs against reporting_baseline)
+# FacebookAlbumTracker.report_changes (diffs against acknowledged names)
 # ---------------------------------------------------------------------------
 
 class TestReportChanges:
-    def test_diffs_against_reporting_baseline_not_albums(self, albums_obj):
-        albums_obj.albums = {"1": {"name": "dog 1"}, "2": {"name": "dog 2"}}
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}}
-        albums_obj.save()
+    def test_diffs_against_acknowledged_names_not_albums(self, albums_obj):
+        albums_obj.update_all({"1": {"name": "dog 1"}, "2": {"name": "dog 2"}})
+        set_acknowledged_names({"1": "dog 1"})
 
         tracker = FacebookAlbumTracker()
         changes = tracker.report_changes({"1": {"name": "dog 1"}, "2": {"name": "dog 2"}})
@@ -233,15 +265,13 @@ class TestReportChanges:
         assert changes["changed"] == {}
 
     def test_detects_removed(self, albums_obj):
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "dog 1"})
         tracker = FacebookAlbumTracker()
         changes = tracker.report_changes({})
         assert changes["removed"] == {"1": "dog 1"}
 
     def test_detects_changed_title(self, albums_obj):
-        albums_obj.reporting_baseline = {"1": {"name": "Bella - in Spain"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "Bella - in Spain"})
         tracker = FacebookAlbumTracker()
         changes = tracker.report_changes({"1": {"name": "Bella - happily homed"}})
         assert "1" in changes["changed"]
@@ -249,8 +279,7 @@ class TestReportChanges:
         assert "Bella - in Spain" in changes["changed"]["1"]
 
     def test_no_changes_returns_empty(self, albums_obj):
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "dog 1"})
         tracker = FacebookAlbumTracker()
         changes = tracker.report_changes({"1": {"name": "dog 1"}})
         assert not any(changes.values())
@@ -263,8 +292,7 @@ class TestReportChanges:
 class TestUpdateAllBaselineAdvance:
     def test_auto_advances_baseline_when_no_changes(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
-        albums_obj.reporting_baseline = {"1": {"name": "dog 1"}}
-        albums_obj.save()
+        set_acknowledged_names({"1": "dog 1"})
 
         tracker = FacebookAlbumTracker()
         with patch.object(tracker, 'fetch_all', return_value={"1": {"name": "dog 1"}}):
@@ -275,12 +303,10 @@ class TestUpdateAllBaselineAdvance:
 
         albums_obj.refresh_from_db()
         # baseline should now equal albums (auto-advanced)
-        assert albums_obj.reporting_baseline == albums_obj.albums
+        assert albums_obj.acknowledged_names() == {"1": "dog 1"}
 
     def test_does_not_advance_baseline_when_changes_exist(self, albums_obj):
         albums_obj.update_all({"1": {"name": "dog 1"}})
-        albums_obj.reporting_baseline = {}
-        albums_obj.save()
 
         tracker = FacebookAlbumTracker()
         new_data = {"1": {"name": "dog 1"}, "2": {"name": "dog 2"}}
@@ -292,8 +318,7 @@ class TestUpdateAllBaselineAdvance:
                     with patch.object(tracker, 'apply_title_routing', return_value={}):
                         tracker.update_all()
 
-        albums_obj.refresh_from_db()
-        assert albums_obj.reporting_baseline == {}
+        assert albums_obj.acknowledged_names() == {}
 
 
 # ---------------------------------------------------------------------------
@@ -531,6 +556,11 @@ class TestCreateNewPagesRouting:
         assert result["album1"]["facebook_album_name"] == "Bella - in Spain, needs offer"
         assert result["album1"]["page_title"] == "Bella"
 
+    def test_invalidates_menu(self, status_pages):
+        version = get_version(MENU_VERSION)
+        FacebookAlbumTracker().create_new_pages({"album1": "Bella - in Spain, needs offer"})
+        assert get_version(MENU_VERSION) != version
+
 
 # ---------------------------------------------------------------------------
 # FacebookAlbumTracker.apply_title_routing
@@ -586,6 +616,195 @@ class TestApplyTitleRouting:
         assert tracker.apply_title_routing({}) == {}
 
 
+# ---------------------------------------------------------------------------
+# FacebookAlbumTracker.fetch_all — concurrent photo and image fetching
+# ---------------------------------------------------------------------------
+
+def jpeg_bytes(color=(0, 0, 0)):
+    buffer = BytesIO()
+    PILImage.new("RGB", (4, 4), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class TestFetchAll:
+
+    ALBUMS = [
+        {"id": "album1", "name": "Bella - in Spain", "updated_time": "2024-02-01T00:00:00"},
+        {"id": "album2", "name": "Rex - in Spain", "updated_time": "2024-02-01T00:00:00"},
+        {"id": "album3", "name": "Luna - in Spain", "updated_time": "2024-01-01T00:00:00"},
+    ]
+    PHOTOS = {
+        "album1": [{"id": "p1"}, {"id": "p2"}, {"id": "p3"}],
+        "album2": [{"id": "p4"}],
+        "album3": [],
+    }
+
+    @pytest.fixture
+    def tracker(self, albums_obj, needs_offer_page, settings):
+        settings.FB_SYNC_REQUESTS_PER_SECOND = 0
+        with patch.object(DogPage, "update_facebook_info"):
+            self.page = DogPageFactory(parent=needs_offer_page, slug="bella", facebook_album_id="album1")
+            DogPageFactory(parent=needs_offer_page, slug="luna", facebook_album_id="album3")
+        albums_obj.update_album("album3", {"name": "Luna - in Spain", "updated_time": "2024-01-01T00:00:00"})
+        tracker = FacebookAlbumTracker(workers=3)
+        tracker._api = MagicMock(access_token="token")
+        tracker._api.get_all_connections.side_effect = lambda **kwargs: iter(copy.deepcopy(self.ALBUMS))
+        return tracker
+
+    def fake_get(self, rate_limit_album=None, rate_limit_after=None, images=None, missing=()):
+        # Each image url gets different content, unless given in images
+        images = images or {}
+
+        def get(url, **kwargs):
+            resp = MagicMock()
+            if url.startswith("https://graph.facebook.com/"):
+                album_id = url.split("/")[4]
+                if album_id == rate_limit_album:
+                    if rate_limit_after:
+                        rate_limit_after.wait(5)
+                    resp.json.return_value = {"error": {"message": "User request limit reached"}}
+                else:
+                    photos = self.PHOTOS[album_id]
+                    resp.json.return_value = {
+                        "data": [
+                            {"id": photo["id"], "images": [{"source": f"https://img.test/{photo['id']}.jpg"}]}
+                            for photo in photos
+                        ]
+                    }
+            elif url in missing:
+                resp.raise_for_status.side_effect = HTTPError("404 Client Error: Not Found")
+            else:
+                image = images.get(url) or jpeg_bytes(tuple(hashlib.md5(url.encode()).digest()[:3]))
+                resp.iter_content.return_value = [image]
+            return resp
+
+        return get
+
+    def test_fetches_changed_albums_and_new_images(self, tracker, albums_obj):
+        with patch.object(get_session(), "get", side_effect=self.fake_get()) as mock_get:
+            data = tracker.fetch_all()
+
+        assert set(data) == {"album1", "album2", "album3"}
+        assert [photo["image_url"] for photo in data["album1"]["images"]] == [
+            "https://img.test/p1.jpg", "https://img.test/p2.jpg", "https://img.test/p3.jpg"
+        ]
+        assert "last_fetched" in data["album1"]
+        assert "id" not in data["album1"]
+        # album3 is unchanged, so not fetched; album2 has no page, so no images
+        requested = {call.args[0] for call in mock_get.call_args_list}
+        assert not any("album3" in url for url in requested)
+        assert {url for url in requested if url.startswith("https://img.test/")} == {
+            "https://img.test/p1.jpg", "https://img.test/p2.jpg", "https://img.test/p3.jpg"
+        }
+        assert set(self.page.gallery_images.values_list("fb_image_id", flat=True)) == {"p1", "p2", "p3"}
+
+        albums_obj.refresh_from_db()
+        assert set(albums_obj.sync_progress) == {"album1", "album2"}
+        with patch.object(DogPage, "update_facebook_info"):
+            tracker.update_all(new_data=data)
+        albums_obj.refresh_from_db()
+        assert albums_obj.sync_progress == {}
+
+    def test_only_new_images_downloaded(self, tracker):
+        with patch.object(get_session(), "get", side_effect=self.fake_get()):
+            tracker.fetch_all()
+        self.page.gallery_images.filter(fb_image_id="p2").delete()
+
+        with patch.object(get_session(), "get", side_effect=self.fake_get()) as mock_get:
+            tracker.fetch_all(force_update=True)
+        # albums fetched before were checkpointed, as the sync wasn't completed
+        assert [call.args[0].split("/")[4] for call in mock_get.call_args_list] == ["album3"]
+
+        FacebookAlbum.objects.update(sync_progress=None)
+        with patch.object(get_session(), "get", side_effect=self.fake_get()) as mock_get:
+            tracker.fetch_all(force_update=True)
+        images = [call.args[0] for call in mock_get.call_args_list if call.args[0].startswith("https://img.test/")]
+        assert images == ["https://img.test/p2.jpg"]
+
+    def test_rate_limited_sync_resumes(self, tracker, albums_obj):
+        # album2 is rate limited once album1 has been fetched
+        album1_fetched = threading.Event()
+        checkpoint_album = tracker.albums_obj.checkpoint_album
+
+        def checkpoint(album_id, album_data):
+            checkpoint_album(album_id, album_data)
+            album1_fetched.set()
+
+        tracker.albums_obj.checkpoint_album = checkpoint
+        fake_get = self.fake_get(rate_limit_album="album2", rate_limit_after=album1_fetched)
+        with patch.object(get_session(), "get", side_effect=fake_get):
+            with pytest.raises(FacebookRateLimited):
+                tracker.fetch_all()
+        albums_obj.refresh_from_db()
+        assert albums_obj.is_rate_limited
+        assert set(albums_obj.sync_progress) == {"album1"}
+
+        tracker = FacebookAlbumTracker()
+        tracker._api = MagicMock(access_token="token")
+        tracker._api.get_all_connections.side_effect = lambda **kwargs: iter(copy.deepcopy(self.ALBUMS))
+        with patch.object(get_session(), "get", side_effect=self.fake_get()) as mock_get:
+            data = tracker.fetch_all()
+        assert set(data) == {"album1", "album2", "album3"}
+        assert [call.args[0].split("/")[4] for call in mock_get.call_args_list] == ["album2"]
+
+    def test_identical_images_stored_once(self, tracker):
+        image = jpeg_bytes()
+        images = {"https://img.test/p1.jpg": image, "https://img.test/p3.jpg": image}
+        with patch.object(get_session(), "get", side_effect=self.fake_get(images=images)):
+            tracker.fetch_all()
+
+        image_ids = dict(self.page.gallery_images.values_list("fb_image_id", "image_id"))
+        assert image_ids["p1"] == image_ids["p3"] != image_ids["p2"]
+        assert Image.objects.get(id=image_ids["p1"]).file_hash == hashlib.sha1(image).hexdigest()
+
+    def test_library_images_not_reused(self, tracker):
+        image = jpeg_bytes()
+        library_image = wagtail_factories.ImageFactory(file_hash=hashlib.sha1(image).hexdigest())
+        with patch.object(get_session(), "get", side_effect=self.fake_get(images={"https://img.test/p1.jpg": image})):
+            tracker.fetch_all()
+        imported = self.page.gallery_images.get(fb_image_id="p1").image
+        assert imported != library_image
+        assert imported.collection.name == "bella_album1"
+
+    def test_failed_image_downloads_skipped(self, tracker, albums_obj):
+        fake_get = self.fake_get(missing={"https://img.test/p2.jpg"})
+        with patch.object(get_session(), "get", side_effect=fake_get):
+            tracker.fetch_all()
+        assert set(self.page.gallery_images.values_list("fb_image_id", flat=True)) == {"p1", "p3"}
+        albums_obj.refresh_from_db()
+        assert set(albums_obj.sync_progress) == {"album1", "album2"}
+
+    def test_photos_shared_between_pages(self, tracker):
+        with patch.object(get_session(), "get", side_effect=self.fake_get()):
+            tracker.fetch_all()
+
+        # p1 is added to Luna's album too; it isn't downloaded again
+        self.PHOTOS = {**self.PHOTOS, "album3": [{"id": "p1"}]}
+        with patch.object(get_session(), "get", side_effect=self.fake_get()) as mock_get:
+            tracker.fetch_all(force_update=True)
+        assert not any(call.args[0].startswith("https://img.test/") for call in mock_get.call_args_list)
+        luna = DogPage.objects.get(facebook_album_id="album3")
+        image = self.page.gallery_images.get(fb_image_id="p1").image
+        assert luna.gallery_images.get().image == image
+
+        # Deleting Bella's page keeps the image Luna's page uses
+        self.page.delete()
+        image.refresh_from_db()
+        assert image.collection.name == "luna_album3"
+        assert luna.gallery_images.get().image == image
+
+
+def test_host_rate_limiter(monkeypatch):
+    now = [100.0]
+    sleeps = []
+    monkeypatch.setattr("dogs.models.monotonic", lambda: now[0])
+    monkeypatch.setattr("dogs.models.sleep", sleeps.append)
+    limiter = HostRateLimiter(per_second=2)
+    for url in ["https://a.test/1", "https://a.test/2", "https://b.test/1", "https://a.test/3"]:
+        limiter.wait(url)
+    assert sleeps == [0.5, 1.0]
+
+
 # ---------------------------------------------------------------------------
 # DogPage.save() behaviour
 # ---------------------------------------------------------------------------
@@ -680,20 +899,20 @@ class TestFacebookTokenManager:
 
     def test_get_token_status_ok(self):
         future = (timezone.now() + timedelta(days=30)).timestamp()
-        with patch("dogs.models.requests.get") as mock_get:
+        with patch.object(get_session(), "get") as mock_get:
             mock_get.return_value.json.return_value = {"data": {"expires_at": future}}
             manager = FacebookTokenManager()
             assert manager.get_token_status("token") == "ok"
 
     def test_get_token_status_expires_soon(self):
         soon = (timezone.now() + timedelta(hours=12)).timestamp()
-        with patch("dogs.models.requests.get") as mock_get:
+        with patch.object(get_session(), "get") as mock_get:
             mock_get.return_value.json.return_value = {"data": {"expires_at": soon}}
             manager = FacebookTokenManager()
             assert manager.get_token_status("token") == "expires_soon"
 
     def test_get_token_status_expired(self):
-        with patch("dogs.models.requests.get") as mock_get:
+        with patch.object(get_session(), "get") as mock_get:
             mock_get.return_value.json.return_value = {
                 "error": {"message": "Session has expired at unix time 12345"}
             }
@@ -703,13 +922,13 @@ class TestFacebookTokenManager:
     def test_get_token_status_expired_by_timestamp(self):
         """A past expires_at should return 'expired' even without an API-level error."""
         past = (timezone.now() - timedelta(hours=1)).timestamp()
-        with patch("dogs.models.requests.get") as mock_get:
+        with patch.object(get_session(), "get") as mock_get:
             mock_get.return_value.json.return_value = {"data": {"expires_at": past}}
             manager = FacebookTokenManager()
             assert manager.get_token_status("token") == "expired"
 
     def test_get_token_status_rate_limited(self, albums_obj):
-        with patch("dogs.models.requests.get") as mock_get:
+        with patch.object(get_session(), "get") as mock_get:
             mock_get.return_value.json.return_value = {
                 "error": {"message": "Request limit reached"}
             }
@@ -0,0 +1,98 @@
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache, caches
+from requests import Response
+
+from dogs import facebook_http
+from dogs.facebook_http import conditional_cache_key, get, get_session
+
+
+pytestmark = pytest.mark.django_db
+
+
+def make_response(status_code=200, content=b"", headers=None):
+    response = Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+def test_session_retries_and_pools(settings):
+    adapter = get_session().get_adapter("https://graph.facebook.com/")
+    retry = adapter.max_retries
+    assert retry.total == settings.FB_HTTP_RETRIES
+    assert set(retry.status_forcelist) == {429, 500, 502, 503, 504}
+    assert retry.backoff_factor > 0
+    assert retry.respect_retry_after_header
+    assert not retry.raise_on_status
+    assert adapter._pool_maxsize >= settings.FB_SYNC_WORKERS
+    assert get_session() is get_session()
+
+
+def test_get_sets_default_timeout(settings):
+    with patch.object(get_session(), "get", return_value=make_response()) as mock_get:
+        get("https://graph.facebook.com/debug_token")
+        get("https://graph.facebook.com/debug_token", timeout=1)
+    assert mock_get.call_args_list[0].kwargs["timeout"] == settings.FB_HTTP_TIMEOUT
+    assert mock_get.call_args_list[1].kwargs["timeout"] == 1
+
+
+def test_conditional_get_revalidates_cached_response():
+    url = "https://graph.facebook.com/v18.0/album1/photos/?fields=images&access_token=token"
+    first = make_response(content=b'{"data": []}', headers={"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024"})
+    with patch.object(get_session(), "get", return_value=first) as mock_get:
+        assert get(url, conditional=True).json() == {"data": []}
+    assert "If-None-Match" not in mock_get.call_args.kwargs["headers"]
+
+    # The new token doesn't change the cache key
+    new_url = url.replace("access_token=token", "access_token=new_token")
+    with patch.object(get_session(), "get", return_value=make_response(304)) as mock_get:
+        response = get(new_url, conditional=True)
+    assert mock_get.call_args.kwargs["headers"] == {
+        "If-None-Match": '"abc"', "If-Modified-Since": "Mon, 01 Jan 2024"
+    }
+    assert response.from_cache
+    assert response.json() == {"data": []}
+
+    # Bodies are kept apart from the shared default cache
+    key = conditional_cache_key(url)
+    assert cache.get(key) is None
+    assert caches[facebook_http.CONDITIONAL_CACHE_ALIAS].get(key)["content"] == b'{"data": []}'
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        make_response(content=b"image"),
+        make_response(content=b"x" * (facebook_http.CONDITIONAL_MAX_BYTES + 1), headers={"ETag": '"abc"'}),
+        make_response(500, content=b"error", headers={"ETag": '"abc"'}),
+    ],
+    ids=["no-validators", "too-large", "error"],
+)
+def test_conditional_get_not_cached(response):
+    url = "https://img.test/p1.jpg"
+    with patch.object(get_session(), "get", return_value=response):
+        get(url, conditional=True)
+    with patch.object(get_session(), "get", return_value=make_response(content=b"image")) as mock_get:
+        get(url, conditional=True)
+    assert mock_get.call_args.kwargs["headers"] == {}
+
+
+def test_conditional_cache_key_ignores_access_token():
+    assert conditional_cache_key("https://a.test/1?fields=images&access_token=a") == conditional_cache_key(
+        "https://a.test/1?fields=images&access_token=b"
+    )
+    assert conditional_cache_key("https://a.test/1?after=x") != conditional_cache_key("https://a.test/1?after=y")
+
+
+def test_streamed_get_not_cached():
+    url = "https://img.test/p1.jpg"
+    response = make_response(content=b"image", headers={"ETag": '"abc"', "Content-Length": "5"})
+    with patch.object(get_session(), "get", return_value=response):
+        get(url, conditional=True, stream=True)
+    assert caches[facebook_http.CONDITIONAL_CACHE_ALIAS].get(conditional_cache_key(url)) is None
+    with patch.object(get_session(), "get", return_value=make_response(content=b"image")) as mock_get:
+        assert get(url, conditional=True, stream=True).content == b"image"
+    assert "headers" not in mock_get.call_args.kwargs
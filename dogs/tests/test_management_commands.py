@@ -4,7 +4,7 @@ from unittest.mock import MagicMock, patch
 import pytest
 from django.core.management import call_command
 
-from dogs.models import FacebookAlbums, FacebookAlbumTracker, FacebookTokenManager
+from dogs.models import FacebookAlbums, FacebookAlbumTracker, FacebookRateLimited, FacebookTokenManager
 
 
 pytestmark = pytest.mark.django_db
@@ -98,6 +98,14 @@ class TestSyncFacebookFullSync:
         assert "failed_to_delete" in output
         assert "album1" in output
 
+    def test_rate_limited_sync_reports_and_sends_no_email(self, albums_obj, mock_token_manager, mock_tracker):
+        mock_tracker.update_all.side_effect = FacebookRateLimited("User request limit reached")
+        err = StringIO()
+        with patch("dogs.management.commands.sync_facebook.send_mail") as mock_mail:
+            call_command("sync_facebook", "--email", stdout=StringIO(), stderr=err)
+        assert "Run again later to resume" in err.getvalue()
+        mock_mail.assert_not_called()
+
 
 # ---------------------------------------------------------------------------
 # Email sending
@@ -254,3 +262,23 @@ class TestSyncFacebookCheckMode:
         albums_obj.update_album("album1", {"name": "Bella"})
         output = run_sync(["--check"])
         assert "Needs Offer" in output
+
+
+# ---------------------------------------------------------------------------
+# Renditions
+# ---------------------------------------------------------------------------
+
+class TestWarmRenditions:
+
+    def test_full_sync_warms_renditions(self, albums_obj, mock_token_manager, mock_tracker):
+        mock_tracker.update_all.return_value = NO_CHANGE_RESULT.copy()
+        with patch("dogs.management.commands.sync_facebook.warm_page_renditions") as warm:
+            run_sync()
+        warm.assert_called_once()
+
+    def test_warm_renditions_command(self):
+        out = StringIO()
+        with patch("dogs.management.commands.warm_renditions.warm_page_renditions", return_value=3) as warm:
+            call_command("warm_renditions", "--workers", "2", stdout=out)
+        assert warm.call_args.kwargs == {"workers": 2}
+        assert "Generated 3 renditions" in out.getvalue()
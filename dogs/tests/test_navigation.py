@@ -0,0 +1,78 @@
+import pytest
+import wagtail_factories
+
+from django.template import Context, Template
+from wagtail.models import Site
+
+from dogs.navigation import get_breadcrumbs, get_menu
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def site(root_page):
+    return Site.objects.get(root_page=root_page)
+
+
+@pytest.fixture
+def menu_pages(root_page):
+    about = wagtail_factories.PageFactory(parent=root_page, title="About", slug="about", show_in_menus=True)
+    team = wagtail_factories.PageFactory(parent=about, title="Team", slug="team", show_in_menus=True)
+    wagtail_factories.PageFactory(parent=team, title="Trustees", slug="trustees", show_in_menus=True)
+    wagtail_factories.PageFactory(parent=about, title="Hidden", slug="hidden", show_in_menus=False)
+    wagtail_factories.PageFactory(parent=about, title="Draft", slug="draft", show_in_menus=True, live=False)
+    other = wagtail_factories.PageFactory(parent=root_page, title="Other", slug="other", show_in_menus=False)
+    # not shown, as its parent isn't in the menu
+    wagtail_factories.PageFactory(parent=other, title="Orphan", slug="orphan", show_in_menus=True)
+    wagtail_factories.PageFactory(parent=root_page, title="Adopt", slug="adopt", show_in_menus=True)
+    return {"about": about, "team": team}
+
+
+def test_get_menu(site, menu_pages, django_assert_num_queries):
+    menu = get_menu(site)
+    assert [(item.title, item.url) for item in menu] == [("About", "/about/"), ("Adopt", "/adopt/")]
+    assert [child.title for child in menu[0].children] == ["Team"]
+    assert menu[0].children[0].has_children
+    assert not menu[1].has_children
+
+    with django_assert_num_queries(0):
+        assert [item.title for item in get_menu(site)] == ["About", "Adopt"]
+
+
+def test_menu_invalidated_on_publish_and_move(site, root_page, menu_pages):
+    get_menu(site)
+
+    page = wagtail_factories.PageFactory(parent=root_page, title="News", slug="news", show_in_menus=True, live=False)
+    assert [item.title for item in get_menu(site)] == ["About", "Adopt"]
+    page.save_revision().publish()
+    assert [item.title for item in get_menu(site)] == ["About", "Adopt", "News"]
+
+    page.move(menu_pages["about"], pos="last-child")
+    assert [item.title for item in get_menu(site)] == ["About", "Adopt"]
+    assert [child.title for child in get_menu(site)[0].children] == ["Team", "News"]
+
+    page.unpublish()
+    assert [child.title for child in get_menu(site)[0].children] == ["Team"]
+
+
+def test_top_menu(rf, menu_pages, django_assert_num_queries):
+    request = rf.get("/", HTTP_HOST="localhost:8000", SERVER_PORT=8000)
+    template = Template("{% load navigation_tags %}{% top_menu calling_page=page %}")
+    context = Context({"request": request, "page": menu_pages["team"]})
+    html = template.render(context)
+    assert '<li class="presentation about active has-submenu">' in html
+    assert '<li class="presentation adopt">' in html
+    assert '<li><a href="/about/team/">Team</a></li>' in html
+
+    request = rf.get("/", HTTP_HOST="localhost:8000", SERVER_PORT=8000)
+    with django_assert_num_queries(1):
+        # only finding the site for the request
+        template.render(Context({"request": request, "page": menu_pages["team"]}))
+
+
+def test_breadcrumbs(site, menu_pages, django_assert_num_queries):
+    breadcrumbs = get_breadcrumbs(menu_pages["team"], site)
+    assert [(str(item), item.url) for item in breadcrumbs] == [("About", "/about/"), ("Team", "/about/team/")]
+    with django_assert_num_queries(0):
+        get_breadcrumbs(menu_pages["team"], site)
@@ -0,0 +1,81 @@
+from unittest.mock import patch
+
+import pytest
+import wagtail_factories
+
+from dogs.models import DogPage, DogPageGalleryImage
+from dogs.renditions import get_page_image_filters, warm_page_renditions, warm_renditions
+from dogs.tests.test_facebook import DogPageFactory, DogsIndexPageFactory, DogStatusPageFactory
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def dog_page(root_page):
+    status_page = DogStatusPageFactory(parent=DogsIndexPageFactory(parent=root_page), title="Needs Offer")
+    page = DogPageFactory(parent=status_page, slug="bella")
+    # Gallery images are ordered by fb_image_id, descending; the first is the cover
+    landscape = wagtail_factories.ImageFactory(file__width=60, file__height=40)
+    portrait = wagtail_factories.ImageFactory(file__width=40, file__height=60)
+    DogPageGalleryImage.objects.create(page=page, image=landscape, fb_image_id="1")
+    DogPageGalleryImage.objects.create(page=page, image=portrait, fb_image_id="2")
+    return page, landscape, portrait
+
+
+def test_page_image_filters(dog_page):
+    page, landscape, portrait = dog_page
+    assert get_page_image_filters([page]) == {
+        landscape.id: {"original"},
+        portrait.id: {"original", "fill-180x180-c100", "fill-600x600"},
+    }
+
+    page.cover_image_index = 1
+    assert get_page_image_filters([page])[landscape.id] == {"original", "fill-180x180-c100", "fill-1920x600"}
+
+    # pages without a cover image show their header image in the hero
+    status_page = page.get_parent().specific
+    status_page.image = landscape
+    assert get_page_image_filters([status_page]) == {landscape.id: {"fill-1920x600"}}
+
+
+def test_warm_page_renditions(dog_page):
+    page, landscape, portrait = dog_page
+    assert warm_page_renditions([page], workers=0) == 4
+    assert set(landscape.renditions.values_list("filter_spec", flat=True)) == {"original"}
+    assert set(portrait.renditions.values_list("filter_spec", flat=True)) == {
+        "original", "fill-180x180-c100", "fill-600x600"
+    }
+
+    # Only missing renditions are generated
+    assert warm_page_renditions([page], workers=0) == 0
+    portrait.renditions.filter(filter_spec="fill-600x600").delete()
+    assert warm_page_renditions([page], workers=0) == 1
+
+
+def test_page_save_warms_renditions(dog_page, django_capture_on_commit_callbacks):
+    page, _, _ = dog_page
+    page.facebook_album_id = "album1"
+    with patch.object(DogPage, "update_facebook_info"):
+        with patch("dogs.models.warm_page_renditions_in_background") as warm:
+            with django_capture_on_commit_callbacks(execute=True):
+                page.save()
+    warm.assert_called_once_with([page.id])
+
+
+def test_warm_renditions_closes_connections_before_forking(dog_page):
+    page, _, _ = dog_page
+    with patch("dogs.renditions.ProcessPoolExecutor") as executor, patch("dogs.renditions.close_caches") as close_caches:
+        executor.return_value.__enter__.return_value.map.return_value = [1, 3]
+        assert warm_renditions(get_page_image_filters([page]), workers=2) == 4
+    close_caches.assert_called_once()
+
+
+def test_status_page_save_warms_header_renditions(dog_page, django_capture_on_commit_callbacks):
+    page, landscape, _ = dog_page
+    status_page = page.get_parent().specific
+    status_page.image = landscape
+    with patch("dogs.models.warm_page_renditions_in_background") as warm:
+        with django_capture_on_commit_callbacks(execute=True):
+            status_page.save()
+    warm.assert_called_once_with([status_page.id])
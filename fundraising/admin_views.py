@@ -28,16 +28,37 @@ def auctions_index(request):
 
 def auction_detail(request, pk):
     auction = get_object_or_404(Auction, pk=pk)
-    object_list = auction.get_children().specific()
-
-    def _get_winning_bid(bid):
-        if bid.active_bids:
-            return f"£{bid.current_winning_bid()}"
+    # Closed auctions show their results, rather than the current bids
+    auction.close_out()
+    object_list = AuctionItem.objects.child_of(auction).select_related(
+        "category", "bid_summary__winning_bid__user", "result"
+    ).annotate_approved_schedule().prefetch_workflow_states().order_by("path")
+
+    def _get_bid_count(auction_item):
+        result = auction_item.get_result()
+        if result:
+            return result.bid_count
+        return auction_item.bid_count()
+
+    def _get_winning_bid(auction_item):
+        result = auction_item.get_result()
+        if result:
+            return f"£{result.amount}" if result.sold else "-"
+        if auction_item.get_bid_summary().winning_bid_id:
+            return f"£{auction_item.current_winning_bid()}"
         return "-"
+
+    def _get_winner(auction_item):
+        result = auction_item.get_result()
+        if result:
+            return result.winner_display()
+        return auction_item.winner()
     
     def _get_total_due(auction_item):
-        if auction_item.total_due():
-            return f"£{auction_item.total_due()}"
+        result = auction_item.get_result()
+        total_due = result.total_due if result else auction_item.total_due()
+        if total_due:
+            return f"£{total_due}"
         return "-"
     
     sort_by = request.GET.get("ordering")
@@ -55,9 +76,9 @@ def auction_detail(request, pk):
         case "-donor":
             object_list = sorted(object_list, key=lambda x: x.donor, reverse=True)
         case "winner":
-            object_list = sorted(object_list, key=lambda x: x.winner() or "")
+            object_list = sorted(object_list, key=lambda x: _get_winner(x) or "")
         case "-winner":
-            object_list = sorted(object_list, key=lambda x: x.winner() or "", reverse=True)
+            object_list = sorted(object_list, key=lambda x: _get_winner(x) or "", reverse=True)
         case "total_due":
             object_list = sorted(object_list, key=_get_total_due)
         case "-total_due":
@@ -73,9 +94,9 @@ def auction_detail(request, pk):
             Column("category"),
             PageStatusColumn("status"),
             Column("donor", sort_key="donor"),
-            Column("bid_count", label="# bids"),
+            Column("bid_count", label="# bids", accessor=_get_bid_count),
             Column("current_winning_bid", sort_key="winning_bid", label="Winning bid", accessor=lambda x: _get_winning_bid(x)),
-            Column("winner", sort_key="winner"),
+            Column("winner", sort_key="winner", accessor=_get_winner),
             BooleanColumn("winner_notified", sort_key="winner_notified"),
             BooleanColumn("donor_notified", sort_key="donor_notified"),
             Column("total_due", sort_key="total_due", accessor=lambda x: _get_total_due(x)),
@@ -136,13 +157,20 @@ def auction_item_bids(request, pk):
 
 def auction_item_result(request, pk):
     auction_item = get_object_or_404(AuctionItem, pk=pk)
-    winning_bid = auction_item.current_winning_bid_obj
+    auction = auction_item.get_parent().specific
+    auction.close_out()
+    result = auction_item.get_result()
+    if result:
+        winning_bid = result.winning_bid
+    else:
+        winning_bid = auction_item.current_winning_bid_obj
     return render(request, 'fundraising/admin/auction_item_result.html',
         {
             "page_title": f"{auction_item.title}",
             "auction_item": auction_item,
+            "result": result,
             "winning_bid": winning_bid,
-            "auction": auction_item.get_parent().specific,
+            "auction": auction,
         }
     )
 
@@ -1,11 +1,22 @@
 from django.conf import settings
-from .models import RecipeBookSubmission, PAGE_TYPE_PAGE_COUNTS
+from .models import RecipeBookSubmission
 
 
 def recipes(request):
+    # Totals are only fetched if a template uses them (templates call callables)
+    totals = None
+
+    def total(name):
+        def _total():
+            nonlocal totals
+            if totals is None:
+                totals = RecipeBookSubmission.totals()
+            return totals[name]
+        return _total
+
     return {
-        "total_recipe_book_pages": sum([PAGE_TYPE_PAGE_COUNTS[subm.page_type] for subm in RecipeBookSubmission.objects.all()]),
-        "total_recipe_book_money": sum([subm.cost for subm in RecipeBookSubmission.objects.all()]),
-        "total_recipe_book_pending": sum([subm.cost for subm in RecipeBookSubmission.objects.filter(paid=False)]) ,
+        "total_recipe_book_pages": total("pages"),
+        "total_recipe_book_money": total("money"),
+        "total_recipe_book_pending": total("pending"),
         "recipe_submissions_open": settings.RECIPE_SUBMISSIONS_OPEN,
     }
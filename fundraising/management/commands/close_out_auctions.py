@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from fundraising.models import Auction
+
+
+class Command(BaseCommand):
+    help = 'Write results for items in closed auctions that have not been closed out yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "auction_ids",
+            nargs="*",
+            type=int,
+            help="Auction page IDs (default: all closed auctions)",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, auction_ids, **kwargs):
+        auctions = Auction.objects.filter(close_at__lte=timezone.now())
+        if auction_ids:
+            auctions = auctions.filter(id__in=auction_ids)
+        for auction in auctions:
+            results = auction.close_out()
+            if results:
+                sold = sum(result.sold for result in results)
+                self.stdout.write(f"{auction.title}: {len(results)} results written ({sold} sold)")
@@ -4,7 +4,7 @@ from wagtail.admin.mail import send_mail
 
 from django.core.management.base import BaseCommand
 
-from fundraising.models import Auction
+from fundraising.models import Auction, AuctionItem
 
 
 class Command(BaseCommand):
@@ -26,8 +26,11 @@ class Command(BaseCommand):
         auction = Auction.objects.get(id=auction_id)
         assert auction.is_closed()
 
-        auction_items = auction.get_children().specific()
-        unsold_items = [it for it in auction_items if not it.active_bids and not it.unsold_notification_sent]
+        auction.close_out()
+        unsold_results = auction.results.filter(
+            sold=False, auction_item__unsold_notification_sent=False
+        ).select_related("auction_item")
+        unsold_items = [result.auction_item for result in unsold_results]
         items_by_donor = {}
         for unsold_item in unsold_items:
             items_by_donor.setdefault((unsold_item.donor, unsold_item.donor_email), []).append(unsold_item)
@@ -54,9 +57,9 @@ class Command(BaseCommand):
                     recipient_list=[donor_email],
                     reply_to=[settings.DEFAULT_ADMIN_EMAIL]
                 )
-                for donor_item in donor_items:
-                    donor_item.unsold_notification_sent = True
-                    donor_item.save()
+                AuctionItem.objects.filter(
+                    id__in=[donor_item.id for donor_item in donor_items]
+                ).update(unsold_notification_sent=True)
 
                 
 def message_body(donor, item_plural, items_str):
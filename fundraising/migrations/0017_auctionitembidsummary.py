@@ -0,0 +1,26 @@
+# Generated by Django 6.0.6 on 2026-10-18 06:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundraising', '0016_auctionitem_unsold_notification_sent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuctionItemBidSummary',
+            fields=[
+                ('auction_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='bid_summary', serialize=False, to='fundraising.auctionitem')),
+                ('max_amount', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('bid_count', models.PositiveIntegerField(default=0)),
+                ('active_bid_count', models.PositiveIntegerField(default=0)),
+                ('winner_notified', models.BooleanField(default=False)),
+                ('donor_notified', models.BooleanField(default=False)),
+                ('winning_bid', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='fundraising.bid')),
+            ],
+        ),
+    ]
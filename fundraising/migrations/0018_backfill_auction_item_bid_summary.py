@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def backfill_bid_summaries(apps, schema_editor):
+    AuctionItemBidSummary = apps.get_model("fundraising", "AuctionItemBidSummary")
+    Bid = apps.get_model("fundraising", "Bid")
+
+    summaries = {}
+    for bid in Bid.objects.order_by("-amount", "placed_at", "id"):
+        summary = summaries.setdefault(
+            bid.auction_item_id, AuctionItemBidSummary(auction_item_id=bid.auction_item_id)
+        )
+        summary.bid_count += 1
+        if bid.withdrawn:
+            continue
+        summary.active_bid_count += 1
+        if summary.winning_bid_id is None:
+            # bids are in winning order, so the first active one wins
+            summary.winning_bid_id = bid.id
+            summary.max_amount = bid.amount
+            summary.winner_notified = bid.winner_notified
+            summary.donor_notified = bid.donor_notified
+    AuctionItemBidSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fundraising", "0017_auctionitembidsummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_bid_summaries, migrations.RunPython.noop)
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundraising', '0018_backfill_auction_item_bid_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuctionResult',
+            fields=[
+                ('auction_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result', serialize=False, to='fundraising.auctionitem')),
+                ('sold', models.BooleanField(default=False)),
+                ('winner_name', models.CharField(blank=True, max_length=255)),
+                ('winner_email', models.CharField(blank=True, max_length=255)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('postage', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('total_due', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('donor', models.CharField(max_length=255)),
+                ('donor_email', models.CharField(max_length=255)),
+                ('bid_count', models.PositiveIntegerField(default=0)),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('auction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='fundraising.auction')),
+                ('winner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('winning_bid', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='fundraising.bid')),
+            ],
+            options={
+                'ordering': ('auction', 'auction_item__path'),
+            },
+        ),
+    ]
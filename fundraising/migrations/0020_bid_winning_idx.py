@@ -0,0 +1,19 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundraising', '0019_auctionresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['auction_item', 'withdrawn', '-amount', 'placed_at', 'id'], name='bid_winning_idx'),
+        ),
+    ]
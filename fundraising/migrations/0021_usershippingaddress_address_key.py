@@ -0,0 +1,19 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundraising', '0020_bid_winning_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershippingaddress',
+            name='address_key',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,38 @@
+import hashlib
+
+from django.db import migrations
+
+
+ADDRESS_FIELDS = (
+    "name", "address_line_1", "address_line_2", "address_line_3", "town_city", "county", "postcode"
+)
+
+
+def backfill_address_keys(apps, schema_editor):
+    UserShippingAddress = apps.get_model("fundraising", "UserShippingAddress")
+
+    seen = set()
+    duplicate_ids = []
+    addresses = []
+    for address in UserShippingAddress.objects.order_by("id"):
+        values = [getattr(address, field) or "" for field in ADDRESS_FIELDS]
+        address.address_key = hashlib.sha256("\x1f".join(values).encode()).hexdigest()
+        if (address.user_id, address.address_key) in seen:
+            duplicate_ids.append(address.id)
+            continue
+        seen.add((address.user_id, address.address_key))
+        addresses.append(address)
+    UserShippingAddress.objects.bulk_update(addresses, ["address_key"], batch_size=500)
+    # Addresses aren't referenced by anything, so duplicates can just go
+    UserShippingAddress.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fundraising", "0021_usershippingaddress_address_key"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_address_keys, migrations.RunPython.noop)
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundraising', '0022_backfill_shipping_address_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='usershippingaddress',
+            constraint=models.UniqueConstraint(fields=('user', 'address_key'), name='unique_user_shipping_address'),
+        ),
+    ]
@@ -1,10 +1,15 @@
 from decimal import Decimal
+import hashlib
 import random
+import uuid
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.shortcuts import redirect
@@ -26,8 +31,9 @@ from wagtail.models import Orderable, Page
 from wagtail.fields import RichTextField
 from wagtail.admin.mail import send_mail
 from wagtail.admin.panels import FieldPanel, InlinePanel, HelpPanel, Panel, MultipleChooserPanel
-from wagtail.images.models import Image
+from wagtail.images.models import Image, SourceImageIOError
 
+from common.cache import bump_version, get_or_build, get_version
 from common.fields import data_processing_consent_field
 from .utils import user_address_choices
 
@@ -44,6 +50,9 @@ PAGE_TYPE_PAGE_COUNTS = {
     "single_with_facing": 2,
     "photo": 1,
 }
+AUCTION_CARD_IMAGE_FILTER = "fill-180x180-c100"
+RECIPE_BOOK_TOTALS_VERSION = "recipe_book_totals"
+AUCTION_CARD_IMAGE_CACHE_TIMEOUT = 60 * 60 * 24
 
 
 def image_upload_path(instance, filename):
@@ -218,6 +227,41 @@ class RecipeBookSubmission(models.Model):
             self.date_paid = timezone.now()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def totals(cls):
+        """
+        Total pages, money raised and money pending for all submissions, in one
+        query; cached until a submission is saved or deleted
+        """
+        def page_type_sum(values, **filters):
+            return models.Sum(
+                models.Case(
+                    *(
+                        models.When(page_type=page_type, then=value)
+                        for page_type, value in values.items()
+                    ),
+                    default=0,
+                ),
+                filter=models.Q(**filters) if filters else None,
+                default=0,
+            )
+
+        def build():
+            return cls.objects.aggregate(
+                pages=page_type_sum(PAGE_TYPE_PAGE_COUNTS),
+                money=page_type_sum(PAGE_TYPE_COSTS),
+                pending=page_type_sum(PAGE_TYPE_COSTS, paid=False),
+            )
+
+        key = f"recipe_book_totals:{get_version(RECIPE_BOOK_TOTALS_VERSION)}"
+        return get_or_build(key, build, None, local=True)
+
+
+@receiver(post_save, sender=RecipeBookSubmission, dispatch_uid="recipe_book_submission_save_totals")
+@receiver(post_delete, sender=RecipeBookSubmission, dispatch_uid="recipe_book_submission_delete_totals")
+def invalidate_recipe_book_totals(sender, instance, **kwargs):
+    bump_version(RECIPE_BOOK_TOTALS_VERSION)
+
 
 class AuctionsPage(Page):
 
@@ -264,6 +308,11 @@ class Auction(Page):
     
     def is_closed(self):
         return self.close_at <= timezone.now()
+
+    def get_context(self, request, *args, **kwargs):
+        context = super().get_context(request, *args, **kwargs)
+        context["bid_totals_poll_interval"] = settings.AUCTION_BID_TOTALS_POLL_INTERVAL
+        return context
     
     @classmethod
     def open(cls):
@@ -271,15 +320,51 @@ class Auction(Page):
             open_at__lte=timezone.now(), close_at__gte=timezone.bow()
         )
     
+    def listing_items(self):
+        """
+        Live items in this auction, with their category, bid summary and the
+        id of their first photo, in a single query
+        """
+        first_image = AuctionItemPhoto.objects.filter(
+            page=models.OuterRef("pk")
+        ).order_by("sort_order", "id").values("image_id")[:1]
+        return AuctionItem.objects.child_of(self).live().select_related(
+            "category", "bid_summary"
+        ).annotate(first_image_id=models.Subquery(first_image)).order_by("path")
+
     def categories(self):
+        auction_items = list(self.listing_items())
+        card_images = get_auction_card_images(
+            auction_item.first_image_id for auction_item in auction_items
+            if auction_item.first_image_id
+        )
         categories = {}
-        for auction_item in self.get_children().specific().live():
+        for auction_item in auction_items:
+            auction_item.card_image = card_images.get(auction_item.first_image_id)
             categories.setdefault(auction_item.category, []).append(auction_item)
         return categories
 
+    def close_out(self):
+        """
+        Once the auction has closed, write an AuctionResult for each item that
+        doesn't have one yet. Safe to call repeatedly; returns the new results.
+        """
+        if not self.is_closed():
+            return []
+        auction_items = AuctionItem.objects.child_of(self).filter(result__isnull=True).select_related(
+            "bid_summary__winning_bid__user"
+        )
+        results = [AuctionResult.for_item(auction_item, self) for auction_item in auction_items]
+        if results:
+            AuctionResult.objects.bulk_create(results, ignore_conflicts=True)
+        return results
+
     def notify_winners_url(self):
         return reverse("fundraising:notify_auction_winners", args=(self.pk,))
 
+    def notify_donors_url(self):
+        return reverse("fundraising:notify_auction_donors", args=(self.pk,))
+
 
 class AuctionCategory(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -291,6 +376,41 @@ class AuctionCategory(models.Model):
         return self.name
 
 
+def auction_card_image_cache_key(image_id):
+    return f"auction_card_image:{image_id}:{AUCTION_CARD_IMAGE_FILTER}"
+
+
+def get_auction_card_images(image_ids):
+    """
+    Returns a dict of image id to the <img> attributes (src, width, height, alt)
+    of the image's auction card rendition. Attributes are cached, so rendering
+    a card doesn't need to look up the image or its renditions.
+    """
+    keys = {auction_card_image_cache_key(image_id): image_id for image_id in set(image_ids)}
+    cached = cache.get_many(keys)
+    card_images = {keys[key]: attrs for key, attrs in cached.items()}
+    missing = [image_id for key, image_id in keys.items() if key not in cached]
+    if missing:
+        to_cache = {}
+        images = Image.objects.filter(id__in=missing).prefetch_renditions(AUCTION_CARD_IMAGE_FILTER)
+        for image in images:
+            try:
+                rendition = image.get_rendition(AUCTION_CARD_IMAGE_FILTER)
+            except SourceImageIOError:
+                # Show the placeholder, and don't cache so it's retried next time
+                continue
+            attrs = dict(rendition.attrs_dict)
+            card_images[image.id] = to_cache[auction_card_image_cache_key(image.id)] = attrs
+        cache.set_many(to_cache, AUCTION_CARD_IMAGE_CACHE_TIMEOUT)
+    return card_images
+
+
+@receiver(post_save, sender=Image, dispatch_uid="image_save_auction_card")
+@receiver(post_delete, sender=Image, dispatch_uid="image_delete_auction_card")
+def invalidate_auction_card_image(sender, instance, **kwargs):
+    cache.delete(auction_card_image_cache_key(instance.id))
+
+
 class AuctionItemPhoto(Orderable):
     page = ParentalKey("AuctionItem", on_delete=models.CASCADE, related_name='photos')
     image = models.ForeignKey(
@@ -344,47 +464,36 @@ class AuctionItem(Page):
 
     def get_form(self, request, data=None, *, instance=None):
         user = request.user.id if request.user.is_authenticated else None
-        return BidForm(data, initial={"auction_item": self.id, "user": user}, instance=instance)
+        return BidForm(
+            data, initial={"auction_item": self.id, "user": user}, instance=instance, auction_item_page=self
+        )
 
     def serve(self, request, *args, **kwargs):
         request.is_preview = False
         form = None
         if request.user.is_authenticated:
             if request.method == "POST":
-                instance = self.bids.filter(id=request.POST.get("id")).first()
+                instance = self.bids.filter(id=request.POST.get("id"), user=request.user).first()
                 if "delete_bid" in request.POST:
-                    amount = instance.amount
-                    instance.delete()
-                    AuctionItemLog.objects.create(auction_item=self, log=f"User {request.user} ({request.user.id}) deleted bid: £{amount}")
-                    messages.success(request, "Your bid was deleted")
+                    if instance is not None:
+                        amount = instance.amount
+                        instance.delete()
+                        AuctionItemLog.objects.create(auction_item=self, log=f"User {request.user} ({request.user.id}) deleted bid: £{amount}")
+                        messages.success(request, "Your bid was deleted")
+                    # else it was already deleted, e.g. by a repeated submission
                     return redirect(self.get_url())
                 else:
                     form = self.get_form(request, request.POST, instance=instance)
                     if form.is_valid():
-                        bid = form.save()
-                        messages.success(request, "Thank you for your bid! Winners will be notified by email after the auction has closed.")
-
-                        # Email next highest bidder if they have requested notification that their bid has
-                        # been exceeded. Don't notify the one lower than that, as they should have been notified
-                        # when their bid was first exceeded
-                        next_highest = self.active_bids.exclude(id=bid.id).order_by("-amount").first()
-                        if (
-                            next_highest 
-                            and next_highest.notify
-                            and next_highest.user != bid.user
-                        ):
-                            send_mail(
-                                "PINS Auction: You have been out-bid!",
-                                (
-                                    "Your bid on the following PINS auction item is no longer the winning bid:\n"
-                                    f"{self.title} ({self.get_parent().title})\n\n"
-                                    f"Go to {self.get_full_url(request)} to bid again.\n"
-                                ),
-                                [next_highest.user.email],
-                                settings.DEFAULT_FROM_EMAIL,
-                                reply_to=[settings.DEFAULT_ADMIN_EMAIL],
-                            )
-                        return redirect(self.get_url())
+                        try:
+                            _, created = self.place_bid(form, request)
+                        except BidConflict as conflict:
+                            form.show_conflict(conflict)
+                            messages.error(request, conflict.message)
+                        else:
+                            if created:
+                                messages.success(request, "Thank you for your bid! Winners will be notified by email after the auction has closed.")
+                            return redirect(self.get_url())
                     else:
                         messages.error(request, "Please correct the errors below")
             else:
@@ -404,28 +513,125 @@ class AuctionItem(Page):
     def active_bids(self):
         return self.bids.filter(withdrawn=False)
 
+    def place_bid(self, form, request):
+        """
+        Save a valid BidForm. Bids on the item are placed one at a time, by
+        locking its bid summary, and the amount is checked against the bids
+        at that point rather than when the form was shown.
+        Returns (bid, created); created is False if the form was a repeated
+        submission (same idempotency key) of a bid that's already placed.
+        Raises BidConflict if the bid can't be placed.
+        """
+        idempotency_key = form.cleaned_data.get("idempotency_key") or None
+        expected_max_amount = form.cleaned_data.get("expected_max_amount")
+        placed = self.get_placed_bid(request.user, idempotency_key)
+        if placed:
+            return placed, False
+        # Repeated submissions aren't counted
+        if not check_bid_rate_limit(request.user.id):
+            raise BidConflict("rate_limited", "You have placed too many bids; please wait a minute and try again.")
+
+        with transaction.atomic():
+            summary = AuctionItemBidSummary.lock(self.id)
+            AuctionItem.bid_summary.related.set_cached_value(self, summary)
+            # Check again, in case a repeated submission was placed while waiting for the lock
+            placed = self.get_placed_bid(request.user, idempotency_key)
+            if placed:
+                return placed, False
+
+            bid = form.save(commit=False)
+            previous_amount = getattr(bid, "_loaded_values", {}).get("amount")
+            minimum_bid = self.minimum_bid()
+            if previous_amount is not None and bid.amount < previous_amount and bid.amount < minimum_bid:
+                raise BidConflict(
+                    "below_minimum",
+                    f"Please enter an amount of at least £{minimum_bid:.2f}",
+                    summary,
+                )
+            if (
+                expected_max_amount is not None
+                and expected_max_amount != summary.max_amount
+                and bid.amount <= summary.max_amount
+            ):
+                # Someone else bid while this form was open
+                raise BidConflict(
+                    "outbid",
+                    (
+                        f"Another bid of £{summary.max_amount:.2f} has been placed since you opened this page. "
+                        "Submit again to confirm your bid, or increase it."
+                    ),
+                    summary,
+                )
+
+            previous_winning_bid = summary.winning_bid
+            bid.idempotency_key = idempotency_key
+            bid.save(summary_locked=True)
+            if (
+                previous_winning_bid
+                and previous_winning_bid.notify
+                and previous_winning_bid.user_id != bid.user_id
+                and bid.is_winner()
+            ):
+                transaction.on_commit(lambda: self.send_outbid_email(previous_winning_bid, request))
+        return bid, True
+
+    def get_placed_bid(self, user, idempotency_key):
+        if idempotency_key:
+            return self.bids.filter(user=user, idempotency_key=idempotency_key).first()
+
+    def send_outbid_email(self, bid, request):
+        send_mail(
+            "PINS Auction: You have been out-bid!",
+            (
+                "Your bid on the following PINS auction item is no longer the winning bid:\n"
+                f"{self.title} ({self.get_parent().title})\n\n"
+                f"Go to {self.get_full_url(request)} to bid again.\n"
+            ),
+            [bid.user.email],
+            settings.DEFAULT_FROM_EMAIL,
+            reply_to=[settings.DEFAULT_ADMIN_EMAIL],
+        )
+
+    def get_bid_summary(self):
+        """
+        Bid totals for this item, kept up to date as bids change. Select
+        "bid_summary__winning_bid__user" when fetching items to avoid queries.
+        """
+        try:
+            return self.bid_summary
+        except AuctionItemBidSummary.DoesNotExist:
+            # No bids yet
+            return AuctionItemBidSummary(auction_item=self)
+
     def current_winning_bid(self):
-        return self.active_bids.aggregate(models.Max("amount", default=0))["amount__max"]
+        return self.get_bid_summary().max_amount
 
     @property
     def current_winning_bid_obj(self):
-        if self.active_bids.exists():
-            return self.active_bids.get(amount=self.current_winning_bid())
+        return self.get_bid_summary().winning_bid
     
     def total_due(self):
-        if self.active_bids.exists():
+        if self.get_bid_summary().winning_bid_id:
             return self.current_winning_bid() + self.postage
         return 0
 
     def winner(self):
-        if self.active_bids.exists():
-            return f"{self.current_winning_bid_obj.name} ({self.current_winning_bid_obj.user})"
+        winning_bid = self.current_winning_bid_obj
+        if winning_bid:
+            return f"{winning_bid.name} ({winning_bid.user})"
+
+    def get_result(self):
+        """The item's AuctionResult, or None if its auction hasn't been closed out"""
+        try:
+            return self.result
+        except AuctionResult.DoesNotExist:
+            return None
 
     def minimum_bid(self):
         return max(self.starting_bid, self.current_winning_bid() + Decimal(0.01))
 
     def bid_count(self):
-        return self.bids.count()
+        return self.get_bid_summary().bid_count
 
     def get_context(self, request, *args, **kwargs):
         context = super().get_context(request, *args, **kwargs)
@@ -442,76 +648,44 @@ class AuctionItem(Page):
             context["minimum_bid"] = self.minimum_bid()
             context["auction_closed"] = self.get_parent().specific.is_closed()
             context["auction_open"] = self.get_parent().specific.is_open()
+            context["bid_totals_poll_interval"] = settings.AUCTION_BID_TOTALS_POLL_INTERVAL
             
         return context
 
     def winner_notified(self):
-        if self.active_bids.exists():
-            return self.current_winning_bid_obj.winner_notified
+        summary = self.get_bid_summary()
+        if summary.winning_bid_id:
+            return summary.winner_notified
         return False
 
     def notify_winner(self, request):
-        if self.winner_notified():
-            return False
-        winning_bid = self.current_winning_bid_obj
-        if winning_bid:
-            send_mail(
-                f"PINS Auction: You have won! ({self.title})",
-                (
-                    "You have won the following PINS auction item:\n"
-                    f"{self.title} ({self.get_parent().title})\n"
-                    f"{self.get_full_url(request)}\n\n"
-                    f"Your total amount due, including shipping is £{self.total_due()}\n\n"
-                    "Please make your payment by bank transfer to PINS:\n"
-                    "Account name: Podencos in Need - PINS\n"
-                    "Account no: 13804187\n"
-                    "Sort code: 09-01-29\n\n"
-                    "To help us process your item as soon as possible, please include 'Auction' and your name in the "
-                    f"reference, and send a screenshot of the transaction to {settings.DEFAULT_ADMIN_EMAIL}\n\n"
-                    "Thank you for your support!\n"
-                    "The PINS team"
-                ),
-                [winning_bid.user.email],
-                settings.DEFAULT_FROM_EMAIL,
-                reply_to=[settings.DEFAULT_ADMIN_EMAIL],
-            )
-            winning_bid.winner_notified = True
-            winning_bid.save()
-            winning_bid.write_bid_log(winner_notified=True, changed_by=request.user)
-            return True
-        return False
+        from .notifications import notify_winners
+        notified, _ = notify_winners(self.get_parent().specific, request, auction_item_ids=[self.id])
+        return notified > 0
 
     def donor_notified(self):
-        if self.active_bids.exists():
-            return self.current_winning_bid_obj.donor_notified
+        summary = self.get_bid_summary()
+        if summary.winning_bid_id:
+            return summary.donor_notified
         return self.unsold_notification_sent
 
     def notify_donor(self, request):
-        if self.donor_notified():
-            return False
-        winning_bid = self.current_winning_bid_obj
-        if winning_bid:
-            send_mail(
-                f"PINS Auction: Your item has sold! ({self.title})",
-                (
-                    "Your PINS auction item has been won:\n"
-                    f"{self.title} ({self.get_parent().title})\n"
-                    f"{self.get_full_url(request)}\n\n"
-                    f"Please ship it to:\n\n"
-                    f"{winning_bid.format_shipping_details()}\n\n"
-                    f"If you requested reimbursement for shipping costs, one of the admin team will be in contact shortly.\n\n"
-                    "Thank you for your support!\n"
-                    "The PINS team"
-                ),
-                [self.donor_email],
-                settings.DEFAULT_FROM_EMAIL,
-                reply_to=[settings.DEFAULT_ADMIN_EMAIL],
-            )
-            winning_bid.donor_notified = True
-            winning_bid.save()
-            winning_bid.write_bid_log(donor_notified=True, changed_by=request.user)
-            return True
-        return False
+        from .notifications import notify_donors
+        notified, _ = notify_donors(self.get_parent().specific, request, auction_item_ids=[self.id])
+        return notified > 0
+
+    def refresh_result(self):
+        """
+        Rewrite the item's result from its current bids, if its auction has
+        already been closed out (e.g. after an admin withdraws the winning bid)
+        """
+        result = self.get_result()
+        if result is None:
+            return
+        auction_item = AuctionItem.objects.select_related("bid_summary__winning_bid__user").get(id=self.id)
+        new_result = AuctionResult.for_item(auction_item, result.auction)
+        new_result.save()
+        AuctionItem.result.related.set_cached_value(self, new_result)
 
     def get_logs_url(self):
         return reverse("auction_item_log", args=(self.id,))
@@ -523,6 +697,155 @@ class AuctionItem(Page):
         return reverse("fundraising:notify_auction_item_winner", args=(self.id,))
     
 
+class AuctionItemBidSummary(models.Model):
+    """
+    Denormalised bid totals for an AuctionItem, recalculated whenever one of its
+    bids is saved or deleted, so that listings of items don't need to aggregate
+    bids for each one.
+    Not stored on the AuctionItem itself, as publishing a page revision would
+    overwrite it.
+    """
+    auction_item = models.OneToOneField(
+        AuctionItem, on_delete=models.CASCADE, primary_key=True, related_name="bid_summary"
+    )
+    max_amount = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    winning_bid = models.ForeignKey(
+        "Bid", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    # All bids, including withdrawn ones
+    bid_count = models.PositiveIntegerField(default=0)
+    active_bid_count = models.PositiveIntegerField(default=0)
+    # Notification status of the winning bid
+    winner_notified = models.BooleanField(default=False)
+    donor_notified = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.auction_item_id}: {self.bid_count} bids, max £{self.max_amount}"
+
+    @classmethod
+    def refresh(cls, auction_item_id):
+        """Recalculate the summary from the item's bids"""
+        with transaction.atomic(savepoint=False):
+            bids = Bid.objects.filter(auction_item_id=auction_item_id)
+            count_fields = {
+                "bid_count": models.Count("id"),
+                "active_bid_count": models.Count("id", filter=models.Q(withdrawn=False)),
+            }
+            # The counts are fetched with the winning bid, in one query
+            counts_query = bids.order_by().values("auction_item_id").annotate(**count_fields)
+            winning_bid = (
+                bids.filter(withdrawn=False).select_related("user")
+                .annotate(**{field: models.Subquery(counts_query.values(field)) for field in count_fields})
+                .order_by(*BidQuerySet.winning_order).first()
+            )
+            if winning_bid:
+                counts = {field: getattr(winning_bid, field) for field in count_fields}
+            else:
+                counts = bids.aggregate(**count_fields)
+            summary = cls(
+                auction_item_id=auction_item_id,
+                **counts,
+                max_amount=winning_bid.amount if winning_bid else 0,
+                winning_bid=winning_bid,
+                winner_notified=winning_bid.winner_notified if winning_bid else False,
+                donor_notified=winning_bid.donor_notified if winning_bid else False,
+            )
+            # insert or update in one query
+            cls.objects.bulk_create(
+                [summary],
+                update_conflicts=True,
+                unique_fields=["auction_item"],
+                update_fields=[
+                    "max_amount", "winning_bid", "bid_count", "active_bid_count", "winner_notified", "donor_notified"
+                ],
+            )
+        return summary
+
+    @classmethod
+    def lock(cls, auction_item_id):
+        """
+        Lock the item's summary row (creating it if needed) until the end of
+        the current transaction, so that its bids are changed one at a time
+        """
+        summaries = cls.objects.select_for_update().select_related("winning_bid__user")
+        summary = summaries.filter(auction_item_id=auction_item_id).first()
+        if summary is None:
+            # No bids yet
+            cls.objects.bulk_create([cls(auction_item_id=auction_item_id)], ignore_conflicts=True)
+            summary = summaries.get(auction_item_id=auction_item_id)
+        return summary
+
+    def as_totals(self):
+        return {
+            "item": self.auction_item_id,
+            "max_amount": f"{self.max_amount:.2f}",
+            "bid_count": self.bid_count,
+        }
+
+
+class AuctionResult(models.Model):
+    """
+    The outcome of an AuctionItem, written once when its auction closes so
+    that results pages and exports don't depend on later changes to bids.
+    It's only rewritten if an admin withdraws or reinstates a bid on the item.
+    """
+    auction_item = models.OneToOneField(
+        AuctionItem, on_delete=models.CASCADE, primary_key=True, related_name="result"
+    )
+    auction = models.ForeignKey(Auction, on_delete=models.CASCADE, related_name="results")
+    sold = models.BooleanField(default=False)
+    winning_bid = models.ForeignKey(
+        "Bid", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    winner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    winner_name = models.CharField(max_length=255, blank=True)
+    winner_email = models.CharField(max_length=255, blank=True)
+    amount = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    postage = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    total_due = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    donor = models.CharField(max_length=255)
+    donor_email = models.CharField(max_length=255)
+    bid_count = models.PositiveIntegerField(default=0)
+    closed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("auction", "auction_item__path")
+
+    def __str__(self):
+        return f"{self.auction_item}: {'sold' if self.sold else 'unsold'}"
+
+    @classmethod
+    def for_item(cls, auction_item, auction):
+        """
+        Build (but don't save) the result for an item, from its bid summary.
+        Select "bid_summary__winning_bid__user" when fetching items to avoid
+        queries.
+        """
+        summary = auction_item.get_bid_summary()
+        winning_bid = summary.winning_bid
+        result = cls(
+            auction_item=auction_item,
+            auction=auction,
+            sold=winning_bid is not None,
+            postage=auction_item.postage,
+            donor=auction_item.donor,
+            donor_email=auction_item.donor_email,
+            bid_count=summary.bid_count,
+        )
+        if winning_bid is not None:
+            result.winning_bid = winning_bid
+            result.winner = winning_bid.user
+            result.winner_name = winning_bid.name
+            result.winner_email = winning_bid.user.email
+            result.amount = winning_bid.amount
+            result.total_due = winning_bid.amount + auction_item.postage
+        return result
+
+    def winner_display(self):
+        if self.sold:
+            return f"{self.winner_name} ({self.winner})"
+
+
 class AuctionItemLog(Orderable):
     auction_item = models.ForeignKey(AuctionItem, on_delete=models.CASCADE, related_name="logs")
     log = models.TextField()
@@ -532,6 +855,51 @@ class AuctionItemLog(Orderable):
         ordering = ("-timestamp",)
 
 
+class BidConflict(Exception):
+    """
+    A bid couldn't be placed, because of bids placed since the form was shown
+    or because the user is bidding too often
+    """
+    def __init__(self, code, message, summary=None):
+        self.code = code
+        self.message = message
+        self.current_amount = summary.max_amount if summary else None
+        super().__init__(message)
+
+
+def check_bid_rate_limit(user_id):
+    """
+    Count a bid submission by the user; returns False if they've made more than
+    AUCTION_BID_RATE_LIMIT in the last AUCTION_BID_RATE_PERIOD seconds
+    """
+    key = f"bid_rate:{user_id}"
+    cache.add(key, 0, settings.AUCTION_BID_RATE_PERIOD)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # expired since it was added
+        cache.set(key, 1, settings.AUCTION_BID_RATE_PERIOD)
+        count = 1
+    return count <= settings.AUCTION_BID_RATE_LIMIT
+
+
+class BidQuerySet(models.QuerySet):
+
+    # Highest active bid wins; ties go to the earliest
+    winning_order = ("-amount", "placed_at", "id")
+
+    def winning(self):
+        """
+        Bids in this queryset that are the winning bid for their item.
+        Each item's winning bid is a single lookup on the bid_winning_idx
+        index, so this stays cheap however many bids an item has.
+        """
+        winning_bid = Bid.objects.filter(
+            auction_item=models.OuterRef("auction_item"), withdrawn=False
+        ).order_by(*self.winning_order).values("id")[:1]
+        return self.filter(withdrawn=False, id=models.Subquery(winning_bid))
+
+
 class Bid(ClusterableModel):
     auction_item = models.ForeignKey(AuctionItem, on_delete=models.CASCADE, related_name="bids")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bids")
@@ -561,18 +929,40 @@ class Bid(ClusterableModel):
     winner_notified = models.BooleanField(default=False)
     # This bid was a winning bid, and the donor has been emailed shipping details for it.
     donor_notified = models.BooleanField(default=False)
+    # Sent with the bid form; a repeated submission with the same key is ignored
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+
+    objects = BidQuerySet.as_manager()
+
+    # Fields whose changes are logged when the bid is saved
+    tracked_fields = ("amount", "withdrawn")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["auction_item", "withdrawn", "-amount", "placed_at", "id"], name="bid_winning_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "idempotency_key"],
+                condition=models.Q(idempotency_key__isnull=False),
+                name="unique_bid_idempotency_key",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.auction_item} - £{self.amount}"
 
     def is_winner(self):
-        return not self.withdrawn and self.amount == self.auction_item.current_winning_bid()
+        return not self.withdrawn and self.auction_item.get_bid_summary().winning_bid_id == self.id
 
     def toggle_withdrawn(self, request):
         toggle_to = not self.withdrawn
         action = "withdrawn" if toggle_to is True else "reinstated"
         self.withdrawn = toggle_to
         self.save()
+        self.auction_item.refresh_result()
 
         send_mail(
             "PINS Auction: Your bid has been withdrawn",
@@ -588,7 +978,7 @@ class Bid(ClusterableModel):
         self.write_bid_log(new_withdrawn_status=toggle_to, changed_by=request.user)
         return toggle_to
 
-    def write_bid_log(
+    def build_bid_log(
             self, 
             new=False, 
             new_withdrawn_status=None,
@@ -596,22 +986,29 @@ class Bid(ClusterableModel):
             donor_notified=False,
             changed_by=None,
         ):
+        """Returns an unsaved AuctionItemLog for the change, if there is one to log"""
         changed_by_str = f" by user {changed_by}" if changed_by else ""
         if winner_notified:
-            AuctionItemLog.objects.create(auction_item=self.auction_item, log=f"Winner {self.user} ({self.user.id}) notified{changed_by_str}")
+            log = f"Winner {self.user} ({self.user.id}) notified{changed_by_str}"
         elif donor_notified:
-            AuctionItemLog.objects.create(auction_item=self.auction_item, log=f"Donor {self.auction_item.donor} notified of {self.user}'s win{changed_by_str}") 
+            log = f"Donor {self.auction_item.donor} notified of {self.user}'s win{changed_by_str}"
         elif new_withdrawn_status is None:
             action = "created" if new else "updated"
-            AuctionItemLog.objects.create(auction_item=self.auction_item, log=f"User {self.user} ({self.user.id}) {action} bid: £{self.amount}")
+            log = f"User {self.user} ({self.user.id}) {action} bid: £{self.amount}"
         else:
             match new_withdrawn_status:
                 case True:
-                    AuctionItemLog.objects.create(auction_item=self.auction_item, log=f"Bid withdrawn for User {self.user} ({self.user.id}){changed_by_str}")
+                    log = f"Bid withdrawn for User {self.user} ({self.user.id}){changed_by_str}"
                 case False:
-                    AuctionItemLog.objects.create(auction_item=self.auction_item, log=f"Bid reinstated for User {self.user} ({self.user.id}){changed_by_str}")
+                    log = f"Bid reinstated for User {self.user} ({self.user.id}){changed_by_str}"
                 case _:
-                    ...
+                    return None
+        return AuctionItemLog(auction_item=self.auction_item, log=log)
+
+    def write_bid_log(self, **kwargs):
+        log = self.build_bid_log(**kwargs)
+        if log is not None:
+            log.save()
 
     def admin_url(self):
         return reverse("auction_item_bid", args=(self.id,))
@@ -619,33 +1016,74 @@ class Bid(ClusterableModel):
     def format_shipping_details(self):
         return parse_shipping_address(self, delimiter="\n")
 
-    def save(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the loaded values, so save() can see what's changed without
+        # fetching the bid again
+        instance._loaded_values = {
+            field: value for field, value in zip(field_names, values) if field in cls.tracked_fields
+        }
+        return instance
+
+    def save(self, *args, summary_locked=False, **kwargs):
+        """
+        Pass summary_locked if the item's bid summary is already locked in this
+        transaction (see AuctionItem.place_bid)
+        """
+        logs = []
         if self.id:
-            pre_save = Bid.objects.get(id=self.id)
-            if pre_save.amount != self.amount:
+            loaded_values = getattr(self, "_loaded_values", {})
+            if set(loaded_values) != set(self.tracked_fields):
+                loaded_values = Bid.objects.values(*self.tracked_fields).get(id=self.id)
+            if loaded_values["amount"] != self.amount:
                 self.placed_at = timezone.now()
-                self.write_bid_log()
-            if pre_save.withdrawn != self.withdrawn:
-                self.write_bid_log(new_withdrawn_status=self.withdrawn)
+                logs.append(self.build_bid_log())
+            if loaded_values["withdrawn"] != self.withdrawn:
+                logs.append(self.build_bid_log(new_withdrawn_status=self.withdrawn))
         else:
-            self.write_bid_log(new=True)
-        
-        for field in [self.name, self.address_line_1, self.address_line_2, self.address_line_3, self.town_city, self.county, self.postcode]:
-            if field is not None:
-                field = field.strip()
-
-        UserShippingAddress.objects.get_or_create(
-            user=self.user,
-            name=self.name,
-            address_line_1=self.address_line_1,
-            address_line_2=self.address_line_2,
-            address_line_3=self.address_line_3,
-            town_city=self.town_city,
-            county=self.county,
-            postcode=self.postcode,
-        )
+            logs.append(self.build_bid_log(new=True))
+
+        for field in UserShippingAddress.address_fields:
+            value = getattr(self, field)
+            if value is not None:
+                setattr(self, field, value.strip())
+
+        with transaction.atomic():
+            if not summary_locked:
+                # Bids on an item are changed one at a time, so that each
+                # refresh of its summary sees the others' changes
+                AuctionItemBidSummary.lock(self.auction_item_id)
+            UserShippingAddress.add_from(self)
+            super().save(*args, **kwargs)
+            AuctionItemLog.objects.bulk_create(logs)
+            self.refresh_bid_summary()
+        self._loaded_values = {field: getattr(self, field) for field in self.tracked_fields}
+
+    def refresh_bid_summary(self):
+        summary = AuctionItemBidSummary.refresh(self.auction_item_id)
+        # and for an item instance that's already loaded
+        if Bid.auction_item.is_cached(self):
+            AuctionItem.bid_summary.related.set_cached_value(self.auction_item, summary)
+
+
+def deleting_auction_item(origin):
+    # The item itself (or a page above it) is being deleted
+    return issubclass(getattr(origin, "model", type(origin)), Page)
+
+
+@receiver(pre_delete, sender=Bid, dispatch_uid="bid_delete_lock_summary")
+def lock_bid_summary_on_delete(sender, instance, origin=None, **kwargs):
+    # Deletes run in a transaction; hold the item's lock until the summary is
+    # refreshed after the delete
+    if not deleting_auction_item(origin):
+        AuctionItemBidSummary.lock(instance.auction_item_id)
+
 
-        super().save()
+@receiver(post_delete, sender=Bid, dispatch_uid="bid_delete_summary")
+def refresh_bid_summary_on_delete(sender, instance, origin=None, **kwargs):
+    if not deleting_auction_item(origin):
+        instance.refresh_bid_summary()
 
 
 class UserShippingAddress(models.Model):
@@ -657,6 +1095,47 @@ class UserShippingAddress(models.Model):
     town_city = models.CharField(verbose_name="Town/City")
     county = models.CharField()
     postcode = models.CharField()
+    # Hash of the address fields, so an address is only stored once per user
+    address_key = models.CharField(max_length=64)
+
+    address_fields = (
+        "name", "address_line_1", "address_line_2", "address_line_3", "town_city", "county", "postcode"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "address_key"], name="unique_user_shipping_address"),
+        ]
+
+    @classmethod
+    def make_address_key(cls, obj):
+        values = [getattr(obj, field) or "" for field in cls.address_fields]
+        return hashlib.sha256("\x1f".join(values).encode()).hexdigest()
+
+    @classmethod
+    def add_from(cls, obj):
+        """
+        Store the user's address from obj (e.g. a Bid), unless they already
+        have it; a single INSERT that does nothing on conflict
+        """
+        address = cls(
+            user_id=obj.user_id,
+            address_key=cls.make_address_key(obj),
+            **{field: getattr(obj, field) for field in cls.address_fields},
+        )
+        cls.objects.bulk_create([address], ignore_conflicts=True)
+
+    def save(self, *args, **kwargs):
+        self.address_key = self.make_address_key(self)
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError:
+            # The user already has this address; merge this one into it
+            existing = UserShippingAddress.objects.get(user_id=self.user_id, address_key=self.address_key)
+            if self.pk is not None and self.pk != existing.pk:
+                UserShippingAddress.objects.filter(pk=self.pk).delete()
+            self.pk = existing.pk
 
     def parse_address(self):
         return parse_shipping_address(self)
@@ -678,6 +1157,9 @@ class BidForm(forms.ModelForm):
         label="Select an existing address",
     )
     data_processing_consent = data_processing_consent_field()
+    idempotency_key = forms.CharField(required=False, widget=forms.HiddenInput)
+    # the highest bid when the form was shown
+    expected_max_amount = forms.DecimalField(required=False, widget=forms.HiddenInput)
 
     class Meta:
         fields = ("amount", "auction_item", "user", "notify", "name", "address_line_1", "address_line_2", "address_line_3", "town_city", "county", "postcode")
@@ -688,9 +1170,11 @@ class BidForm(forms.ModelForm):
             "address_line_3": "Street address (optional)",
         }
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, auction_item_page=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.auction_item = self.initial["auction_item"]
+        # the AuctionItem, if the caller already has it
+        self.auction_item_page = auction_item_page
         self.helper = FormHelper()
         self.helper.form_show_errors = True
         if self.instance.id:
@@ -708,10 +1192,18 @@ class BidForm(forms.ModelForm):
             for field in ["name", "address_line_1", "town_city", "county", "postcode"]:
                 self.fields[field].required = False
 
+        # new for each form shown, so repeated submissions of it can be spotted
+        self.idempotency_key_field = Hidden("idempotency_key", uuid.uuid4().hex)
+        self.expected_max_amount_field = Hidden(
+            "expected_max_amount",
+            self.auction_item_page.current_winning_bid() if self.auction_item_page else "",
+        )
         self.helper.layout = Layout(
             Hidden("user", self.initial["user"]),
             Hidden("auction_item", self.auction_item),
             id_field,
+            self.idempotency_key_field,
+            self.expected_max_amount_field,
             PrependedText("amount", "£"),
             "notify",
             Fieldset(
@@ -732,9 +1224,18 @@ class BidForm(forms.ModelForm):
             Submit('submit', f'Submit', css_class="btn btn-success"),
         )
 
+    def show_conflict(self, conflict):
+        """
+        Show a BidConflict as an error on the amount, and expect the current
+        highest bid when the form is submitted again
+        """
+        self.add_error("amount", conflict.message)
+        if conflict.current_amount is not None:
+            self.expected_max_amount_field.value = conflict.current_amount
+
     def clean_amount(self):
         value = self.cleaned_data["amount"]
-        auction_item = AuctionItem.objects.get(id=self.auction_item)
+        auction_item = self.auction_item_page or AuctionItem.objects.get(id=self.auction_item)
         if self.instance.id and value < self.instance.amount:
             if value < auction_item.minimum_bid():
                 raise ValidationError(f"Please enter an amount of at least £{auction_item.minimum_bid():.2f}")
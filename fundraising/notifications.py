@@ -0,0 +1,132 @@
+"""
+Winner and donor emails for closed auctions.
+
+Items to notify are fetched with their winning bids in one query, emails are
+sent over a single connection (or added to the email outbox if
+settings.EMAIL_OUTBOX is set), and bids, summaries and logs are updated in bulk.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+
+from home.models import OutboxEmail
+
+from .models import AuctionItem, AuctionItemBidSummary, AuctionItemLog, Bid
+
+
+logger = logging.getLogger(__name__)
+
+
+def winner_email(auction_item, auction, item_url):
+    winning_bid = auction_item.bid_summary.winning_bid
+    return (
+        f"PINS Auction: You have won! ({auction_item.title})",
+        (
+            "You have won the following PINS auction item:\n"
+            f"{auction_item.title} ({auction.title})\n"
+            f"{item_url}\n\n"
+            f"Your total amount due, including shipping is £{auction_item.total_due()}\n\n"
+            "Please make your payment by bank transfer to PINS:\n"
+            "Account name: Podencos in Need - PINS\n"
+            "Account no: 13804187\n"
+            "Sort code: 09-01-29\n\n"
+            "To help us process your item as soon as possible, please include 'Auction' and your name in the "
+            f"reference, and send a screenshot of the transaction to {settings.DEFAULT_ADMIN_EMAIL}\n\n"
+            "Thank you for your support!\n"
+            "The PINS team"
+        ),
+        [winning_bid.user.email],
+    )
+
+
+def donor_email(auction_item, auction, item_url):
+    winning_bid = auction_item.bid_summary.winning_bid
+    return (
+        f"PINS Auction: Your item has sold! ({auction_item.title})",
+        (
+            "Your PINS auction item has been won:\n"
+            f"{auction_item.title} ({auction.title})\n"
+            f"{item_url}\n\n"
+            f"Please ship it to:\n\n"
+            f"{winning_bid.format_shipping_details()}\n\n"
+            f"If you requested reimbursement for shipping costs, one of the admin team will be in contact shortly.\n\n"
+            "Thank you for your support!\n"
+            "The PINS team"
+        ),
+        [auction_item.donor_email],
+    )
+
+
+def _notify(auction, request, notified_field, build_email, auction_item_ids=None):
+    auction_items = AuctionItem.objects.child_of(auction).filter(
+        bid_summary__winning_bid__isnull=False, **{f"bid_summary__{notified_field}": False}
+    ).select_related("bid_summary__winning_bid__user").order_by("path")
+    if auction_item_ids is not None:
+        auction_items = auction_items.filter(id__in=auction_item_ids)
+
+    # Items are children of the auction, so build their urls from its url
+    # rather than routing each one
+    auction_url = auction.get_full_url(request)
+    emails = []
+    for auction_item in auction_items:
+        subject, body, recipients = build_email(auction_item, auction, f"{auction_url}{auction_item.slug}/")
+        email = OutboxEmail(
+            message={
+                "subject": subject,
+                "body": body,
+                "from_email": settings.DEFAULT_FROM_EMAIL,
+                "to": recipients,
+                "reply_to": [settings.DEFAULT_ADMIN_EMAIL],
+            }
+        )
+        emails.append((auction_item, email))
+
+    if settings.EMAIL_OUTBOX:
+        OutboxEmail.objects.bulk_create([email for _, email in emails])
+        notified = [auction_item for auction_item, _ in emails]
+    else:
+        notified = []
+        connection = get_connection()
+        with connection:
+            for auction_item, email in emails:
+                try:
+                    email.build_message(connection=connection).send()
+                except Exception:
+                    logger.exception("Could not send %s email for auction item %s", notified_field, auction_item.id)
+                else:
+                    notified.append(auction_item)
+
+    winning_bids = []
+    for auction_item in notified:
+        winning_bid = auction_item.bid_summary.winning_bid
+        winning_bid.auction_item = auction_item
+        winning_bids.append(winning_bid)
+    with transaction.atomic():
+        Bid.objects.filter(id__in=[bid.id for bid in winning_bids]).update(**{notified_field: True})
+        AuctionItemBidSummary.objects.filter(
+            auction_item_id__in=[auction_item.id for auction_item in notified]
+        ).update(**{notified_field: True})
+        AuctionItemLog.objects.bulk_create(
+            [bid.build_bid_log(changed_by=request.user, **{notified_field: True}) for bid in winning_bids]
+        )
+    return len(notified), len(emails) - len(notified)
+
+
+def notify_winners(auction, request, auction_item_ids=None):
+    """
+    Email the winners of items in the auction that haven't been notified yet.
+    Returns the number of winners notified and the number of emails that
+    failed to send.
+    """
+    return _notify(auction, request, "winner_notified", winner_email, auction_item_ids=auction_item_ids)
+
+
+def notify_donors(auction, request, auction_item_ids=None):
+    """
+    Email the donors of sold items in the auction that haven't been notified
+    yet. Returns the number of donors notified and the number of emails that
+    failed to send.
+    """
+    return _notify(auction, request, "donor_notified", donor_email, auction_item_ids=auction_item_ids)
@@ -0,0 +1,24 @@
+import wagtail_factories
+
+from ..models import Auction, AuctionItem, AuctionsPage
+
+
+class AuctionsPageFactory(wagtail_factories.PageFactory):
+    title = "Auctions"
+    class Meta:
+        model = AuctionsPage
+
+
+class AuctionFactory(wagtail_factories.PageFactory):
+    title = "Test Auction"
+    class Meta:
+        model = Auction
+
+
+class AuctionItemFactory(wagtail_factories.PageFactory):
+    donor = "Donald Duck"
+    donor_email = "donald@test.com"
+    starting_bid = 5
+    postage = 2
+    class Meta:
+        model = AuctionItem
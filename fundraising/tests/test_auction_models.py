@@ -0,0 +1,241 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from wagtail_factories import ImageFactory
+
+from ..wagtail_hooks import AuctionItemLogFilterSet, BidFilterSet
+
+from ..models import Bid, BidForm, UserShippingAddress, AuctionItem, AuctionItemBidSummary, AuctionItemLog, AuctionItemPhoto, auction_card_image_cache_key
+
+pytestmark = pytest.mark.django_db
+
+
+def test_auction_item_bid_summary(auction_item, bid):
+    item = auction_item()
+    assert item.current_winning_bid() == 0
+    assert item.current_winning_bid_obj is None
+    assert item.bid_count() == 0
+    assert item.minimum_bid() == 5
+    assert item.total_due() == 0
+    assert item.winner() is None
+
+    bid(item, 10)
+    winning = bid(item, 12, name="Minnie Mouse")
+    item = AuctionItem.objects.get(id=item.id)
+    assert item.current_winning_bid() == 12
+    assert item.current_winning_bid_obj == winning
+    assert item.bid_count() == 2
+    assert item.minimum_bid().quantize(Decimal("0.01")) == Decimal("12.01")
+    assert item.total_due() == 14
+    assert item.winner() == f"Minnie Mouse ({winning.user})"
+    assert not item.winner_notified()
+
+    winning.winner_notified = True
+    winning.save()
+    item = AuctionItem.objects.get(id=item.id)
+    assert item.winner_notified()
+
+
+def test_auction_item_bid_summary_withdrawn_and_deleted(auction_item, bid):
+    item = auction_item()
+    first = bid(item, 10)
+    second = bid(item, 12)
+
+    second.withdrawn = True
+    second.save()
+    summary = AuctionItemBidSummary.objects.get(auction_item=item)
+    assert (summary.max_amount, summary.winning_bid, summary.bid_count, summary.active_bid_count) == (10, first, 2, 1)
+
+    first.delete()
+    summary.refresh_from_db()
+    assert (summary.max_amount, summary.winning_bid, summary.bid_count, summary.active_bid_count) == (0, None, 1, 0)
+
+    # Deleting the item deletes its bids and summary
+    item.delete()
+    assert not AuctionItemBidSummary.objects.exists()
+
+
+def test_bid_changes_lock_bid_summary(auction_item, bid):
+    item = auction_item()
+    placed = bid(item, 10)
+    lock = AuctionItemBidSummary.lock
+    withdrawn_when_locked = []
+
+    def record_lock(auction_item_id):
+        withdrawn_when_locked.append(Bid.objects.filter(id=placed.id).values_list("withdrawn", flat=True).first())
+        return lock(auction_item_id)
+
+    # The item is locked before the bid is changed (e.g. by an admin) or deleted
+    with patch.object(AuctionItemBidSummary, "lock", side_effect=record_lock):
+        placed.withdrawn = True
+        placed.save()
+        placed.delete()
+    assert withdrawn_when_locked == [False, True]
+
+
+def test_auction_detail_queries_independent_of_items(admin_client, auction, auction_item, bid):
+    url = reverse("auction_detail", args=(auction.id,))
+    bid(auction_item(), 10)
+
+    def _get_queries(ordering):
+        with CaptureQueriesContext(connection) as queries:
+            resp = admin_client.get(url, {"ordering": ordering})
+            assert resp.status_code == 200
+        return len(queries)
+
+    _get_queries("winner")
+    baseline = _get_queries("winner")
+    for i in range(5):
+        bid(auction_item(title=f"Item {i}"), 10 + i)
+    assert _get_queries("winner") == baseline
+    assert _get_queries("-total_due") == baseline
+
+
+def test_auction_page_queries_independent_of_items(rf, auction, auction_item, bid):
+    image = ImageFactory()
+    for i in range(2):
+        item = auction_item(title=f"Item {i}")
+        AuctionItemPhoto.objects.create(page=item, image=image)
+        bid(item, 10)
+
+    def _get_queries():
+        with CaptureQueriesContext(connection) as queries:
+            request = rf.get("/")
+            request.user = AnonymousUser()
+            resp = auction.serve(request).render()
+        return resp, len(queries)
+
+    resp, _ = _get_queries()
+    assert resp.content.decode().count(">1</span> bids") == 2
+    resp, baseline = _get_queries()
+    for i in range(3):
+        auction_item(title=f"Another item {i}")
+    resp, queries = _get_queries()
+    assert queries == baseline
+    assert "No photo available" in resp.content.decode()
+
+
+def test_auction_card_image_cache(auction, auction_item):
+    image = ImageFactory(title="Photo", file__width=400, file__height=400)
+    item = auction_item()
+    AuctionItemPhoto.objects.create(page=item, image=image)
+    AuctionItemPhoto.objects.create(page=item, image=ImageFactory(title="Second photo"))
+
+    categories = auction.categories()
+    [listed] = categories[item.category]
+    assert listed.card_image["alt"] == "Photo"
+    assert listed.card_image["width"] == 180
+    assert cache.get(auction_card_image_cache_key(image.id)) == listed.card_image
+
+    image.title = "Renamed"
+    image.save()
+    assert cache.get(auction_card_image_cache_key(image.id)) is None
+    [listed] = auction.categories()[item.category]
+    assert listed.card_image["alt"] == "Renamed"
+
+
+def test_winning_bids(auction_item, bid):
+    item, other_item, no_bids_item = [auction_item(title=f"Item {i}") for i in range(3)]
+    bid(item, 10)
+    winning = bid(item, 12)
+    bid(item, 15, withdrawn=True)
+    tied = bid(other_item, 20)
+    bid(other_item, 20)
+
+    assert set(Bid.objects.winning()) == {winning, tied}
+    assert list(Bid.objects.filter(auction_item=item).winning()) == [winning]
+    # filters on the queryset don't change which bid wins
+    assert not Bid.objects.filter(amount__lt=12).winning().exists()
+    assert winning.is_winner()
+    assert not Bid.objects.get(auction_item=item, amount=10).is_winner()
+
+
+def test_bid_filter_set_winning(auction, auction_item, bid):
+    item = auction_item()
+    bid(item, 10)
+    winning = bid(item, 12)
+    bid(item, 15, withdrawn=True)
+    filterset = BidFilterSet({"auction": auction.id, "limit_to": "winning"}, queryset=Bid.objects.all())
+    assert list(filterset.qs) == [winning]
+
+
+def test_auction_item_log_filter_set(auction, auction_item, bid):
+    item = auction_item()
+    bid(item, 10)
+    # logs can't be limited to winning bids
+    filterset = AuctionItemLogFilterSet(
+        {"auction": auction.id, "limit_to": "winning"}, queryset=AuctionItemLog.objects.all()
+    )
+    assert "limit_to" not in filterset.filters
+    assert list(filterset.qs) == list(item.logs.all())
+
+
+def test_bid_save_logs_changes(auction_item, bid):
+    item = auction_item()
+    new_bid = bid(item, 10)
+    assert list(item.logs.values_list("log", flat=True)) == [f"User {new_bid.user} ({new_bid.user.id}) created bid: £10"]
+
+    saved_bid = Bid.objects.get(id=new_bid.id)
+    placed_at = saved_bid.placed_at
+    saved_bid.notify = False
+    saved_bid.save()
+    assert item.logs.count() == 1
+
+    saved_bid.amount = 12
+    saved_bid.withdrawn = True
+    saved_bid.save()
+    assert saved_bid.placed_at > placed_at
+    assert set(item.logs.values_list("log", flat=True)) == {
+        f"User {new_bid.user} ({new_bid.user.id}) created bid: £10",
+        f"User {new_bid.user} ({new_bid.user.id}) updated bid: £12",
+        f"Bid withdrawn for User {new_bid.user} ({new_bid.user.id})",
+    }
+
+
+def test_bid_save_queries(auction_item, bid, django_assert_num_queries):
+    item = auction_item()
+    saved_bid = Bid.objects.select_related("user", "auction_item").get(id=bid(item, 10).id)
+    saved_bid.amount = 12
+    # savepoint, summary lock, address, bid, log, summary (winning bid with counts, upsert), release;
+    # it was 14 queries when each change fetched the bid, address and summary again
+    with django_assert_num_queries(8):
+        saved_bid.save()
+
+
+def test_bid_shipping_addresses(auction_item, bid):
+    item = auction_item()
+    first = bid(item, 10, address_line_1=" 1 Test St ")
+    assert first.address_line_1 == "1 Test St"
+    bid(auction_item(title="Other"), 10, user=first.user)
+    bid(auction_item(title="Another"), 10, user=first.user, postcode="T2")
+    addresses = UserShippingAddress.objects.filter(user=first.user).order_by("id")
+    assert [address.postcode for address in addresses] == ["T1", "T2"]
+    assert addresses[0].address_key == UserShippingAddress.make_address_key(first)
+
+    # Editing an address to match another of the user's addresses merges them
+    addresses[1].postcode = "T1"
+    addresses[1].save()
+    assert addresses[1].pk == addresses[0].pk
+    assert list(UserShippingAddress.objects.filter(user=first.user).values_list("postcode", flat=True)) == ["T1"]
+
+
+def test_bid_form_lower_amount(auction_item, bid):
+    item = auction_item()
+    bid(item, 8)
+    existing = bid(item, 10)
+    data = {
+        "amount": 7, "auction_item": item.id, "user": existing.user.id, "name": "Mickey Mouse",
+        "address_line_1": "1 Test St", "town_city": "Test", "county": "Test", "postcode": "T1",
+        "data_processing_consent": True,
+    }
+    form = BidForm(data, initial={"auction_item": item.id, "user": existing.user.id}, instance=existing, auction_item_page=item)
+    assert not form.is_valid()
+    assert form.errors["amount"] == ["Please enter an amount of at least £10.01"]
@@ -0,0 +1,355 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from model_bakery import baker
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from home.models import OutboxEmail
+
+from ..models import AuctionItem, AuctionItemBidSummary, AuctionItemLog, AuctionResult, Bid
+
+pytestmark = pytest.mark.django_db
+
+
+def test_auction_item_bid_totals(client, auction_item, bid, django_assert_num_queries):
+    item = auction_item()
+    other_item = auction_item(title="Other")
+    bid(item, 10)
+    bid(other_item, 20)
+
+    url = reverse("fundraising:auction_item_bid_totals", args=(item.id,))
+    resp = client.get(url)
+    assert resp.json() == {"items": [{"item": item.id, "max_amount": "10.00", "bid_count": 1}]}
+
+    # cached briefly for everyone polling the page
+    bid(item, 12)
+    with django_assert_num_queries(0):
+        assert client.get(url).json()["items"][0]["max_amount"] == "10.00"
+    cache.delete(f"auction_item_bid_totals:{item.id}")
+    assert client.get(url).json() == {"items": [{"item": item.id, "max_amount": "12.00", "bid_count": 2}]}
+
+
+def test_auction_bid_totals(client, rf, settings, auction, auction_item, bid):
+    settings.AUCTION_BID_TOTALS_POLL_INTERVAL = 7
+    items = [auction_item(title=f"Item {i}") for i in range(3)]
+    for i, item in enumerate(items[:2]):
+        bid(item, 10 + i)
+
+    url = reverse("fundraising:auction_bid_totals", args=(auction.id,))
+    request = rf.get(auction.url, SERVER_PORT=8000)
+    request.user = AnonymousUser()
+    html = auction.serve(request).render().content.decode()
+    assert f'fetch("{url}")' in html
+    assert "}, 7 * 1000);" in html
+
+    resp = client.get(url)
+    assert sorted(resp.json()["items"], key=lambda item: item["item"]) == [
+        {"item": items[0].id, "max_amount": "10.00", "bid_count": 1},
+        {"item": items[1].id, "max_amount": "11.00", "bid_count": 1},
+    ]
+
+
+def test_bid_totals_closed_auction(client, auction, auction_item):
+    item = auction_item()
+    auction.close_at = timezone.now() - timedelta(minutes=1)
+    auction.save()
+    # 204 stops the page polling
+    resp = client.get(reverse("fundraising:auction_bid_totals", args=(auction.id,)))
+    assert resp.status_code == 204
+    resp = client.get(reverse("fundraising:auction_item_bid_totals", args=(item.id,)))
+    assert resp.status_code == 204
+    resp = client.get(reverse("fundraising:auction_item_bid_totals", args=(item.id + 100,)))
+    assert resp.status_code == 404
+
+
+@pytest.fixture
+def closed_auction_items(auction, auction_item, bid):
+    items = [auction_item(title=f"Item {i}") for i in range(3)]
+    for i, item in enumerate(items[:2]):
+        bid(item, 10 + i)
+    auction.close_at = timezone.now() - timedelta(minutes=1)
+    auction.save()
+    yield items
+
+
+def test_notify_winners(admin_client, auction, closed_auction_items):
+    items = closed_auction_items
+    resp = admin_client.post(reverse("fundraising:notify_auction_winners", args=(auction.id,)), follow=True)
+    assert "2 winners have been notified" in resp.content.decode()
+    assert len(mail.outbox) == 2
+    assert mail.outbox[0].subject == "PINS Auction: You have won! (Item 0)"
+    assert f"{auction.full_url}item-0/" in mail.outbox[0].body
+    assert "Your total amount due, including shipping is £12.00" in mail.outbox[0].body
+    for item in items[:2]:
+        item = AuctionItem.objects.get(id=item.id)
+        assert item.winner_notified()
+        assert item.current_winning_bid_obj.winner_notified
+        assert item.logs.filter(log__startswith=f"Winner {item.current_winning_bid_obj.user}").exists()
+    assert not items[2].logs.filter(log__startswith="Winner").exists()
+
+    # already notified
+    resp = admin_client.post(reverse("fundraising:notify_auction_winners", args=(auction.id,)), follow=True)
+    assert "0 winners have been notified" in resp.content.decode()
+    assert len(mail.outbox) == 2
+
+
+def test_notify_winners_queries_independent_of_items(
+    admin_client, auction, closed_auction_items, auction_item, bid, django_assert_max_num_queries
+):
+    url = reverse("fundraising:notify_auction_winners", args=(auction.id,))
+    with CaptureQueriesContext(connection) as queries:
+        admin_client.post(url)
+    for i in range(5):
+        bid(auction_item(title=f"Another item {i}"), 10)
+    Bid.objects.update(winner_notified=False)
+    AuctionItemBidSummary.objects.update(winner_notified=False)
+    with django_assert_max_num_queries(len(queries)):
+        admin_client.post(url)
+    assert len(mail.outbox) == 2 + 7
+
+
+def test_notify_winners_send_failure(admin_client, auction, closed_auction_items):
+    with patch("django.core.mail.EmailMessage.send", side_effect=[1, ValueError("boom")]):
+        resp = admin_client.post(reverse("fundraising:notify_auction_winners", args=(auction.id,)), follow=True)
+    content = resp.content.decode()
+    assert "1 winners have been notified" in content
+    assert "1 emails could not be sent" in content
+    assert AuctionItemBidSummary.objects.filter(winner_notified=True).count() == 1
+
+
+def test_notify_winners_outbox(admin_client, settings, auction, closed_auction_items):
+    settings.EMAIL_OUTBOX = True
+    admin_client.post(reverse("fundraising:notify_auction_winners", args=(auction.id,)))
+    assert not mail.outbox
+    assert OutboxEmail.objects.count() == 2
+    assert OutboxEmail.process() == (2, 0)
+    assert len(mail.outbox) == 2
+
+
+def test_notify_donors(admin_client, auction, closed_auction_items):
+    resp = admin_client.post(reverse("fundraising:notify_auction_donors", args=(auction.id,)), follow=True)
+    assert "2 donors have been notified" in resp.content.decode()
+    assert [email.to for email in mail.outbox] == [["donald@test.com"], ["donald@test.com"]]
+    assert "Please ship it to:\n\nMickey Mouse\n1 Test St" in mail.outbox[0].body
+    assert AuctionItemBidSummary.objects.filter(donor_notified=True).count() == 2
+    assert AuctionItemLog.objects.filter(log__startswith="Donor Donald Duck notified").count() == 2
+
+
+@pytest.mark.parametrize(
+    "url_name", ["notify_auction_winners", "notify_auction_donors"]
+)
+def test_notify_requires_admin_access(client, url_name, auction, closed_auction_items):
+    url = reverse(f"fundraising:{url_name}", args=(auction.id,))
+    resp = client.post(url)
+    assert resp.status_code == 302
+    assert resp.url.startswith(reverse("wagtailadmin_login"))
+
+    client.force_login(baker.make("auth.User"))
+    client.post(url)
+    assert not mail.outbox
+    assert not AuctionItemBidSummary.objects.filter(winner_notified=True).exists()
+    assert not AuctionItemBidSummary.objects.filter(donor_notified=True).exists()
+
+
+def test_notify_auction_item_winner(admin_client, auction, closed_auction_items):
+    item = closed_auction_items[0]
+    resp = admin_client.post(reverse("fundraising:notify_auction_item_winner", args=(item.id,)), follow=True)
+    assert "Winner has been notified by email" in resp.content.decode()
+    assert len(mail.outbox) == 1
+    assert AuctionItemBidSummary.objects.filter(winner_notified=True).get().auction_item_id == item.id
+
+
+def test_auction_close_out(auction, closed_auction_items):
+    items = closed_auction_items
+    results = auction.close_out()
+    assert [(result.auction_item_id, result.sold, result.amount, result.total_due) for result in results] == [
+        (items[0].id, True, 10, 12),
+        (items[1].id, True, 11, 13),
+        (items[2].id, False, 0, 0),
+    ]
+    assert results[0].winner_email == items[0].bids.get().user.email
+    # only written once
+    assert auction.close_out() == []
+    assert AuctionResult.objects.count() == 3
+
+
+def test_auction_close_out_open_auction(auction, auction_item, bid):
+    bid(auction_item(), 10)
+    assert auction.close_out() == []
+    assert not AuctionResult.objects.exists()
+
+
+def test_auction_results_unaffected_by_later_bid_changes(admin_client, auction, closed_auction_items, bid):
+    item = closed_auction_items[0]
+    admin_client.get(reverse("auction_detail", args=(auction.id,)))
+    # e.g. a bid changed directly in the database
+    Bid.objects.filter(auction_item=item).update(amount=50)
+    bid(item, 100).delete()
+
+    resp = admin_client.get(reverse("auction_item_result", args=(item.id,)))
+    assert "Sold to Mickey Mouse" in resp.content.decode()
+    assert resp.context["result"].amount == 10
+    resp = admin_client.get(reverse("auction_detail", args=(auction.id,)))
+    assert "£12.00" in resp.content.decode()
+
+
+def test_auction_result_rewritten_when_admin_withdraws_bid(admin_client, auction, closed_auction_items, bid):
+    item = closed_auction_items[0]
+    lower_bid = bid(item, 8, name="Minnie Mouse")
+    auction.close_out()
+    winning_bid = AuctionResult.objects.get(auction_item=item).winning_bid
+    admin_client.post(reverse("fundraising:toggle_withdrawn_bid", args=(winning_bid.id,)))
+    result = AuctionResult.objects.get(auction_item=item)
+    assert (result.winning_bid, result.winner_name, result.amount) == (lower_bid, "Minnie Mouse", 8)
+
+
+def test_close_out_auctions_command(auction, closed_auction_items):
+    out = StringIO()
+    call_command("close_out_auctions", stdout=out)
+    assert out.getvalue() == "Test Auction: 3 results written (2 sold)\n"
+    out = StringIO()
+    call_command("close_out_auctions", auction.id, stdout=out)
+    assert out.getvalue() == ""
+
+
+def test_send_unsold_auction_emails(auction, closed_auction_items):
+    call_command("send_unsold_auction_emails", auction.id)
+    assert len(mail.outbox) == 1
+    assert "- Item 2" in mail.outbox[0].body
+    assert AuctionItem.objects.get(id=closed_auction_items[2].id).unsold_notification_sent
+    call_command("send_unsold_auction_emails", auction.id)
+    assert len(mail.outbox) == 1
+
+
+def test_auction_results_export(admin_client, auction, closed_auction_items):
+    auction.close_out()
+    resp = admin_client.get(reverse("wagtailsnippets_fundraising_auctionresult:list"), {"export": "csv"})
+    assert resp.status_code == 200
+    rows = b"".join(resp.streaming_content).decode().splitlines()
+    assert len(rows) == 4
+    resp = admin_client.get(reverse("wagtailsnippets_fundraising_auctionresult:add"))
+    assert resp.status_code == 302
+
+
+@pytest.fixture
+def post_bid(rf):
+    def _post_bid(auction_item, user, amount, **data):
+        request = rf.post(
+            auction_item.url,
+            {
+                "user": user.id,
+                "auction_item": auction_item.id,
+                "amount": amount,
+                "notify": True,
+                "name": "Minnie Mouse",
+                "address_line_1": "2 Test St",
+                "town_city": "Test",
+                "county": "Test",
+                "postcode": "T2",
+                "data_processing_consent": True,
+                **data,
+            },
+        )
+        request.user = user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        return AuctionItem.objects.get(id=auction_item.id).serve(request)
+    return _post_bid
+
+
+def test_place_bid_emails_outbid_winner(
+    auction_item, bid, post_bid, django_user_model, django_capture_on_commit_callbacks
+):
+    item = auction_item()
+    bid(item, 10, notify=True)
+    winning = bid(item, 15, notify=True)
+    user = baker.make(django_user_model, email="new@test.com")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        resp = post_bid(item, user, 20, expected_max_amount="15.00", idempotency_key="abc")
+    assert resp.status_code == 302
+    assert Bid.objects.get(user=user).is_winner()
+    # only the bid that was winning, not every lower bidder
+    assert [email.to for email in mail.outbox] == [[winning.user.email]]
+
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        resp = post_bid(item, baker.make(django_user_model), 12, expected_max_amount="20.00", idempotency_key="def")
+    # a lower bid doesn't out-bid anyone
+    assert resp.status_code == 302
+    assert mail.outbox == []
+
+
+def test_place_bid_repeated_submission(
+    auction_item, bid, post_bid, django_user_model, django_capture_on_commit_callbacks
+):
+    item = auction_item()
+    bid(item, 10, notify=True)
+    user = baker.make(django_user_model, email="new@test.com")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        post_bid(item, user, 20, expected_max_amount="10.00", idempotency_key="abc")
+        resp = post_bid(item, user, 20, expected_max_amount="10.00", idempotency_key="abc")
+    assert resp.status_code == 302
+    assert item.bids.filter(user=user).count() == 1
+    assert len(mail.outbox) == 1
+    assert AuctionItemBidSummary.objects.get(auction_item=item).bid_count == 2
+
+
+def test_place_bid_conflict(auction_item, bid, post_bid, django_user_model):
+    item = auction_item()
+    bid(item, 25)
+    user = baker.make(django_user_model)
+
+    # someone else bid 25 after the page showed 10
+    resp = post_bid(item, user, 20, expected_max_amount="10.00", idempotency_key="abc")
+    assert resp.status_code == 200
+    assert resp.context_data["form"].errors["amount"][0].startswith("Another bid of £25.00")
+    assert not item.bids.filter(user=user).exists()
+
+    assert resp.context_data["form"].expected_max_amount_field.value == 25
+
+    # bidding more than the current highest bid is fine
+    resp = post_bid(item, user, 30, expected_max_amount="10.00", idempotency_key="ghi")
+    assert resp.status_code == 302
+    assert Bid.objects.get(user=user).is_winner()
+
+
+def test_place_bid_rate_limited(settings, auction_item, post_bid, django_user_model):
+    settings.AUCTION_BID_RATE_LIMIT = 2
+    item = auction_item()
+    user = baker.make(django_user_model)
+
+    for amount in [10, 11]:
+        assert post_bid(item, user, amount, idempotency_key=f"key{amount}").status_code == 302
+    # repeated submissions don't count
+    assert post_bid(item, user, 11, idempotency_key="key11").status_code == 302
+    resp = post_bid(item, user, 12, idempotency_key="key12")
+    assert resp.status_code == 200
+    assert resp.context_data["form"].errors["amount"] == [
+        "You have placed too many bids; please wait a minute and try again."
+    ]
+    assert list(item.bids.filter(user=user).values_list("amount", flat=True).order_by("amount")) == [10, 11]
+
+
+def test_delete_bid_twice(rf, auction_item, bid):
+    item = auction_item()
+    placed = bid(item, 10)
+    for _ in range(2):
+        request = rf.post(item.url, {"id": placed.id, "delete_bid": True})
+        request.user = placed.user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        assert item.serve(request).status_code == 302
+    assert not item.bids.exists()
@@ -2,6 +2,7 @@ import pytest
 
 from model_bakery import baker
 
+from ..context_processors import recipes
 from ..models import RecipeBookSubmission
 
 pytestmark = pytest.mark.django_db
@@ -34,3 +35,29 @@ def test_recipe_book_submission_page_type_cost(page_type, cost):
 def test_recipe_book_submission_status(paid, processing, complete, expected):
     submission = baker.make(RecipeBookSubmission, paid=paid, processing=processing, complete=complete)
     assert submission.status() == expected
+
+
+def test_recipe_book_submission_totals(django_assert_num_queries):
+    baker.make(RecipeBookSubmission, page_type="single", paid=True)
+    baker.make(RecipeBookSubmission, page_type="double", paid=False)
+    submission = baker.make(RecipeBookSubmission, page_type="photo", paid=False)
+
+    with django_assert_num_queries(1):
+        assert RecipeBookSubmission.totals() == {"pages": 4, "money": 20, "pending": 15}
+        # cached
+        RecipeBookSubmission.totals()
+
+    submission.paid = True
+    submission.save()
+    assert RecipeBookSubmission.totals() == {"pages": 4, "money": 20, "pending": 10}
+    submission.delete()
+    assert RecipeBookSubmission.totals() == {"pages": 3, "money": 15, "pending": 10}
+
+
+def test_recipes_context_processor_is_lazy(rf, django_assert_num_queries):
+    baker.make(RecipeBookSubmission, page_type="double", paid=False)
+    with django_assert_num_queries(0):
+        context = recipes(rf.get("/"))
+    with django_assert_num_queries(1):
+        assert context["total_recipe_book_pages"]() == 2
+        assert context["total_recipe_book_pending"]() == 10
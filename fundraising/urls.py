@@ -3,7 +3,8 @@ from django.urls import include, path
 from .views import (
     RecipeBookSubmissionCreateView, RecipeBookSubmissionDetailView, RecipeBookSubmissionUpdateView, 
     update_form_fields, method_char_count, profile_caption_char_count, submitted_recipes, user_bids, notify_winners,
-    notify_auction_item_donor, notify_auction_item_winner, toggle_withdrawn_bid
+    notify_donors, notify_auction_item_donor, notify_auction_item_winner, toggle_withdrawn_bid, auction_bid_totals,
+    auction_item_bid_totals
 )
 app_name = "fundraising"
 urlpatterns = [
@@ -40,6 +41,9 @@ urlpatterns = [
     path(
         "auction/<pk>/notify-winners", notify_winners, name="notify_auction_winners", 
     ),
+    path(
+        "auction/<pk>/notify-donors", notify_donors, name="notify_auction_donors",
+    ),
     path(
         "auction/item/<pk>/notify-winner", notify_auction_item_winner, name="notify_auction_item_winner", 
     ),
@@ -48,6 +52,12 @@ urlpatterns = [
     ),
     path(
         "auction/bid/<pk>/withdraw", toggle_withdrawn_bid, name="toggle_withdrawn_bid", 
-    )
+    ),
+    path(
+        "auction/<pk>/bid-totals", auction_bid_totals, name="auction_bid_totals",
+    ),
+    path(
+        "auction/item/<pk>/bid-totals", auction_item_bid_totals, name="auction_item_bid_totals",
+    ),
 
 ]
@@ -4,8 +4,10 @@ from django.conf import settings
 from django.core.mail import send_mail
 from wagtail.admin.mail import send_mail as wagtail_send_mail
 from django.contrib import messages
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, HttpResponse, get_object_or_404
 from django.views.decorators.http import require_POST
+from wagtail.admin.auth import require_admin_access
 
 from django.urls import reverse
 from django.template.response import TemplateResponse
@@ -17,9 +19,13 @@ from payments.utils import get_paypal_form
 
 
 from payments.utils import signature
+from common.cache import get_or_build
 
+from . import notifications
 from .forms import RecipeBookContrbutionForm, RecipeBookContrbutionEditForm
-from .models import RecipeBookSubmission, Bid, Auction, AuctionItem
+from .models import (
+    RecipeBookSubmission, Bid, Auction, AuctionItem, AuctionItemBidSummary
+)
 
 
 class RecipeBookSubmissionCreateView(CreateView):
@@ -159,27 +165,50 @@ def user_bids(request, auction_slug):
     )
 
 
-def withdraw_bid(request, bid_id):
-    # called via htmx from admin bids page
-    bid = get_object_or_404(Bid, pk=bid_id)
-    bid.withdrawn = True
-    bid.save()
-    auction_item = bid.auction_item
-
-    send_mail(
-        "PINS Auction: Your bid has been withdrawn",
-        (
-            "An admin has withdrawn your bid on the following PINS auction item:\n"
-            f"{auction_item.title} ({auction_item.get_parent().title})\n\n"
-        ),
-        [bid.user.email],
-        settings.DEFAULT_FROM_EMAIL,
-        reply_to=[settings.DEFAULT_ADMIN_EMAIL],
-    )
+def get_bid_totals(key, get_auction_item_ids):
+    """
+    Cached highest bid and bid count for each of the items, or None if they
+    aren't found, or if their auction has closed. Auction pages poll for these
+    every settings.AUCTION_BID_TOTALS_POLL_INTERVAL seconds, so the totals are
+    cached briefly for everyone viewing the same page.
+    """
+    def build():
+        auction_item_ids = get_auction_item_ids()
+        if auction_item_ids is None:
+            return None
+        return [
+            summary.as_totals()
+            for summary in AuctionItemBidSummary.objects.filter(auction_item_id__in=auction_item_ids)
+        ]
+
+    return get_or_build(key, build, settings.AUCTION_BID_TOTALS_CACHE_TIMEOUT)
+
+
+def bid_totals_response(totals):
+    if totals is None:
+        # 204 tells the page to stop polling
+        return HttpResponse(status=204)
+    response = JsonResponse({"items": totals})
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def auction_bid_totals(request, pk):
+    def get_auction_item_ids():
+        auction = get_object_or_404(Auction.objects.live(), pk=pk)
+        if not auction.is_closed():
+            return list(AuctionItem.objects.child_of(auction).live().values_list("id", flat=True))
+
+    return bid_totals_response(get_bid_totals(f"auction_bid_totals:{pk}", get_auction_item_ids))
+
+
+def auction_item_bid_totals(request, pk):
+    def get_auction_item_ids():
+        auction_item = get_object_or_404(AuctionItem.objects.live(), pk=pk)
+        if not auction_item.get_parent().specific.is_closed():
+            return [auction_item.id]
 
-    resp = HttpResponse()
-    resp.headers["HX-Refresh"] = "true"
-    return resp
+    return bid_totals_response(get_bid_totals(f"auction_item_bid_totals:{pk}", get_auction_item_ids))
 
 
 @require_POST
@@ -195,6 +224,7 @@ def toggle_withdrawn_bid(request, pk):
 
 
 @require_POST
+@require_admin_access
 def notify_auction_item_donor(request, pk):
     auction_item = get_object_or_404(AuctionItem, pk=pk)
     auction = auction_item.get_parent().specific
@@ -209,6 +239,7 @@ def notify_auction_item_donor(request, pk):
 
 
 @require_POST
+@require_admin_access
 def notify_auction_item_winner(request, pk):
     auction_item = get_object_or_404(AuctionItem, pk=pk)
     auction = auction_item.get_parent().specific
@@ -223,17 +254,30 @@ def notify_auction_item_winner(request, pk):
 
 
 @require_POST
+@require_admin_access
 def notify_winners(request, pk):
     # called from admin auction detail page
     auction = get_object_or_404(Auction, pk=pk)
     if not auction.is_closed():
         messages.error(request, "Cannot notify winners; auction is not yet closed")
     else:
-        auction_items = auction.get_children().specific()
-        notified_count = 0
-        for auction_item in auction_items:
-            notified = auction_item.notify_winner(request)
-            if notified:
-                notified_count += 1
+        notified_count, failed_count = notifications.notify_winners(auction, request)
         messages.success(request, f"{notified_count} winners have been notified")
+        if failed_count:
+            messages.error(request, f"{failed_count} emails could not be sent; try notifying winners again")
+    return redirect(reverse("auction_detail", args=(pk,)))
+
+
+@require_POST
+@require_admin_access
+def notify_donors(request, pk):
+    # called from admin auction detail page
+    auction = get_object_or_404(Auction, pk=pk)
+    if not auction.is_closed():
+        messages.error(request, "Cannot notify donors; auction is not yet closed")
+    else:
+        notified_count, failed_count = notifications.notify_donors(auction, request)
+        messages.success(request, f"{notified_count} donors have been notified")
+        if failed_count:
+            messages.error(request, f"{failed_count} emails could not be sent; try notifying donors again")
     return redirect(reverse("auction_detail", args=(pk,)))
@@ -10,11 +10,12 @@ from wagtail.admin.views.pages.bulk_actions.page_bulk_action import PageBulkActi
 
 from wagtail.admin.panels import FieldPanel, TabbedInterface, ObjectList, InlinePanel
 from wagtail.admin.menu import Menu, MenuItem, SubmenuMenuItem
+from wagtail.permission_policies import ModelPermissionPolicy
 
 from django_filters.filters import ChoiceFilter
 
 from .admin_views import auctions_index, auction_detail, auction_docs, auction_item_bids, auction_item_log, auction_item_bid, auction_item_result
-from .models import RecipeBookSubmission, AuctionCategory, Bid, Auction, AuctionItemLog, AuctionItem
+from .models import RecipeBookSubmission, AuctionCategory, Bid, Auction, AuctionItemLog, AuctionItem, AuctionResult
 from paypal.standard.ipn.models import PayPalIPN
 
 
@@ -205,11 +206,18 @@ class AuctionCategoryViewSet(SnippetViewSet):
     add_to_settings_menu = True
 
 
-from django.db.models import Max, Q
-
-class BidFilterSet(WagtailFilterSet):
+class AuctionItemFilterSet(WagtailFilterSet):
+    """Filters for models with an auction_item"""
 
     auction = ChoiceFilter(choices=Auction.objects.values_list("id", "title"), method="filter_by_auction", label="Auction")
+
+    def filter_by_auction(self, queryset, name, value):
+        auction_item_ids = Auction.objects.get(id=value).get_children().specific().values_list('id', flat=True)
+        return queryset.filter(auction_item__id__in=auction_item_ids)
+
+
+class BidFilterSet(AuctionItemFilterSet):
+
     limit_to = ChoiceFilter(choices=(("all", "All bids"), ("winning", "Winning bids only")), method="filter_by_limit_to", label="Limit to")
 
 
@@ -219,21 +227,23 @@ class BidFilterSet(WagtailFilterSet):
             "auction",
             "auction_item",
         ]
-    
-    def filter_by_auction(self, queryset, name, value):
-        auction_item_ids = Auction.objects.get(id=value).get_children().specific().values_list('id', flat=True)
-        return queryset.filter(auction_item__id__in=auction_item_ids)
 
     def filter_by_limit_to(self, queryset, name, value):
         if value == "winning":
-            max_bids = queryset.values('auction_item').annotate(max_bid=Max('amount')).order_by()
-            q_statement = Q()
-            for pair in max_bids:
-                q_statement |= (Q(auction_item__id=pair['auction_item']) & Q(amount=pair['max_bid']))
-            return queryset.filter(q_statement)
+            return queryset.winning()
         return queryset
 
 
+class AuctionItemLogFilterSet(AuctionItemFilterSet):
+
+    class Meta:
+        model = AuctionItemLog
+        fields = [
+            "auction",
+            "auction_item",
+        ]
+
+
 class BidViewSet(SnippetViewSet):
     model = Bid
     # template_prefix = "bid_"
@@ -262,7 +272,42 @@ class AuctionItemLogViewSet(SnippetViewSet):
     )
     fields = ("timestamp", "log", "auction_item")
 
-    filterset_class = BidFilterSet
+    filterset_class = AuctionItemLogFilterSet
+
+
+class ReadOnlyPermissionPolicy(ModelPermissionPolicy):
+    def user_has_permission(self, user, action):
+        if action in ("add", "change", "delete"):
+            return False
+        return super().user_has_permission(user, action)
+
+
+class AuctionResultViewSet(SnippetViewSet):
+    model = AuctionResult
+    list_display = (
+        "auction_item", "auction", BooleanColumn("sold"), "winner_name", "amount", "total_due", "donor"
+    )
+    list_filter = ["auction", "sold"]
+    list_export = (
+        "auction",
+        "auction_item",
+        "sold",
+        "winner_name",
+        "winner_email",
+        "amount",
+        "postage",
+        "total_due",
+        "donor",
+        "donor_email",
+        "bid_count",
+        "closed_at",
+    )
+    export_filename = "auction_results"
+
+    @property
+    def permission_policy(self):
+        # results are written when the auction closes, not edited
+        return ReadOnlyPermissionPolicy(self.model)
 
 
 @hooks.register('register_admin_urls')
@@ -283,6 +328,7 @@ def register_auction_menu_item():
     submenu = Menu(items=[
         MenuItem('Auction Categories', reverse(AuctionCategoryViewSet().get_url_name("list")), icon_name='tablet-alt'),
         MenuItem('Auctions', reverse('auctions'), icon_name='tablet-alt'),
+        MenuItem('Auction Results', reverse(AuctionResultViewSet().get_url_name("list")), icon_name='tablet-alt'),
     ])
 
     return SubmenuMenuItem('Auctions', submenu, icon_name='hammer')
@@ -295,6 +341,7 @@ def register_auction_docs_menu_item():
 
 register_snippet(RecipeBookGroup)
 register_snippet(AuctionCategoryViewSet)
+register_snippet(AuctionResultViewSet)
 
 
 from django import forms
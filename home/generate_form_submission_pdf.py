@@ -1,8 +1,17 @@
+import hashlib
 import io
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
+from django import db
 from django.conf import settings
-
-from html2text import html2text
+from django.core.cache import close_caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
 
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
@@ -11,6 +20,59 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import pdfencrypt
 
 
+# Bump to regenerate stored PDFs after changing the layout below
+PDF_LAYOUT_VERSION = 1
+
+
+def pdf_storage_dir(submission):
+    return f"pdf_forms/{submission.pk}"
+
+
+def pdf_content_hash(submission):
+    """
+    Hash of everything that goes into a submission's PDF; the stored PDF is
+    regenerated whenever it changes
+    """
+    content = {
+        "layout": PDF_LAYOUT_VERSION,
+        # The key's version rather than the key itself, so no secret material
+        # goes into the stored file names
+        "key_version": settings.PDF_ENCRYPTION_KEY_VERSION,
+        "page": [submission.page_id, submission.page.title, submission.page.latest_revision_id],
+        "form_data": submission.form_data,
+        "is_draft": submission.is_draft,
+        "submit_time": submission.submit_time,
+        "name": submission.name,
+        "email": submission.email,
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, cls=DjangoJSONEncoder).encode()
+    ).hexdigest()
+
+
+def get_pdf(submission):
+    """
+    Returns an open file of the submission's (encrypted) PDF. It's generated
+    once for each version of the submission and kept in default storage.
+    """
+    storage_dir = pdf_storage_dir(submission)
+    path = f"{storage_dir}/{pdf_content_hash(submission)}.pdf"
+    if not default_storage.exists(path):
+        delete_stored_pdfs(submission)
+        path = default_storage.save(path, ContentFile(generate_pdf(submission).read()))
+    return default_storage.open(path, "rb")
+
+
+def delete_stored_pdfs(submission):
+    storage_dir = pdf_storage_dir(submission)
+    try:
+        _, filenames = default_storage.listdir(storage_dir)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        default_storage.delete(f"{storage_dir}/{filename}")
+
+
 def generate_pdf(submission):
     # Create a file-like buffer to receive PDF data.
     buffer = io.BytesIO()
@@ -51,8 +113,10 @@ def generate_pdf(submission):
             )
         return styles[style_name]
 
+    info_texts = submission.form_page.form_schema.text_info_texts
+
     def add_info_text(story_lines, field, info_location):
-        info_text = html2text(submission.form_page.form_field_info_texts[field][info_location])
+        info_text = info_texts[field][info_location]
         for line in info_text.split('\n'):
             leading_space = len(line) - len(line.lstrip())
             story_lines.append(
@@ -93,13 +157,13 @@ def generate_pdf(submission):
             [Paragraph(field, styles["Bold"]), Spacer(1, 5)]
         )
 
-        if field in submission.form_page.form_field_info_texts:
+        if field in info_texts:
             story = add_info_text(story, field, "before")
 
         for line in value.split('\n'):
             story.append(Paragraph(line, styles["Response"]))
 
-        if field in submission.form_page.form_field_info_texts:
+        if field in info_texts:
             story = add_info_text(story, field, "after")
 
         story.append(Spacer(1, 10))
@@ -109,3 +173,85 @@ def generate_pdf(submission):
     buffer.seek(0)
 
     return buffer
+
+
+def _export_pdf(submission_id):
+    # Runs in a worker process
+    from .models import PDFFormSubmission
+    submission = PDFFormSubmission.objects.get(pk=submission_id)
+    with get_pdf(submission) as pdf:
+        return submission.get_download_filename(), pdf.read()
+
+
+def export_pdfs(submission_ids, max_workers=None, progress=None):
+    """
+    Yields (filename, PDF content) for each submission, in order of completion.
+
+    PDFs are rendered (if not already stored) across a pool of max_workers
+    processes (default settings.PDF_EXPORT_WORKERS, or the number of CPUs), with
+    at most two per worker in flight at once. progress(done, total) is called
+    after each one.
+    """
+    submission_ids = list(submission_ids)
+    total = len(submission_ids)
+    max_workers = min(max_workers or settings.PDF_EXPORT_WORKERS or os.cpu_count(), total)
+
+    if max_workers <= 1:
+        for done, submission_id in enumerate(submission_ids, start=1):
+            yield _export_pdf(submission_id)
+            if progress:
+                progress(done, total)
+        return
+
+    # Forked workers open their own database and cache connections; don't
+    # share ours (e.g. pooled memcached sockets)
+    db.connections.close_all()
+    close_caches()
+    remaining = iter(submission_ids)
+    done = 0
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        pending = set()
+        while True:
+            for submission_id in remaining:
+                pending.add(executor.submit(_export_pdf, submission_id))
+                if len(pending) >= max_workers * 2:
+                    break
+            if not pending:
+                break
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                done += 1
+                yield future.result()
+                if progress:
+                    progress(done, total)
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only buffer for zipfile, emptied as each file is added"""
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_pdf_zip(submission_ids, max_workers=None, progress=None):
+    """
+    Yields the bytes of a zip file of the submissions' PDFs, as each PDF is
+    ready, so the whole zip is never held in memory
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, content in export_pdfs(submission_ids, max_workers=max_workers, progress=progress):
+            zip_file.writestr(filename, content)
+            yield stream.pop()
+    yield stream.pop()
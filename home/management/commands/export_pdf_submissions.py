@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from home.generate_form_submission_pdf import stream_pdf_zip
+from home.models import PDFFormPage
+
+
+class Command(BaseCommand):
+    help = 'Export the PDFs of submissions for a PDF form page to a zip file'
+
+    def add_arguments(self, parser):
+        parser.add_argument("page_id", type=int)
+        parser.add_argument("output", help="Path of the zip file to write")
+        parser.add_argument(
+            "--include-drafts",
+            action="store_true",
+            help="Include draft (not yet submitted) forms",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes to render PDFs with",
+        )
+
+    def handle(self, page_id, output, include_drafts, workers, **kwargs):
+        page = PDFFormPage.objects.get(id=page_id)
+        submissions = page.pdfformsubmission_set.all()
+        if not include_drafts:
+            submissions = submissions.filter(is_draft=False)
+        submission_ids = submissions.order_by("submit_time").values_list("id", flat=True)
+
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total} PDFs exported")
+
+        with open(output, "wb") as zip_file:
+            for chunk in stream_pdf_zip(submission_ids, max_workers=workers, progress=progress):
+                zip_file.write(chunk)
+        self.stdout.write(f"{page.title}: PDFs written to {output}")
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.models import OutboxEmail
+
+
+class Command(BaseCommand):
+    help = 'Send pending emails from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum number of emails to send",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, checking the outbox every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=10,
+            help="Seconds to wait between checks with --loop",
+        )
+
+    def handle(self, limit, loop, interval, **kwargs):
+        while True:
+            sent, failed = OutboxEmail.process(limit=limit)
+            if sent or failed or not loop:
+                self.stdout.write(f"{sent} emails sent, {failed} failed")
+            if not loop:
+                break
+            time.sleep(interval)
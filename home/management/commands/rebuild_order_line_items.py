@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from home.models import OrderFormPage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the order stock ledger from order form submission data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--page-ids",
+            nargs='+',
+            type=int,
+            default=[],
+            help="Rebuild specific order form page IDs only",
+        )
+
+    def handle(self, page_ids, **kwargs):
+        pages = OrderFormPage.objects.all()
+        if page_ids:
+            pages = pages.filter(id__in=page_ids)
+        for page in pages:
+            page.rebuild_line_items()
+            self.stdout.write(
+                f"{page.title}: {page.get_total_quantity_ordered()} items ordered"
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from home.models import OrderStock
+
+
+class Command(BaseCommand):
+    help = 'Release stock held by unpaid orders whose reservation has expired'
+
+    def handle(self, **kwargs):
+        released = OrderStock.release_expired()
+        self.stdout.write(f"{released} expired order items released")
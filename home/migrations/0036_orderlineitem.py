@@ -0,0 +1,30 @@
+# Generated by Django 6.0.6 on 2026-10-18 06:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0035_productvariant_default_value_and_more'),
+        ('wagtailcore', '0097_baselogentry_uuid_action_timestamp_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant_slug', models.CharField(max_length=60)),
+                ('group_name', models.CharField(blank=True, max_length=100)),
+                ('quantity', models.PositiveIntegerField()),
+                ('item_quantity', models.PositiveIntegerField()),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='home.orderformsubmission')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['page', 'variant_slug'], name='home_orderl_page_id_9cf56e_idx')],
+            },
+        ),
+    ]
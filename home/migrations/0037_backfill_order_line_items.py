@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+def backfill_order_line_items(apps, schema_editor):
+    OrderFormSubmission = apps.get_model("home", "OrderFormSubmission")
+    OrderLineItem = apps.get_model("home", "OrderLineItem")
+    ProductVariant = apps.get_model("home", "ProductVariant")
+
+    variants_by_page = {}
+    for variant in ProductVariant.objects.all():
+        variants_by_page.setdefault(variant.page_id, {})[variant.slug] = variant
+
+    line_items = []
+    for submission in OrderFormSubmission.objects.all():
+        variants = variants_by_page.get(submission.page_id, {})
+        for slug, value in submission.form_data.items():
+            if slug not in variants:
+                continue
+            quantity = value[0] if isinstance(value, list) else value
+            quantity = int(quantity) if quantity is not None else 0
+            if quantity <= 0:
+                continue
+            line_items.append(
+                OrderLineItem(
+                    submission=submission,
+                    page_id=submission.page_id,
+                    variant_slug=slug,
+                    group_name=variants[slug].group_name,
+                    quantity=quantity,
+                    item_quantity=quantity * variants[slug].item_count,
+                )
+            )
+    OrderLineItem.objects.bulk_create(line_items, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0036_orderlineitem"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_line_items, migrations.RunPython.noop)
+    ]
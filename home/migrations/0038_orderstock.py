@@ -0,0 +1,46 @@
+# Generated by Django 6.0.6 on 2026-10-18 06:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0037_backfill_order_line_items'),
+        ('wagtailcore', '0097_baselogentry_uuid_action_timestamp_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=110)),
+                ('reserved', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderlineitem',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderlineitem',
+            name='released',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='orderlineitem',
+            index=models.Index(fields=['released', 'expires_at'], name='home_orderl_release_46bf28_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstock',
+            name='page',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderstock',
+            unique_together={('page', 'key')},
+        ),
+    ]
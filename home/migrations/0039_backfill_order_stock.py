@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def backfill_order_stock(apps, schema_editor):
+    OrderLineItem = apps.get_model("home", "OrderLineItem")
+    OrderStock = apps.get_model("home", "OrderStock")
+    ProductVariant = apps.get_model("home", "ProductVariant")
+
+    variant_slugs = set(ProductVariant.objects.values_list("page_id", "slug"))
+
+    counters = {}
+    released = []
+    for line_item in OrderLineItem.objects.all():
+        # Orders for deleted variants don't count towards stock
+        if (line_item.page_id, line_item.variant_slug) not in variant_slugs:
+            released.append(line_item.id)
+            continue
+        for key in ["overall", f"group:{line_item.group_name}", f"variant:{line_item.variant_slug}"]:
+            counters.setdefault((line_item.page_id, key), 0)
+            counters[(line_item.page_id, key)] += line_item.item_quantity
+
+    OrderStock.objects.bulk_create(
+        [
+            OrderStock(page_id=page_id, key=key, reserved=reserved)
+            for (page_id, key), reserved in counters.items()
+        ],
+        batch_size=500,
+    )
+    OrderLineItem.objects.filter(id__in=released).update(released=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0038_orderstock"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_stock, migrations.RunPython.noop)
+    ]
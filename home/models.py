@@ -1,3 +1,4 @@
+import copy
 import datetime
 import re
 import uuid
@@ -7,14 +8,18 @@ from os.path import splitext
 from django import forms
 from django.conf import settings
 from django.contrib import messages
-from django.core.mail import EmailMultiAlternatives
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import validate_slug
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.template.response import TemplateResponse
 from django.shortcuts import redirect
 from django.utils.formats import date_format
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.utils import timezone
 from django.urls import reverse
@@ -51,15 +56,19 @@ from wagtail.models import (
     TranslatableMixin,
 )
 from wagtail.contrib.forms.utils import get_field_clean_name
+from wagtail.signals import page_published, published, unpublished
 
 from wagtailcaptcha.forms import remove_captcha_field
 from wagtailcaptcha.models import WagtailCaptchaEmailForm, WagtailCaptchaFormBuilder
 
 from encrypted_json_fields.fields import EncryptedJSONField, EncryptedCharField, EncryptedEmailField
 
+from common.cache import get_or_build
 from common.fields import data_processing_consent_field
 from payments.utils import get_paypal_form
-from .generate_form_submission_pdf import generate_pdf
+from .generate_form_submission_pdf import delete_stored_pdfs, get_pdf
+from .pdf_schema import PDFFormSchema, invalidate_form_schema
+from .pricing import OrderPricing, OutOfStockError, invalidate_page_pricing, invalidate_stock
 
 
 class HomePage(Page):
@@ -598,14 +607,13 @@ class PDFFormPage(FormPage):
             *[field.clean_name for field in self.get_form_fields() if field.required_for_draft]
         ]
 
+    @cached_property
+    def form_schema(self):
+        return PDFFormSchema.for_page(self)
+
     @property
     def form_field_info_texts(self):
-        return {
-            field.label: {
-                "before": field.before_info_text, 
-                "after": field.after_info_text
-            } for field in self.get_form_fields()
-        }
+        return self.form_schema.info_texts
 
     def serve(self, request, *args, **kwargs):
         if request.method == "POST":
@@ -696,7 +704,7 @@ class PDFFormPage(FormPage):
         )
 
     def send_mail_to_user(self, submission, subject, content):
-        send_mail(
+        send_or_queue_mail(
             subject,
             content,
             [submission.email], 
@@ -714,19 +722,14 @@ class PDFFormPage(FormPage):
             reply_to_addresses
         ):
         # form is a PDFFormSubmission instance
-        kwargs = {
-            "headers": {
-                "Auto-Submitted": "auto-generated",
-            },
-            "reply_to": reply_to_addresses,
-        }
-
-        mail = EmailMultiAlternatives(
-            subject, content, from_address, to_addresses, **kwargs
+        return send_or_queue_mail(
+            subject, 
+            content, 
+            to_addresses, 
+            from_email=from_address, 
+            reply_to=reply_to_addresses, 
+            pdf_submission=submission,
         )
-        pdf = generate_pdf(submission)
-        mail.attach(submission.get_download_filename(), pdf.read())
-        return mail.send()
 
     def process_form_submission(self, form, save_as_draft=True):
         """
@@ -823,11 +826,7 @@ class PDFFormSubmission(AbstractFormSubmission):
         return self.token_valid(token) and self.token_expiry > timezone.now()
 
     def display_data(self):
-        def _format_key(key):
-            try:
-                return self.form_page.pdf_form_fields.get(clean_name=key).label
-            except PDFFormField.DoesNotExist:
-                return key
+        schema = self.form_page.form_schema
 
         def _format_value(value):
             if value is None:
@@ -849,13 +848,10 @@ class PDFFormSubmission(AbstractFormSubmission):
             formatted_value = formatted_value.replace("\r\n", "\n")
             return formatted_value
 
-        fields_in_order = self.form_page.pdf_form_fields.exclude(
-            clean_name__in=["name", "email", "email_address", "wagtailcaptcha", "reference"]
-            ).values_list("clean_name", flat=True)
-        valid_fields = [field for field in  fields_in_order if field in self.form_data]
+        valid_fields = [field for field in schema.fields if field in self.form_data]
 
         return {
-            _format_key(field): _format_value(self.form_data[field]) for field in valid_fields
+            schema.label(field): _format_value(self.form_data[field]) for field in valid_fields
         }
 
     def get_download_filename(self):
@@ -880,9 +876,52 @@ class PDFFormSubmission(AbstractFormSubmission):
         super().save(*args, **kwargs)
         if is_new:
             self.reset_token()
+
+
+@receiver(page_published, sender=PDFFormPage, dispatch_uid="pdfformpage_publish_schema")
+def invalidate_form_schema_on_publish(sender, instance, **kwargs):
+    invalidate_form_schema(instance.id)
+
+
+@receiver(post_save, sender=PDFFormField, dispatch_uid="pdfformfield_save_schema")
+@receiver(post_delete, sender=PDFFormField, dispatch_uid="pdfformfield_delete_schema")
+def invalidate_form_schema_on_field_change(sender, instance, **kwargs):
+    invalidate_form_schema(instance.page_id)
+    # and for a page instance that's already loaded
+    if PDFFormField.page.is_cached(instance):
+        instance.page.__dict__.pop("form_schema", None)
+
+
+@receiver(post_delete, sender=PDFFormSubmission, dispatch_uid="pdfformsubmission_delete_pdfs")
+def delete_pdfs_on_submission_delete(sender, instance, using, **kwargs):
+    delete_stored_pdfs(instance)
     
 
-class OrderFormField(AbstractFormField):
+class OrderPageRelatedMixin:
+    """
+    For models related to an OrderFormPage; clears the page's cached order data
+    when the related object is changed, if the page instance is already loaded
+    """
+    order_page_field = "page"
+
+    def _clear_page_order_data(self):
+        invalidate_page_pricing(getattr(self, f"{self.order_page_field}_id"))
+        descriptor = getattr(type(self), self.order_page_field)
+        if descriptor.is_cached(self):
+            page = getattr(self, self.order_page_field)
+            if hasattr(page, "clear_order_data"):
+                page.clear_order_data()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._clear_page_order_data()
+
+    def delete(self, *args, **kwargs):
+        self._clear_page_order_data()
+        return super().delete(*args, **kwargs)
+
+
+class OrderFormField(OrderPageRelatedMixin, AbstractFormField):
     """
     https://docs.wagtail.org/en/stable/reference/contrib/forms/index.html
     """
@@ -901,7 +940,7 @@ class OrderFormField(AbstractFormField):
         return get_field_clean_name(self.label)
 
 
-class ProductVariant(Orderable):
+class ProductVariant(OrderPageRelatedMixin, Orderable):
     page = ParentalKey("OrderFormPage", related_name="product_variants", on_delete=models.CASCADE)
     group_name = models.CharField(
         max_length=100, blank=True, 
@@ -924,7 +963,18 @@ class ProductVariant(Orderable):
     )
     default_value = models.PositiveIntegerField(default=0)
     slug = models.CharField(max_length=60, blank=True, default="", help_text="This field will be autopoulated")
-    
+
+    # Fields copied to the stock ledger; orders are recounted when they change
+    stock_fields = ("group_name", "item_count")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock_values = {
+            field: value for field, value in zip(field_names, values) if field in cls.stock_fields
+        }
+        return instance
+
     def save(self, *args, **kwargs):
         if self.page.specific.total_available and (self.group_total_available or self.variant_total_available):
             raise ValueError("Cannot set group/variant stock for a page with overall stock set")
@@ -944,7 +994,20 @@ class ProductVariant(Orderable):
                 counter += 1
                 slug = f"{base_slug}_{counter}"
             self.slug = slug
-        super().save(*args, **kwargs)
+
+        stock_changed = False
+        if self.id:
+            loaded_values = getattr(self, "_loaded_stock_values", {})
+            if set(loaded_values) != set(self.stock_fields):
+                loaded_values = ProductVariant.objects.filter(id=self.id).values(*self.stock_fields).first() or {}
+            stock_changed = bool(loaded_values) and any(
+                loaded_values[field] != getattr(self, field) for field in self.stock_fields
+            )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if stock_changed:
+                OrderStock.recount_variant(self)
+        self._loaded_stock_values = {field: getattr(self, field) for field in self.stock_fields}
 
     @property
     def group_and_name(self):
@@ -1046,8 +1109,7 @@ class OrderFormSubmissionsListView(OrderingMixin, SubmissionsListView):
 
     def _get_heading_label(self, slug, name):
         try:
-            pv = ProductVariant.objects.get(page=self.form_page, slug=slug)
-            return pv.group_and_name
+            return self.form_page.get_product_variant(slug).group_and_name
         except ProductVariant.DoesNotExist:
             return name
     
@@ -1133,10 +1195,11 @@ class OrderFormSubmissionsListView(OrderingMixin, SubmissionsListView):
         return context_data
 
 
-class OrderVoucher(Orderable):
+class OrderVoucher(OrderPageRelatedMixin, Orderable):
     """
     Simple code that gives a discount on an order (e.g. if collecting, can remove shipping cost)
     """
+    order_page_field = "order_form_page"
     order_form_page = ParentalKey("OrderFormPage", related_name="voucher_codes", on_delete=models.CASCADE)
     code = models.CharField(max_length=20, validators=[validate_slug])
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -1153,11 +1216,7 @@ class OrderBaseForm(BaseForm):
     def clean(self):
         super().clean()
         voucher_code = self.cleaned_data.get("voucher_code", "").strip()
-        if (
-            voucher_code and 
-            voucher_code not in 
-            self.page.voucher_codes.filter(code=voucher_code, active=True).values_list("code", flat=True)
-        ):
+        if voucher_code and self.page.get_active_voucher(voucher_code) is None:
             del self.cleaned_data["voucher_code"]
 
         total_items = self.page.quantity_ordered_by_submission(self.cleaned_data)["total"]
@@ -1188,7 +1247,7 @@ class OrderFormBuilder(WagtailCaptchaFormBuilder):
             original_fields.update(
                 data_processing_consent=data_processing_consent_field()
             )
-        if self.page.voucher_codes.filter(active=True).exists():
+        if any(voucher.active for voucher in self.page.order_data["vouchers"]):
             formfields = {
                 k: v for k, v in original_fields.items() if k != "wagtailcaptcha"
             }
@@ -1219,8 +1278,9 @@ class OrderFormBuilder(WagtailCaptchaFormBuilder):
         return type("WagtailForm", (OrderBaseForm,), self.formfields)
 
 
-class OrderShippingCost(Orderable):
+class OrderShippingCost(OrderPageRelatedMixin, Orderable):
     DEFAULT_MAX = 999999999
+    order_page_field = "order_form_page"
     order_form_page = ParentalKey("OrderFormPage", related_name="shipping_costs", on_delete=models.CASCADE)
     max_quantity = models.PositiveIntegerField(default=DEFAULT_MAX)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -1375,6 +1435,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
     def save(self, *args, **kwargs):
         self.from_address = settings.DEFAULT_FROM_EMAIL
         super().save(*args, **kwargs)
+        self.clear_order_data()
 
         # Check the product variant stock
         all_groups = set(self.product_variants.filter(group_total_available__isnull=False).values_list("group_name", flat=True))
@@ -1390,11 +1451,51 @@ class OrderFormPage(WagtailCaptchaEmailForm):
         for pr in self.product_variants.all():
             pr.save()
         # generate/update quantity fields
-        for slug in self.product_variant_slugs:
+        product_variant_slugs = set(self.product_variants.values_list("slug", flat=True))
+        for slug in product_variant_slugs:
             self.create_or_update_order_form_field(slug)
-        fields_to_remove = self.product_quantity_field_names - self.product_variant_slugs
+        fields_to_remove = set(
+            self.order_form_fields.filter(clean_name__startswith="pv__").values_list("clean_name", flat=True)
+        ) - product_variant_slugs
         for field_name in fields_to_remove:
-            self.order_form_fields.get(clean_name=field_name).delete()      
+            self.order_form_fields.get(clean_name=field_name).delete()
+        self.clear_order_data()
+
+    @cached_property
+    def order_data(self):
+        """
+        The product variants, shipping costs, voucher codes and form fields for this
+        page, loaded once per page instance (i.e. once per request) and cleared on save
+        """
+        return {
+            "variants": list(self.product_variants.all()),
+            "shipping_costs": list(self.shipping_costs.all()),
+            "vouchers": list(self.voucher_codes.all()),
+            "form_fields": list(self.order_form_fields.all()),
+        }
+
+    def clear_order_data(self):
+        self.__dict__.pop("order_data", None)
+        self.__dict__.pop("pricing", None)
+        if self.id:
+            invalidate_page_pricing(self.id)
+
+    @cached_property
+    def pricing(self):
+        """In-memory pricing for this page instance (without stock checks)"""
+        return OrderPricing(self)
+
+    def get_product_variant(self, slug):
+        for variant in self.order_data["variants"]:
+            if variant.slug == slug:
+                return variant
+        raise ProductVariant.DoesNotExist(f"No product variant with slug {slug}")
+
+    def get_active_voucher(self, code):
+        return next(
+            (voucher for voucher in self.order_data["vouchers"] if voucher.code == code and voucher.active),
+            None
+        )
 
     @property
     def subject_title(self):
@@ -1404,10 +1505,10 @@ class OrderFormPage(WagtailCaptchaEmailForm):
 
     @property
     def shipping_costs_dict(self):
-        if self.shipping_costs.exists():
+        if self.order_data["shipping_costs"]:
             sc_dict = {}
             previous_max_quantity = None
-            for sc in self.shipping_costs.all():
+            for sc in self.order_data["shipping_costs"]:
                 if sc.max_quantity ==  1:
                     label = f"1 item"
                 elif sc.max_quantity == OrderShippingCost.DEFAULT_MAX:
@@ -1424,13 +1525,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
             return sc_dict
 
     def get_shipping_cost(self, quantity):
-        if not self.shipping_costs_dict:
-            return 0
-        for max_quantity, shipping_label_and_cost in self.shipping_costs_dict.items():
-            if max_quantity >= quantity:
-                return shipping_label_and_cost[1]
-        # If there was no ceiling max set, use the highest rate
-        return shipping_label_and_cost[1]
+        return self.pricing.shipping_cost(quantity)
 
     def create_or_update_order_form_field(self, product_variant_slug):
         variant = self.product_variants.get(slug=product_variant_slug)
@@ -1450,75 +1545,46 @@ class OrderFormPage(WagtailCaptchaEmailForm):
             field.save()
 
     def variants_by_group(self):
-        groups = self.product_variants.values_list("group_name", flat=True)
-        # remove duplicates but preserve order
-        groups = list(dict.fromkeys(groups))
-        return {
-            group_name: self.product_variants.filter(group_name=group_name) for group_name in groups
-        }
+        variants_by_group = {}
+        for variant in self.order_data["variants"]:
+            variants_by_group.setdefault(variant.group_name, []).append(variant)
+        return variants_by_group
 
     @property
     def product_quantity_field_names(self):
-        return set(self.order_form_fields.filter(clean_name__startswith="pv__").values_list("clean_name", flat=True))
+        return {
+            field.clean_name for field in self.order_data["form_fields"]
+            if field.clean_name.startswith("pv__")
+        }
 
     @property
     def product_variant_slugs(self):
-        return set(self.product_variants.values_list("slug", flat=True))
+        return {variant.slug for variant in self.order_data["variants"]}
 
     def get_form_fields(self):
-        return self.order_form_fields.all()
+        return self.order_data["form_fields"]
  
     def get_form_class(self):
         fb = self.form_builder(self.get_form_fields(), page=self)
         return fb.get_form_class()
 
     def _get_quantities(self, data):
-        def get_item(v):
-            if isinstance(v, list):
-                quantity = v[0]
-            else:
-                quantity = v
-            # Quantity may be None if new variants have been added
-            if quantity is None:
-                return 0
-            return int(quantity)     
-        return {
-            k: get_item(v) for k, v in data.items() if k in self.product_variant_slugs
-        }
+        return self.pricing.get_quantities(data)
 
     def default_total(self):
+        product_quantity_field_names = self.product_quantity_field_names
         data = {
             field.clean_name: field.default_value for field in self.get_form_fields() 
-            if field.clean_name in self.product_quantity_field_names
+            if field.clean_name in product_quantity_field_names
         }
         _, total, _ = self.get_variant_quantities_and_total(data)
         return total
 
     def get_variant_quantities_and_total(self, data):
-        code = data.get("voucher_code", "")
-        if isinstance(code, list):
-            code = code[0]
-        code = code.strip()
-        voucher_amount = 0
-        if code and self.voucher_codes.filter(code=code, active=True).exists():
-            voucher_amount = OrderVoucher.objects.get(code=code, active=True).amount
-        quantities = self._get_quantities(data)
-        total = 0
-        variant_quantities = {}
-        for key, quantity in quantities.items():
-            variant = self.product_variants.get(slug=key)
-            variant_quantities[key] = (variant, quantity)
-            total += (variant.cost * quantity)
-        if total > 0:
-            # shipping cost
-            total_quantity = self.quantity_ordered_by_submission(data)["total"]
-            total += self.get_shipping_cost(total_quantity)
-            total -= voucher_amount
-
-        return variant_quantities, total, voucher_amount
+        return self.pricing.price(data)
 
     def _item_counts_per_variant(self):
-        return dict(self.product_variants.values_list("slug", "item_count"))
+        return {variant.slug: variant.item_count for variant in self.order_data["variants"]}
 
     def sold_out(self):
         # Are we sold out entirely?
@@ -1549,7 +1615,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
             quantity_ordered_so_far = self.get_total_quantity_ordered()
             remaining_stock = self.total_available - quantity_ordered_so_far 
             return [
-                variant for variant in self.product_variants.all()
+                variant for variant in self.order_data["variants"]
                 if item_counts_per_variant[variant.slug] > remaining_stock
             ]
         
@@ -1557,7 +1623,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
         totals_available = self.get_stock_quantities()
         ordered = self.get_total_quantity_ordered_by_group_and_variant()
 
-        for variant in self.product_variants.all():
+        for variant in self.order_data["variants"]:
             if variant.group_name in totals_available["groups"]:
                 remaining_stock = totals_available["groups"][variant.group_name] - ordered["groups"].get(variant.group_name, 0)
                 if item_counts_per_variant[variant.slug] > remaining_stock:
@@ -1569,15 +1635,26 @@ class OrderFormPage(WagtailCaptchaEmailForm):
 
         return disallowed
 
+    def rebuild_line_items(self):
+        """
+        Regenerate the stock ledger and stock counters from every submission
+        made on this page
+        """
+        with transaction.atomic():
+            OrderStock.objects.filter(page_id=self.pk).delete()
+            OrderLineItem.objects.filter(page_id=self.pk).delete()
+            for submission in self.orderformsubmission_set.all():
+                submission.page = self
+                submission.update_line_items(reserved_at=submission.submit_time)
+            OrderStock.release_expired(page_id=self.pk)
+
     def get_total_quantity_ordered(self):
-        total = 0
-        if self.pk:
-            submissions = self.orderformsubmission_set.all()
-            item_counts_per_variant = self._item_counts_per_variant()
-            
-            for submission in submissions:
-                total += self.quantity_ordered_by_submission(submission.form_data, item_counts_per_variant)["total"]
-        return total
+        if not self.pk:
+            return 0
+        return (
+            OrderStock.objects.filter(page_id=self.pk, key=OrderStock.OVERALL)
+            .values_list("reserved", flat=True).first()
+        ) or 0
 
     def get_total_quantity_ordered_by_group_and_variant(self):
         quantities_ordered ={
@@ -1586,95 +1663,44 @@ class OrderFormPage(WagtailCaptchaEmailForm):
             "variants": {}
         }
         if self.pk:
-            submissions = self.orderformsubmission_set.all()
-            item_counts_per_variant = self._item_counts_per_variant()
-
-            for submission in submissions:
-                submission_quantities_ordered = self.quantity_ordered_by_submission(submission.form_data, item_counts_per_variant)
-                quantities_ordered["total"] += submission_quantities_ordered["total"]
-                for group, quantity in submission_quantities_ordered["groups"].items():
-                    quantities_ordered["groups"].setdefault(group, 0)
-                    quantities_ordered["groups"][group] += quantity
-                for variant, quantity in submission_quantities_ordered["variants"].items():
-                    quantities_ordered["variants"].setdefault(variant, 0)
-                    quantities_ordered["variants"][variant] += quantity
+            counters = OrderStock.objects.filter(page_id=self.pk, reserved__gt=0).values_list("key", "reserved")
+            for key, reserved in counters:
+                if key == OrderStock.OVERALL:
+                    quantities_ordered["total"] = reserved
+                else:
+                    kind, name = key.split(":", 1)
+                    quantities_ordered[f"{kind}s"][name] = reserved
 
         return quantities_ordered
     
     def get_stock_quantities(self):
         if self.total_available:
             return {"overall": self.total_available}
-        groups_with_totals = self.product_variants.filter(group_total_available__isnull=False).values_list("group_name", "group_total_available")
         totals = {"groups": {}, "variants": {}}
-        for group_name, group_total in groups_with_totals:
-            totals["groups"][group_name] = group_total
-        variants_with_totals = self.product_variants.filter(variant_total_available__isnull=False).values_list("slug", "variant_total_available")
-        for variant_slug, variant_total in variants_with_totals:
-            totals["variants"][variant_slug] = variant_total
+        for variant in self.order_data["variants"]:
+            if variant.group_total_available is not None:
+                totals["groups"][variant.group_name] = variant.group_total_available
+            if variant.variant_total_available is not None:
+                totals["variants"][variant.slug] = variant.variant_total_available
         return totals
 
-    def quantity_ordered_by_submission(self, form_data, item_counts_per_variant=None):
-        variant_to_group = dict(self.product_variants.all().values_list("slug", "group_name"))
-        quantities = {
-            "total": 0,
-            "groups": {},
-            "variants": {}
-        }
-
-        if item_counts_per_variant is None:
-            item_counts_per_variant = self._item_counts_per_variant()
-        variant_quantities = self._get_quantities(form_data)
+    def get_stock_limits(self):
+        """
+        The limits for each of the page's stock counters, and the labels used
+        for them in stock error messages
+        """
+        limits = OrderStock.limits_for(self.get_stock_quantities())
+        labels = {}
+        for variant in self.order_data["variants"]:
+            labels[OrderStock.group_key(variant.group_name)] = variant.group_name
+            labels[OrderStock.variant_key(variant.slug)] = variant.name
+        return limits, labels
 
-        for key, quantity in variant_quantities.items():
-            quantities["total"] += item_counts_per_variant[key] * quantity
-            quantities["variants"].setdefault(key, 0)
-            quantities["variants"][key] += item_counts_per_variant[key] * quantity
-            quantities["groups"].setdefault(variant_to_group[key], 0)
-            quantities["groups"][variant_to_group[key]] += item_counts_per_variant[key] * quantity
-        return quantities
+    def quantity_ordered_by_submission(self, form_data):
+        return self.pricing.quantity_ordered(form_data)
 
     def quantity_submitted_is_valid(self, form_data):
-        validation_error_msg = ""
-        valid = True
-
-        total_for_this_order = self.quantity_ordered_by_submission(form_data)
-
-        # First check totals
-        if self.total_available:
-            total_ordered_so_far = self.get_total_quantity_ordered()
-            remaining_stock = self.total_available - total_ordered_so_far
-            valid = total_for_this_order["total"] <= remaining_stock
-            if not valid:
-                rem_stock = remaining_stock if remaining_stock >= 0 else 0
-                validation_error_msg  = f"Quantity selected is unavailable; select a maximum of {rem_stock} total items."
-            return valid, validation_error_msg
-        
-
-        total_ordered_so_far = self.get_total_quantity_ordered_by_group_and_variant()
-        totals_available = self.get_stock_quantities()
-
-        # Next check groups
-        for group, quantity in total_for_this_order["groups"].items():
-            if group in totals_available["groups"]:
-                remaining_stock = totals_available["groups"][group] - total_ordered_so_far["groups"].get(group, 0)
-                valid = quantity <= remaining_stock
-                if not valid:
-                    rem_stock = remaining_stock if remaining_stock >= 0 else 0
-                    validation_error_msg  = f"Quantity selected for {group} is unavailable; select a maximum of {rem_stock} total items."
-                    return valid, validation_error_msg
-        
-        # Finally check variants
-        for variant, quantity in total_for_this_order["variants"].items():
-            if variant in totals_available["variants"]:
-                remaining_stock = totals_available["variants"][variant] - total_ordered_so_far["variants"].get(variant, 0)
-                valid = quantity <= remaining_stock
-                if not valid:
-                    rem_stock = remaining_stock if remaining_stock >= 0 else 0
-                    variant_name = self.product_variants.get(slug=variant).name
-                    validation_error_msg  = f"Quantity selected for {variant_name} is unavailable; select a maximum of {rem_stock} total items."
-                    return valid, validation_error_msg
-
-        return valid, validation_error_msg
+        return OrderPricing(self, include_stock=True).check_stock(form_data)
 
     def _render_extra_email(self,  submission, total, discount):
         content = "\nOrder summary:\n"
@@ -1692,10 +1718,11 @@ class OrderFormPage(WagtailCaptchaEmailForm):
         content = []
 
         cleaned_data = form.cleaned_data
+        product_quantity_field_names = self.product_quantity_field_names
         for field in form:
             if field.name not in cleaned_data:
                 continue
-            if field.name in self.product_quantity_field_names:
+            if field.name in product_quantity_field_names:
                 continue
 
             value = cleaned_data.get(field.name)
@@ -1750,7 +1777,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
 
     def send_mail(self, form, submission, total, discount, subject):
         addresses = [x.strip() for x in self.to_address.split(",")]
-        send_mail(
+        send_or_queue_mail(
             subject,
             self.render_email(form, submission, total, discount),
             addresses,
@@ -1759,6 +1786,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
 
     def get_context(self, request):
         context = super().get_context(request)
+        context["disallowed_variants"] = self.disallowed_variants()
         if request.GET.get("order_ref"):
             context["existing_order_ref"] = request.GET["order_ref"]
         else:
@@ -1776,10 +1804,15 @@ class OrderFormPage(WagtailCaptchaEmailForm):
             )
 
             if form.is_valid():
-                form_submission = self.process_form_submission(form, request)
-                return self.render_landing_page(
-                    request, form_submission, *args, **kwargs
-                )
+                try:
+                    form_submission = self.process_form_submission(form, request)
+                except OutOfStockError as e:
+                    # Stock was sold to someone else since the form was validated
+                    form.add_error(None, str(e))
+                else:
+                    return self.render_landing_page(
+                        request, form_submission, *args, **kwargs
+                    )
         else:
             form = self.get_form(page=self, user=request.user)
             context = self.get_context(request)
@@ -1812,6 +1845,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
         """
         cleaned_data = form.cleaned_data
 
+        uploaded_images = []
         for name, field in form.fields.items():
             if isinstance(field, WagtailImageField):
                 image_file_data = cleaned_data[name]
@@ -1828,6 +1862,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
 
                     image = ImageModel(**kwargs)
                     image.save()
+                    uploaded_images.append(image)
                     # saving the image id
                     # alternatively we can store a path to the image via image.get_rendition
                     cleaned_data.update({name: f"{self.get_uploaded_image_collection().name}/{image.filename}"})
@@ -1852,15 +1887,22 @@ class OrderFormPage(WagtailCaptchaEmailForm):
                         if self.id in request.session.get("orders", {}):
                             del request.session["orders"][str(self.id)]
 
+        # Saving reserves the stock for the order, or raises OutOfStockError
         if existing_submission:
             submission = existing_submission
             submission.form_data = form.cleaned_data
-            submission.save()
         else:
-            submission = self.get_submission_class().objects.create(
+            submission = self.get_submission_class()(
                 form_data=form.cleaned_data,
                 page=self,
             )
+        try:
+            submission.save(check_stock=True)
+        except OutOfStockError:
+            # The order isn't saved, so its uploaded images would be orphaned
+            for image in uploaded_images:
+                image.delete()
+            raise
 
         _, total, discount = self.get_variant_quantities_and_total(form.cleaned_data)
 
@@ -1875,7 +1917,7 @@ class OrderFormPage(WagtailCaptchaEmailForm):
         submission.save()
 
         # Send email to purchaser
-        send_mail(
+        send_or_queue_mail(
             subject,
             self.render_email_for_purchaser(submission, total, discount),
             [submission.email],
@@ -1941,25 +1983,447 @@ class OrderFormSubmission(AbstractFormSubmission):
 
     def get_absolute_url(self):
         return reverse("orders:order_detail", kwargs={"reference": self.reference})
-    
-    def save(self, *args, **kwargs):
-        if self.paid and not self.date_paid:
-            self.date_paid = timezone.now()
-            # This submission has just been marked as paid; look for a one-time voucher
-            # used for it, and deactivate it if applicable
-            # We don't do this for subsequent saves, because the code could have been
-            # reactivated for another use
-            voucher_code = self.form_data.get("voucher_code")
-            if voucher_code:
-                # is there a matching one-time use voucher? If so, deactivate it now
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep a copy of the form data as loaded, so we only rewrite the stock ledger
+        # when the order itself changes (not when it's marked paid/shipped)
+        instance._loaded_form_data = copy.deepcopy(instance.__dict__.get("form_data"))
+        return instance
+
+    def get_order_page(self):
+        """The specific OrderFormPage, reusing the page instance if it's already loaded"""
+        if OrderFormSubmission.page.is_cached(self) and isinstance(self.page, OrderFormPage):
+            return self.page
+        return OrderFormPage.objects.get(id=self.page_id)
+
+    def update_line_items(self, check_stock=False, reserved_at=None):
+        """
+        Replace this submission's stock ledger rows with the quantities in its
+        current form data, and reserve the difference from the page's stock
+        counters.
+        If check_stock, raises OutOfStockError if there isn't enough stock left.
+        """
+        page = self.get_order_page()
+        variants = {variant.slug: variant for variant in page.order_data["variants"]}
+        expires_at = None
+        if settings.ORDER_RESERVATION_MINUTES and not self.paid:
+            expires_at = (reserved_at or timezone.now()) + datetime.timedelta(
+                minutes=settings.ORDER_RESERVATION_MINUTES
+            )
+        line_items = []
+        for slug, quantity in page._get_quantities(self.form_data).items():
+            variant = variants.get(slug)
+            if quantity <= 0 or variant is None:
+                # Deleted variants no longer count towards stock
+                continue
+            line_items.append(
+                OrderLineItem(
+                    submission=self,
+                    page_id=self.page_id,
+                    variant_slug=slug,
+                    group_name=variant.group_name,
+                    quantity=quantity,
+                    item_quantity=quantity * variant.item_count,
+                    expires_at=expires_at,
+                )
+            )
+
+        limits = labels = None
+        if check_stock:
+            limits, labels = page.get_stock_limits()
+
+        with transaction.atomic():
+            # Only the change from the stock this order already holds is reserved
+            changes = OrderStock.quantities_for(line_items)
+            for key, quantity in OrderStock.quantities_for(self.line_items.filter(released=False)).items():
+                changes[key] = changes.get(key, 0) - quantity
+            self.line_items.all().delete()
+            try:
+                OrderStock.reserve(self.page_id, changes, limits=limits, labels=labels)
+            except OutOfStockError:
+                # Free up any stock held by abandoned orders and try again
+                if not OrderStock.release_expired(page_id=self.page_id):
+                    raise
+                OrderStock.reserve(self.page_id, changes, limits=limits, labels=labels)
+            OrderLineItem.objects.bulk_create(line_items)
+        self._loaded_form_data = copy.deepcopy(self.form_data)
+
+    def hold_line_items(self):
+        """
+        The order has been paid; it keeps its stock indefinitely. Stock that was
+        released when its reservation expired is taken back if there's enough
+        left; if not, it stays released and the page's admins are told that the
+        order is out of stock.
+        """
+        with transaction.atomic():
+            # Clear the reservation first, so this order's stock isn't released below
+            self.line_items.filter(expires_at__isnull=False).update(expires_at=None)
+            released = self.line_items.filter(
+                released=True,
+                variant_slug__in=ProductVariant.objects.filter(page_id=self.page_id).values("slug"),
+            )
+            quantities = OrderStock.quantities_for(released)
+            if quantities:
+                page = self.get_order_page()
+                limits, labels = page.get_stock_limits()
+                # Free up any stock held by abandoned orders first
+                OrderStock.release_expired(page_id=self.page_id)
                 try:
-                    voucher = OrderVoucher.objects.get(code=voucher_code, one_time_use=True)
-                    voucher.active = False
-                    voucher.save()
-                except OrderVoucher.DoesNotExist:
-                    ...
-        super().save(*args, **kwargs)
-    
+                    OrderStock.reserve(self.page_id, quantities, limits=limits, labels=labels)
+                except OutOfStockError as error:
+                    transaction.on_commit(lambda error=error: self.send_out_of_stock_email(page, error))
+                else:
+                    released.update(released=False)
+
+    def send_out_of_stock_email(self, page, error):
+        label = f" for {error.label}" if error.label else ""
+        addresses = [x.strip() for x in page.to_address.split(",") if x.strip()] or [settings.DEFAULT_ADMIN_EMAIL]
+        send_or_queue_mail(
+            f"Paid order {self.reference} is out of stock",
+            (
+                f"Order {self.reference} for {page.title} was paid after its reservation expired, "
+                f"and its stock has been ordered by others since; "
+                f"{max(error.remaining_stock, 0)} items are left{label}.\n\n"
+                f"The order is not counted in the stock ordered; please check it.\n"
+                f"{settings.WAGTAILADMIN_BASE_URL}{reverse('wagtailforms:list_submissions', args=(page.id,))}"
+            ),
+            addresses,
+            settings.DEFAULT_FROM_EMAIL,
+        )
+
+    def save(self, *args, check_stock=False, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        form_data_changed = (
+            (update_fields is None or "form_data" in update_fields)
+            and self.form_data != getattr(self, "_loaded_form_data", None)
+        )
+        with transaction.atomic():
+            newly_paid = self.paid and not self.date_paid
+            if newly_paid:
+                self.date_paid = timezone.now()
+                # This submission has just been marked as paid; look for a one-time voucher
+                # used for it, and deactivate it if applicable
+                # We don't do this for subsequent saves, because the code could have been
+                # reactivated for another use
+                voucher_code = self.form_data.get("voucher_code")
+                if voucher_code:
+                    # is there a matching one-time use voucher? If so, deactivate it now
+                    try:
+                        voucher = OrderVoucher.objects.get(code=voucher_code, one_time_use=True)
+                        voucher.active = False
+                        voucher.save()
+                    except OrderVoucher.DoesNotExist:
+                        ...
+            super().save(*args, **kwargs)
+            if form_data_changed:
+                self.update_line_items(check_stock=check_stock)
+            if newly_paid:
+                self.hold_line_items()
+
+
+class OrderLineItem(models.Model):
+    """
+    Stock ledger for order form submissions; one row per product variant ordered.
+    Holds no personal data, so stock sold can be summed in SQL instead of
+    decrypting the form data of every submission.
+    """
+    submission = models.ForeignKey(
+        OrderFormSubmission, on_delete=models.CASCADE, related_name="line_items"
+    )
+    page = models.ForeignKey("wagtailcore.Page", on_delete=models.CASCADE, related_name="+")
+    variant_slug = models.CharField(max_length=60)
+    group_name = models.CharField(max_length=100, blank=True)
+    quantity = models.PositiveIntegerField()
+    # quantity * variant item count (recounted if the variant's item count changes)
+    item_quantity = models.PositiveIntegerField()
+    # Unpaid orders hold their stock until this time
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # The stock is no longer held in the page's stock counters
+    released = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["page", "variant_slug"]),
+            models.Index(fields=["released", "expires_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.submission_id}: {self.variant_slug} ({self.quantity})"
+
+
+class OrderStock(models.Model):
+    """
+    Running totals of the stock held by orders for an OrderFormPage; one row
+    overall, and one per product group and per variant.
+
+    Orders reserve stock with a conditional UPDATE on each row, so concurrent
+    orders can't take a counter over its limit, and checking stock is one query
+    per counter regardless of the number of orders.
+    """
+    OVERALL = "overall"
+
+    page = models.ForeignKey("wagtailcore.Page", on_delete=models.CASCADE, related_name="+")
+    key = models.CharField(max_length=110)
+    reserved = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("page", "key")
+
+    def __str__(self):
+        return f"{self.page_id}: {self.key} ({self.reserved})"
+
+    @staticmethod
+    def group_key(group_name):
+        return f"group:{group_name}"
+
+    @staticmethod
+    def variant_key(variant_slug):
+        return f"variant:{variant_slug}"
+
+    @classmethod
+    def quantities_for(cls, line_items):
+        """Item quantities for each stock counter, from a list of OrderLineItems"""
+        quantities = {}
+        for line_item in line_items:
+            for key in [cls.OVERALL, cls.group_key(line_item.group_name), cls.variant_key(line_item.variant_slug)]:
+                quantities[key] = quantities.get(key, 0) + line_item.item_quantity
+        return quantities
+
+    @classmethod
+    def limits_for(cls, stock_quantities):
+        """
+        Counter limits from OrderFormPage.get_stock_quantities(); group and
+        variant stock is ignored if there's an overall limit
+        """
+        if "overall" in stock_quantities:
+            return {cls.OVERALL: stock_quantities["overall"]}
+        limits = {cls.group_key(group): total for group, total in stock_quantities["groups"].items()}
+        limits.update({cls.variant_key(slug): total for slug, total in stock_quantities["variants"].items()})
+        return limits
+
+    @classmethod
+    def reserve(cls, page_id, quantities, limits=None, labels=None):
+        """
+        Add quantities (a dict of key: quantity, which may be negative to release
+        stock) to the page's counters, atomically.
+        Raises OutOfStockError and reserves nothing if any counter would go over its
+        limit.
+        """
+        quantities = {key: quantity for key, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        limits = limits or {}
+        labels = labels or {}
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [cls(page_id=page_id, key=key) for key, quantity in quantities.items() if quantity > 0],
+                ignore_conflicts=True,
+            )
+            # Update in a consistent order so concurrent orders can't deadlock
+            for key in sorted(quantities):
+                quantity = quantities[key]
+                counter = cls.objects.filter(page_id=page_id, key=key)
+                if quantity > 0 and key in limits:
+                    if not counter.filter(reserved__lte=limits[key] - quantity).update(reserved=models.F("reserved") + quantity):
+                        remaining_stock = limits[key] - counter.values_list("reserved", flat=True).get()
+                        raise OutOfStockError(key, remaining_stock, labels.get(key))
+                else:
+                    counter.update(reserved=models.F("reserved") + quantity)
+        invalidate_stock(page_id)
+
+    @classmethod
+    def recount(cls, page_id):
+        """
+        Rebuild the page's counters from the stock its orders hold
+        """
+        with transaction.atomic():
+            counters = {counter.key: counter for counter in cls.objects.select_for_update().filter(page_id=page_id)}
+            quantities = cls.quantities_for(OrderLineItem.objects.filter(page_id=page_id, released=False))
+            for key, counter in counters.items():
+                counter.reserved = quantities.get(key, 0)
+            cls.objects.bulk_update(counters.values(), ["reserved"])
+            cls.objects.bulk_create(
+                [cls(page_id=page_id, key=key, reserved=quantity) for key, quantity in quantities.items() if key not in counters],
+                ignore_conflicts=True,
+            )
+        invalidate_stock(page_id)
+
+    @classmethod
+    def recount_variant(cls, variant):
+        """
+        A variant's group or item count has changed; update its orders'
+        line items to match and recount the page's stock
+        """
+        with transaction.atomic():
+            OrderLineItem.objects.filter(page_id=variant.page_id, variant_slug=variant.slug).update(
+                group_name=variant.group_name,
+                item_quantity=models.F("quantity") * variant.item_count,
+            )
+            cls.recount(variant.page_id)
+
+    @classmethod
+    def release(cls, page_id, quantities):
+        cls.reserve(page_id, {key: -quantity for key, quantity in quantities.items()})
+
+    @classmethod
+    def release_expired(cls, page_id=None):
+        """
+        Release the stock held by unpaid orders whose reservation has expired.
+        Returns the number of line items released.
+        """
+        with transaction.atomic():
+            expired = OrderLineItem.objects.select_for_update().filter(
+                released=False, expires_at__lte=timezone.now()
+            )
+            if page_id is not None:
+                expired = expired.filter(page_id=page_id)
+            expired = list(expired)
+            line_items_by_page = {}
+            for line_item in expired:
+                line_items_by_page.setdefault(line_item.page_id, []).append(line_item)
+            for expired_page_id, line_items in line_items_by_page.items():
+                cls.release(expired_page_id, cls.quantities_for(line_items))
+            OrderLineItem.objects.filter(id__in=[line_item.id for line_item in expired]).update(released=True)
+        return len(expired)
+
+
+@receiver(pre_delete, sender=OrderFormSubmission, dispatch_uid="orderformsubmission_delete_stock")
+def release_stock_on_submission_delete(sender, instance, using, **kwargs):
+    OrderStock.release(instance.page_id, OrderStock.quantities_for(instance.line_items.filter(released=False)))
+
+
+@receiver(post_delete, sender=ProductVariant, dispatch_uid="productvariant_delete_stock")
+def release_stock_on_variant_delete(sender, instance, using, **kwargs):
+    # Orders for deleted variants no longer count towards stock
+    line_items = OrderLineItem.objects.filter(
+        page_id=instance.page_id, variant_slug=instance.slug, released=False
+    )
+    OrderStock.release(instance.page_id, OrderStock.quantities_for(line_items))
+    line_items.update(released=True)
+    OrderStock.objects.filter(page_id=instance.page_id, key=OrderStock.variant_key(instance.slug)).delete()
+
+
+def send_or_queue_mail(subject, message, recipient_list, from_email=None, reply_to=None, pdf_submission=None):
+    """
+    Send an email now or, if settings.EMAIL_OUTBOX is set, add it to the
+    outbox to be sent by the process_outbox command.
+    If pdf_submission is given, its PDF is generated and attached at the time
+    of sending.
+    """
+    email = OutboxEmail(
+        message={
+            "subject": subject,
+            "body": message,
+            "from_email": from_email or settings.DEFAULT_FROM_EMAIL,
+            "to": list(recipient_list),
+            "reply_to": reply_to,
+        },
+        pdf_submission=pdf_submission,
+    )
+    if settings.EMAIL_OUTBOX:
+        email.save()
+        return 0
+    return email.build_message().send()
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent by the process_outbox command, so that sending
+    doesn't hold up the request that triggered it
+    """
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    # subject, body and addresses; encrypted as they contain personal data
+    message = EncryptedJSONField(encoder=DjangoJSONEncoder)
+    pdf_submission = models.ForeignKey(
+        PDFFormSubmission, null=True, blank=True, on_delete=models.CASCADE, related_name="+"
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.status}"
+
+    def build_message(self, connection=None):
+        mail = EmailMultiAlternatives(
+            self.message["subject"],
+            self.message["body"],
+            self.message["from_email"],
+            self.message["to"],
+            connection=connection,
+            headers={"Auto-Submitted": "auto-generated"},
+            reply_to=self.message["reply_to"],
+        )
+        if self.pdf_submission:
+            with get_pdf(self.pdf_submission) as pdf:
+                mail.attach(self.pdf_submission.get_download_filename(), pdf.read())
+        return mail
+
+    def send(self, connection=None):
+        """
+        Try to send the email. On failure, schedule a retry with exponential
+        backoff, or mark it failed once it's out of attempts.
+        Returns True if it was sent.
+        """
+        try:
+            self.build_message(connection=connection).send()
+        except Exception as e:
+            self.attempts += 1
+            self.last_error = repr(e)
+            if self.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                self.status = "failed"
+            else:
+                self.next_attempt_at = timezone.now() + datetime.timedelta(
+                    seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+                )
+            self.save()
+            return False
+        self.attempts += 1
+        self.status = "sent"
+        self.sent_at = timezone.now()
+        self.save()
+        return True
+
+    @classmethod
+    def due(cls):
+        return cls.objects.filter(status="pending", next_attempt_at__lte=timezone.now())
+
+    @classmethod
+    def process(cls, limit=None):
+        """
+        Send pending emails that are due, over one mail connection.
+        Each email is locked while it's sent (skipping any already locked), so
+        more than one worker can run at once.
+        Returns (sent, failed) counts.
+        """
+        sent = failed = 0
+        connection = get_connection()
+        with connection:
+            while limit is None or sent + failed < limit:
+                with transaction.atomic():
+                    email = cls.due().order_by("next_attempt_at").select_for_update(skip_locked=True).first()
+                    if email is None:
+                        break
+                    if email.send(connection=connection):
+                        sent += 1
+                    else:
+                        failed += 1
+        return sent, failed
+
 
 class StandardPage(Page):
     """
@@ -2071,6 +2535,27 @@ class FooterText(
     class Meta(TranslatableMixin.Meta):
         verbose_name_plural = "Footer Text"
 
+    cache_key = "footer_text"
+    # Publishing clears the cache; the timeout limits how long other
+    # processes can show old text if the cache isn't shared between them
+    cache_timeout = 60 * 10
+
+    @classmethod
+    def live_body(cls):
+        """The body of the most recently created live footer text, cached"""
+        def build():
+            footer_text = cls.objects.filter(live=True).order_by("-id").only("body").first()
+            return footer_text.body if footer_text else ""
+
+        return get_or_build(cls.cache_key, build, cls.cache_timeout)
+
+
+@receiver(published, sender=FooterText, dispatch_uid="footertext_publish_cache")
+@receiver(unpublished, sender=FooterText, dispatch_uid="footertext_unpublish_cache")
+@receiver(post_delete, sender=FooterText, dispatch_uid="footertext_delete_cache")
+def invalidate_footer_text(sender, **kwargs):
+    transaction.on_commit(lambda: cache.delete(FooterText.cache_key))
+
 
 class NewsPage(Page):
     parent_page_types = ["HomePage"]
@@ -0,0 +1,58 @@
+
+from html2text import html2text
+
+from common.cache import bump_version, get_or_build, get_version
+
+
+SCHEMA_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def schema_version_name(page_id):
+    return f"pdf_form_page:{page_id}"
+
+
+def invalidate_form_schema(page_id):
+    """The page's form fields have changed"""
+    bump_version(schema_version_name(page_id))
+
+
+class PDFFormSchema:
+    """
+    The form fields of a PDFFormPage, as used to display and render submissions:
+    fields in order, their labels, and their info texts (as HTML, and converted
+    to text for PDFs).
+
+    `PDFFormSchema.for_page` returns a cached instance, so rendering a
+    submission doesn't query the fields for each one.
+    """
+    # Fields shown in the header of a submission, rather than with its data
+    HEADER_FIELDS = ["name", "email", "email_address", "wagtailcaptcha", "reference"]
+
+    def __init__(self, page):
+        self.page_id = page.id
+        form_fields = list(page.pdf_form_fields.all())
+        self.fields = [
+            field.clean_name for field in form_fields if field.clean_name not in self.HEADER_FIELDS
+        ]
+        self.labels = {field.clean_name: field.label for field in form_fields}
+        self.info_texts = {
+            field.label: {
+                "before": field.before_info_text, 
+                "after": field.after_info_text
+            } for field in form_fields
+        }
+        self.text_info_texts = {
+            label: {location: html2text(info_text) for location, info_text in info_texts.items()}
+            for label, info_texts in self.info_texts.items()
+        }
+
+    @classmethod
+    def cache_key(cls, page_id):
+        return f"pdf_form_schema:{page_id}:{get_version(schema_version_name(page_id))}"
+
+    @classmethod
+    def for_page(cls, page):
+        return get_or_build(cls.cache_key(page.id), lambda: cls(page), SCHEMA_CACHE_TIMEOUT, local=True)
+
+    def label(self, clean_name):
+        return self.labels.get(clean_name, clean_name)
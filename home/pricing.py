@@ -0,0 +1,194 @@
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+
+from common.cache import bump_version, get_or_build, get_versions
+
+
+PRICING_CACHE_TIMEOUT = 60 * 60
+
+
+def page_version_name(page_id):
+    return f"order_form_page:{page_id}"
+
+
+def stock_version_name(page_id):
+    return f"order_form_stock:{page_id}"
+
+
+def invalidate_page_pricing(page_id):
+    """Page, variant, shipping or voucher data has changed"""
+    bump_version(page_version_name(page_id))
+
+
+def invalidate_stock(page_id):
+    """The stock ledger for the page has changed"""
+    bump_version(stock_version_name(page_id))
+    # and again once committed, in case pricing was rebuilt from the old stock
+    # in the meantime
+    transaction.on_commit(lambda: bump_version(stock_version_name(page_id)))
+
+
+def stock_unavailable_message(remaining_stock, label=None):
+    rem_stock = remaining_stock if remaining_stock >= 0 else 0
+    label = f" for {label}" if label else ""
+    return f"Quantity selected{label} is unavailable; select a maximum of {rem_stock} total items."
+
+
+class OutOfStockError(Exception):
+    """
+    Raised when reserving stock for an order would take a stock counter over
+    its limit
+    """
+    def __init__(self, key, remaining_stock, label=None):
+        self.key = key
+        self.remaining_stock = remaining_stock
+        self.label = label
+        super().__init__(stock_unavailable_message(remaining_stock, label))
+
+
+class OrderPricing:
+    """
+    Prices orders and checks them against remaining stock for an OrderFormPage,
+    in memory.
+
+    Holds the page's variants, shipping costs, active voucher codes and stock
+    limits, and (if include_stock) a snapshot of the stock sold so far from the
+    order ledger. `OrderPricing.for_page` returns a cached instance, keyed on
+    the page and stock ledger versions, so repeated calls (e.g. the htmx order
+    total endpoint) don't hit the database.
+    """
+
+    def __init__(self, page, include_stock=False):
+        self.page_id = page.id
+        self.variants = {variant.slug: variant for variant in page.order_data["variants"]}
+        self.shipping_costs = page.shipping_costs_dict or {}
+        self.vouchers = {
+            voucher.code: voucher.amount for voucher in page.order_data["vouchers"] if voucher.active
+        }
+        self.stock = page.get_stock_quantities()
+        self.ordered = None
+        if include_stock:
+            self.ordered = page.get_total_quantity_ordered_by_group_and_variant()
+
+    @classmethod
+    def cache_key(cls, page_id):
+        page_version, stock_version = get_versions(
+            page_version_name(page_id), stock_version_name(page_id)
+        )
+        return f"order_pricing:{page_id}:{page_version}:{stock_version}"
+
+    @classmethod
+    def for_page(cls, page_id):
+        # Read the versions before building, so an engine built while the stock
+        # ledger changes is stored under the old key and not reused
+        key = cls.cache_key(page_id)
+
+        def build():
+            from .models import OrderFormPage
+            page = get_object_or_404(OrderFormPage, pk=page_id)
+            return cls(page, include_stock=True)
+
+        return get_or_build(key, build, PRICING_CACHE_TIMEOUT, local=True)
+
+    def get_quantities(self, data):
+        def get_item(v):
+            if isinstance(v, list):
+                quantity = v[0]
+            else:
+                quantity = v
+            # Quantity may be None if new variants have been added
+            if quantity is None:
+                return 0
+            return int(quantity)
+        return {
+            k: get_item(v) for k, v in data.items() if k in self.variants
+        }
+
+    def quantity_ordered(self, data):
+        quantities = {
+            "total": 0,
+            "groups": {},
+            "variants": {}
+        }
+        for key, quantity in self.get_quantities(data).items():
+            variant = self.variants[key]
+            item_quantity = variant.item_count * quantity
+            quantities["total"] += item_quantity
+            quantities["variants"].setdefault(key, 0)
+            quantities["variants"][key] += item_quantity
+            quantities["groups"].setdefault(variant.group_name, 0)
+            quantities["groups"][variant.group_name] += item_quantity
+        return quantities
+
+    def shipping_cost(self, quantity):
+        if not self.shipping_costs:
+            return 0
+        for max_quantity, shipping_label_and_cost in self.shipping_costs.items():
+            if max_quantity >= quantity:
+                return shipping_label_and_cost[1]
+        # If there was no ceiling max set, use the highest rate
+        return shipping_label_and_cost[1]
+
+    def voucher_amount(self, data):
+        code = data.get("voucher_code", "")
+        if isinstance(code, list):
+            code = code[0]
+        return self.vouchers.get(code.strip(), 0)
+
+    def price(self, data):
+        """
+        Returns a dict of variant slug to (variant, quantity), the total cost
+        (including shipping, less any voucher discount) and the voucher discount
+        """
+        voucher_amount = self.voucher_amount(data)
+        total = 0
+        variant_quantities = {}
+        for key, quantity in self.get_quantities(data).items():
+            variant = self.variants[key]
+            variant_quantities[key] = (variant, quantity)
+            total += (variant.cost * quantity)
+        if total > 0:
+            total += self.shipping_cost(self.quantity_ordered(data)["total"])
+            total -= voucher_amount
+
+        return variant_quantities, total, voucher_amount
+
+    def check_stock(self, data):
+        """
+        Check the quantities in data against the remaining stock.
+        Returns (valid, validation error message)
+        """
+        if self.ordered is None:
+            raise ValueError("Stock checks require pricing built with include_stock=True")
+
+        validation_error_msg = ""
+        valid = True
+        total_for_this_order = self.quantity_ordered(data)
+
+        # First check totals
+        if "overall" in self.stock:
+            remaining_stock = self.stock["overall"] - self.ordered["total"]
+            valid = total_for_this_order["total"] <= remaining_stock
+            if not valid:
+                validation_error_msg = stock_unavailable_message(remaining_stock)
+            return valid, validation_error_msg
+
+        # Next check groups
+        for group, quantity in total_for_this_order["groups"].items():
+            if group in self.stock["groups"]:
+                remaining_stock = self.stock["groups"][group] - self.ordered["groups"].get(group, 0)
+                valid = quantity <= remaining_stock
+                if not valid:
+                    validation_error_msg = stock_unavailable_message(remaining_stock, group)
+                    return valid, validation_error_msg
+
+        # Finally check variants
+        for variant, quantity in total_for_this_order["variants"].items():
+            if variant in self.stock["variants"]:
+                remaining_stock = self.stock["variants"][variant] - self.ordered["variants"].get(variant, 0)
+                valid = quantity <= remaining_stock
+                if not valid:
+                    validation_error_msg = stock_unavailable_message(remaining_stock, self.variants[variant].name)
+                    return valid, validation_error_msg
+
+        return valid, validation_error_msg
@@ -1,11 +1,14 @@
 import datetime
 
 from django.core import mail
+from django.core.cache import cache
 
 from model_bakery import baker
 
 import pytest
 
+from common import cache as common_cache
+from common.cache import get_or_build, get_version
 from .conftest import FormPageFactory
 from ..models import FormField, FooterText
 
@@ -98,3 +101,78 @@ def test_footer_text(home_page, rf):
 
     assert footer.get_preview_context(request, None) == {"footer_text": "I am a footer"}
     assert footer.get_preview_template(request, None) == "base.html"
+
+
+def test_footer_text_live_body_cached(django_assert_num_queries, django_capture_on_commit_callbacks):
+    footer = FooterText.objects.create(body="Old footer")
+    with django_assert_num_queries(1):
+        assert FooterText.live_body() == "Old footer"
+        assert FooterText.live_body() == "Old footer"
+
+    footer.body = "New footer"
+    with django_capture_on_commit_callbacks(execute=True):
+        footer.save_revision().publish()
+    assert FooterText.live_body() == "New footer"
+
+    with django_capture_on_commit_callbacks(execute=True):
+        footer.unpublish()
+    assert FooterText.live_body() == ""
+
+
+def test_get_or_build_local_cache():
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"value": len(builds)}
+
+    assert get_or_build("test:1", build, local=True) == {"value": 1}
+    # served from the local cache, even once gone from the shared cache
+    cache.delete("test:1")
+    assert get_or_build("test:1", build, local=True) == {"value": 1}
+    assert get_or_build("test:1", build) == {"value": 2}
+    assert len(builds) == 2
+
+
+def test_get_or_build_waits_for_other_build(monkeypatch):
+    monkeypatch.setattr(common_cache, "BUILD_WAIT", 0.2)
+    # another process is building the value
+    cache.add("lock:test:1", 1)
+    assert get_or_build("test:1", lambda: "built") == "built"
+
+    cache.delete("test:1")
+    sleeps = []
+
+    def sleep(seconds):
+        # the other process finishes building
+        sleeps.append(seconds)
+        cache.set("test:1", "built elsewhere")
+
+    monkeypatch.setattr(common_cache.time, "sleep", sleep)
+    assert get_or_build("test:1", lambda: "built") == "built elsewhere"
+    assert len(sleeps) == 1
+
+
+def test_get_or_build_cache_unavailable(settings, monkeypatch):
+    # memcached is down, and its errors are ignored as in production
+    settings.CACHES = {
+        **settings.CACHES,
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": "127.0.0.1:1",
+            "OPTIONS": {"ignore_exc": True, "connect_timeout": 0.1, "timeout": 0.1},
+        },
+    }
+
+    def sleep(seconds):
+        raise AssertionError("waited for a build lock that isn't held")
+
+    monkeypatch.setattr(common_cache.time, "sleep", sleep)
+    assert [get_or_build("test:1", lambda: "built") for _ in range(3)] == ["built"] * 3
+
+
+def test_get_version_cache_unavailable(monkeypatch):
+    monkeypatch.setattr(common_cache.cache, "get", lambda key, default=None: default)
+    monkeypatch.setattr(common_cache.cache, "add", lambda key, value, timeout=None: False)
+    monkeypatch.setattr(common_cache.time, "time_ns", lambda: 123)
+    assert get_version("test") == 123
@@ -1,15 +1,28 @@
 import datetime
+from io import StringIO
 
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from model_bakery import baker
+from wagtail.images import get_image_model
+from wagtail.images.tests.utils import get_test_image_file
 
 import pytest
 
 from .conftest import OrderFormPageFactory
-from ..models import OrderShippingCost
+from ..models import (
+    OrderFormPage, OrderFormSubmission, OrderLineItem, OrderShippingCost, OrderStock, OutboxEmail, ProductVariant
+)
+from ..pricing import OutOfStockError
 
 pytestmark = pytest.mark.django_db
 
@@ -331,6 +344,165 @@ def test_quantity_ordered_by_submission(order_form_page, order_form_pre_submissi
     }
 
 
+
+def test_order_line_items(order_form_page, order_form_pre_submission):
+    baker.make("home.ProductVariant", page=order_form_page, group_name="group1", name="test product x5", cost=45, item_count=5)
+
+    submission = order_form_pre_submission({"pv__test_product": 2, "pv__group1_test_product_x5": 1})
+    assert set(submission.line_items.values_list("variant_slug", "group_name", "quantity", "item_quantity")) == {
+        ("pv__test_product", "", 2, 2),
+        ("pv__group1_test_product_x5", "group1", 1, 5),
+    }
+
+    # ledger is replaced when the order changes
+    submission.form_data = {**submission.form_data, "pv__test_product": 0}
+    submission.save()
+    assert list(submission.line_items.values_list("variant_slug", "item_quantity")) == [
+        ("pv__group1_test_product_x5", 5)
+    ]
+    assert order_form_page.get_total_quantity_ordered_by_group_and_variant() == {
+        "total": 5, "groups": {"group1": 5}, "variants": {"pv__group1_test_product_x5": 5}
+    }
+
+    # and left alone for status changes
+    line_item_ids = set(submission.line_items.values_list("id", flat=True))
+    submission.mark_paid()
+    submission.refresh_from_db()
+    submission.mark_shipped()
+    assert set(submission.line_items.values_list("id", flat=True)) == line_item_ids
+
+
+def test_order_line_items_ignore_deleted_variants(order_form_page, order_form_pre_submission):
+    variant = baker.make("home.ProductVariant", page=order_form_page, name="test product x5", cost=45, item_count=5)
+    order_form_pre_submission({"pv__test_product": 1, "pv__test_product_x5": 1})
+    assert order_form_page.get_total_quantity_ordered() == 6
+
+    variant.delete()
+    assert order_form_page.get_total_quantity_ordered() == 1
+
+    # the form data still has the deleted variant's slug
+    submission = OrderFormSubmission.objects.get()
+    submission.form_data = {**submission.form_data, "pv__test_product": 2}
+    submission.save()
+    assert order_form_page.get_total_quantity_ordered() == 2
+
+
+def test_order_stock_recounted_on_variant_change(order_form_page, order_form_pre_submission):
+    variant = baker.make("home.ProductVariant", page=order_form_page, name="test product x5", cost=45, item_count=5)
+    order_form_pre_submission({"pv__test_product": 0, "pv__test_product_x5": 2})
+    assert order_form_page.get_total_quantity_ordered() == 10
+
+    variant = ProductVariant.objects.get(id=variant.id)
+    variant.item_count = 6
+    variant.group_name = "Packs"
+    variant.save()
+    line_item = OrderLineItem.objects.get()
+    assert (line_item.group_name, line_item.item_quantity) == ("Packs", 12)
+    assert dict(OrderStock.objects.values_list("key", "reserved")) == {
+        OrderStock.OVERALL: 12,
+        OrderStock.group_key(""): 0,
+        OrderStock.group_key("Packs"): 12,
+        OrderStock.variant_key("pv__test_product_x5"): 12,
+    }
+
+
+def test_rebuild_order_line_items_command(order_form_page, order_form_pre_submission):
+    order_form_pre_submission({"pv__test_product": 3})
+    OrderLineItem.objects.all().delete()
+    OrderStock.objects.all().delete()
+    assert order_form_page.get_total_quantity_ordered() == 0
+
+    out = StringIO()
+    call_command("rebuild_order_line_items", stdout=out)
+    assert order_form_page.get_total_quantity_ordered() == 3
+    assert out.getvalue() == "Test Order Form: 3 items ordered\n"
+
+
+def test_reserve_stock(order_form_page, order_form_pre_submission):
+    order_form_page.total_available = 5
+    order_form_page.save()
+    submission = order_form_pre_submission({"pv__test_product": 3})
+
+    submission.form_data = {**submission.form_data, "pv__test_product": 6}
+    with pytest.raises(OutOfStockError, match="select a maximum of 2 total items"):
+        submission.save(check_stock=True)
+    # nothing was reserved
+    assert order_form_page.get_total_quantity_ordered() == 3
+    assert list(submission.line_items.values_list("quantity", flat=True)) == [3]
+
+    # changing an order only reserves the difference
+    submission.form_data = {**submission.form_data, "pv__test_product": 5}
+    submission.save(check_stock=True)
+    assert order_form_page.get_total_quantity_ordered() == 5
+
+    submission.delete()
+    assert order_form_page.get_total_quantity_ordered() == 0
+
+
+def test_reserve_stock_by_variant(order_form_page, order_form_pre_submission):
+    baker.make("home.ProductVariant", page=order_form_page, variant_total_available=2, name="test product x2", cost=10, item_count=2)
+    submission = order_form_pre_submission({"pv__test_product": 1})
+    submission.form_data = {**submission.form_data, "pv__test_product_x2": 2}
+    with pytest.raises(OutOfStockError, match="for test product x2 is unavailable; select a maximum of 2"):
+        submission.save(check_stock=True)
+
+
+def test_reserved_stock_expires(
+    settings, order_form_page, order_form_pre_submission, django_capture_on_commit_callbacks
+):
+    settings.ORDER_RESERVATION_MINUTES = 30
+    order_form_page.total_available = 5
+    order_form_page.save()
+    submission = order_form_pre_submission({"pv__test_product": 3})
+    assert submission.line_items.get().expires_at is not None
+
+    submission.submit_time = timezone.now() - datetime.timedelta(minutes=31)
+    submission.save()
+    order_form_page.rebuild_line_items()
+    assert order_form_page.get_total_quantity_ordered() == 0
+
+    # a new order can use the expired stock
+    other = order_form_pre_submission({"pv__test_product": 4})
+    other.form_data = {**other.form_data, "pv__test_product": 5}
+    other.save(check_stock=True)
+    assert order_form_page.get_total_quantity_ordered() == 5
+
+    # paying for the expired order doesn't take its stock back from the new order
+    submission.refresh_from_db()
+    with django_capture_on_commit_callbacks(execute=True):
+        submission.mark_paid()
+    line_item = submission.line_items.get()
+    assert line_item.expires_at is None
+    assert line_item.released
+    assert order_form_page.get_total_quantity_ordered() == 5
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].subject == f"Paid order {submission.reference} is out of stock"
+    assert mail.outbox[0].to == ["admin@test.com"]
+    assert "0 items are left" in mail.outbox[0].body
+
+    # it's taken back if there's enough stock once expired orders are released
+    other.delete()
+    other = order_form_pre_submission({"pv__test_product": 3})
+    other.line_items.update(expires_at=timezone.now())
+    submission.hold_line_items()
+    assert not submission.line_items.get().released
+    assert order_form_page.get_total_quantity_ordered() == 3
+
+
+def test_release_expired_stock_command(settings, order_form_page, order_form_pre_submission):
+    settings.ORDER_RESERVATION_MINUTES = 30
+    unpaid = order_form_pre_submission({"pv__test_product": 3})
+    paid = order_form_pre_submission({"pv__test_product": 2})
+    paid.mark_paid()
+    unpaid.line_items.update(expires_at=timezone.now())
+
+    out = StringIO()
+    call_command("release_expired_stock", stdout=out)
+    assert out.getvalue() == "1 expired order items released\n"
+    assert order_form_page.get_total_quantity_ordered() == 2
+    assert unpaid.line_items.get().released
+
+
 @pytest.mark.parametrize(
     "total_available,quantity,is_valid,err_msg",
     [
@@ -404,6 +576,92 @@ def test_order_form_process_form_submission(order_form_page):
     )
 
 
+def test_order_form_process_form_submission_with_outbox(settings, order_form_page):
+    settings.EMAIL_OUTBOX = True
+    form_class = order_form_page.get_form_class()
+    form = form_class(
+        {
+            "name": "Minnie Mouse",
+            "email_address": "m@mouse.com",
+            "pv__test_product": 1,
+            "data_processing_consent": True,
+            "g-recaptcha-response": "PASSED"
+        },
+        page=order_form_page
+    )
+    assert form.is_valid()
+    order_form_page.process_form_submission(form)
+    assert len(mail.outbox) == 0
+    assert OutboxEmail.objects.filter(status="pending").count() == 2
+
+    out = StringIO()
+    call_command("process_outbox", stdout=out)
+    assert out.getvalue() == "2 emails sent, 0 failed\n"
+    assert [email.to for email in mail.outbox] == [["admin@test.com"], ["m@mouse.com"]]
+    assert mail.outbox[0].body.endswith("Total amount due: £12.00")
+    assert mail.outbox[1].reply_to == [settings.DEFAULT_ADMIN_EMAIL]
+    assert not OutboxEmail.objects.filter(status="pending").exists()
+
+
+def test_outbox_email_retries(settings):
+    settings.EMAIL_OUTBOX = True
+    settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 2
+    # newlines in headers can't be sent
+    email = OutboxEmail.objects.create(
+        message={
+            "subject": "bad\nsubject", "body": "", "from_email": "a@test.com", "to": ["b@test.com"], "reply_to": None
+        }
+    )
+    assert OutboxEmail.process() == (0, 1)
+    email.refresh_from_db()
+    assert email.status == "pending"
+    assert email.attempts == 1
+    assert email.next_attempt_at > timezone.now() + datetime.timedelta(seconds=50)
+    assert "Header values may not contain linefeed" in email.last_error
+
+    # not due yet
+    assert OutboxEmail.process() == (0, 0)
+
+    OutboxEmail.objects.update(next_attempt_at=timezone.now())
+    assert OutboxEmail.process() == (0, 1)
+    email.refresh_from_db()
+    assert email.status == "failed"
+    assert email.attempts == 2
+
+
+def test_order_form_process_form_submission_out_of_stock(
+    order_form_page, order_form_pre_submission, django_capture_on_commit_callbacks
+):
+    order_form_page.total_available = 3
+    order_form_page.save()
+    baker.make("home.OrderFormField", label="photo", field_type="image", page=order_form_page)
+    form_class = order_form_page.get_form_class()
+    form = form_class(
+        {
+            "name": "Minnie Mouse",
+            "email_address": "m@mouse.com",
+            "pv__test_product": 2,
+            "data_processing_consent": True,
+            "g-recaptcha-response": "PASSED"
+        },
+        {"photo": SimpleUploadedFile("photo.png", get_test_image_file().file.getvalue())},
+        page=order_form_page
+    )
+    assert form.is_valid()
+
+    # stock is sold to someone else after the form was validated
+    order_form_pre_submission({"pv__test_product": 2})
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(OutOfStockError, match="select a maximum of 1 total items"):
+            order_form_page.process_form_submission(form)
+    assert order_form_page.orderformsubmission_set.count() == 1
+    assert order_form_page.get_total_quantity_ordered() == 2
+    assert len(mail.outbox) == 0
+    # the uploaded image isn't kept
+    assert not get_image_model().objects.exists()
+    assert not default_storage.listdir("original_images")[1]
+
+
 def test_order_form_process_form_submission_with_voucher_code(order_form_page):
     baker.make(
         "home.OrderVoucher", order_form_page=order_form_page, code="foo", amount=2, active=True
@@ -612,4 +870,37 @@ def test_order_form_submission_no_shipping_cost(order_form_page):
     OrderShippingCost.objects.all().delete() 
     assert order_form_page.get_shipping_cost(5) == 0
     _, total, _ = order_form_page.get_variant_quantities_and_total({"pv__test_product": 1})
-    assert total == 10
\ No newline at end of file
+    assert total == 10
+
+def test_order_form_page_render_queries_independent_of_variants(rf, order_form_page):
+    def _render_queries():
+        # fetch the page fresh, as for a new request
+        page = OrderFormPage.objects.get(id=order_form_page.id)
+        request = rf.get(page.url)
+        request.user = AnonymousUser()
+        request.session = {}
+        with CaptureQueriesContext(connection) as queries:
+            page.serve(request).render()
+        return len(queries)
+
+    # first render warms up cached site/page url lookups
+    _render_queries()
+    baseline = _render_queries()
+
+    for i in range(5):
+        baker.make(
+            "home.ProductVariant", page=order_form_page, group_name="group1",
+            name=f"size {i}", cost=10, variant_total_available=5
+        )
+    order_form_page.show_summary = True
+    order_form_page.save()
+    assert len(order_form_page.order_data["variants"]) == 6
+    assert _render_queries() == baseline
+
+
+def test_order_form_page_order_data_cleared_on_related_change(order_form_page):
+    assert order_form_page.shipping_costs_dict == {OrderShippingCost.DEFAULT_MAX: ("Flat rate per order", 2)}
+    baker.make(OrderShippingCost, order_form_page=order_form_page, max_quantity=1, amount=1)
+    assert order_form_page.shipping_costs_dict == {
+        1: ("1 item", 1), OrderShippingCost.DEFAULT_MAX: ("2+ items", 2)
+    }
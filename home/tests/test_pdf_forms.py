@@ -1,4 +1,7 @@
+import io
+import zipfile
 from datetime import timedelta
+from unittest.mock import patch
 
 import pytest
 
@@ -6,11 +9,18 @@ from django.contrib.sessions.middleware import SessionMiddleware
 from django.contrib.messages.middleware import MessageMiddleware
 from django.contrib.auth.models import AnonymousUser, User
 from django.core import mail
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 
 from model_bakery import baker
 
 from .conftest import PDFFormPageFactory
+from ..generate_form_submission_pdf import export_pdfs, generate_pdf, get_pdf, pdf_content_hash, pdf_storage_dir
+from ..models import OutboxEmail, PDFFormField, PDFFormSubmission
 
 pytestmark = pytest.mark.django_db
 
@@ -250,6 +260,34 @@ def test_pdf_form_page_serve_post_submit_missing_form_data(pdf_form_page, rf):
     }
 
 
+def test_pdf_form_page_serve_post_submit_with_outbox(settings, pdf_form_page, rf):
+    settings.EMAIL_OUTBOX = True
+    data = {
+        "name": "Mickey Mouse",
+        "email": "mickey.mouse@test.com",
+        "data_processing_consent": True,
+        "a_checkbox": True,
+        "a_multicheckbox": ["yes"],
+        "a_field": "Foo\r\nbar",
+        "submit": "Submit"
+    }
+    request = rf.post("/", data)
+    setup_request(request)
+
+    pdf_form_page.serve(request)
+    submission = pdf_form_page.pdfformsubmission_set.get()
+    assert len(mail.outbox) == 0
+    assert OutboxEmail.objects.filter(status="pending").count() == 2
+
+    # the PDF is generated when the email is sent
+    assert OutboxEmail.process() == (2, 0)
+    assert len(mail.outbox) == 2
+    assert mail.outbox[0].to == ["admin@test.com"]
+    assert mail.outbox[0].attachments[0][0] == submission.get_download_filename()
+    assert mail.outbox[1].to == ["mickey.mouse@test.com"]
+    assert mail.outbox[1].attachments == []
+
+
 def test_pdf_form_page_serve_post_submit(pdf_form_page, rf):
     assert not pdf_form_page.pdfformsubmission_set.exists()
     # partial data
@@ -272,3 +310,177 @@ def test_pdf_form_page_serve_post_submit(pdf_form_page, rf):
     assert len(mail.outbox) == 2
     assert mail.outbox[0].to == ["admin@test.com"]
     assert mail.outbox[1].to == ["mickey.mouse@test.com"]
+
+
+def test_get_pdf_stored_per_version(settings, pdf_form_submission):
+    submission = pdf_form_submission()
+    storage_dir = pdf_storage_dir(submission)
+    with get_pdf(submission) as pdf:
+        content = pdf.read()
+    assert content.startswith(b"%PDF")
+    _, filenames = default_storage.listdir(storage_dir)
+    assert len(filenames) == 1
+
+    # reused while the submission is unchanged
+    with get_pdf(submission) as pdf:
+        assert pdf.read() == content
+    assert default_storage.listdir(storage_dir)[1] == filenames
+
+    # regenerated when it changes, and the old version is removed
+    submission.form_data = {**submission.form_data, "a_field": "Baz"}
+    submission.save()
+    get_pdf(submission).close()
+    _, new_filenames = default_storage.listdir(storage_dir)
+    assert len(new_filenames) == 1
+    assert new_filenames != filenames
+
+    # and when the encryption key version changes (the key itself isn't hashed)
+    settings.PDF_ENCRYPTION_KEY_VERSION = "2"
+    get_pdf(submission).close()
+    _, key_filenames = default_storage.listdir(storage_dir)
+    assert len(key_filenames) == 1
+    assert key_filenames != new_filenames
+    assert pdf_content_hash(submission) == key_filenames[0].removesuffix(".pdf")
+    settings.PDF_ENCRYPTION_KEY = "another key"
+    assert pdf_content_hash(submission) == key_filenames[0].removesuffix(".pdf")
+
+    submission.delete()
+    assert default_storage.listdir(storage_dir)[1] == []
+
+
+def test_pdf_form_download(client, pdf_form_submission):
+    submission = pdf_form_submission()
+    resp = client.get(reverse("pdf_form_download", args=(submission.pk,)))
+    assert resp.status_code == 200
+    assert resp["Content-Type"] == "application/pdf"
+    assert submission.get_download_filename() in resp["Content-Disposition"]
+    with get_pdf(submission) as pdf:
+        assert b"".join(resp.streaming_content) == pdf.read()
+
+
+def _submit(pdf_form_submission, name):
+    submission = pdf_form_submission({"name": name})
+    submission.is_draft = False
+    submission.save()
+    return submission
+
+
+def test_pdf_form_export(admin_client, pdf_form_page, pdf_form_submission):
+    submissions = [_submit(pdf_form_submission, name) for name in ["Mickey", "Minnie"]]
+    draft = pdf_form_submission({"name": "Donald"})
+    url = reverse("pdf_form_export", args=(pdf_form_page.id,))
+
+    # all submitted forms, rendered in the request's process
+    with patch("home.generate_form_submission_pdf.ProcessPoolExecutor") as executor:
+        resp = admin_client.get(url)
+        assert resp.status_code == 200
+        assert resp["Content-Type"] == "application/zip"
+        zip_file = zipfile.ZipFile(io.BytesIO(b"".join(resp.streaming_content)))
+    executor.assert_not_called()
+    assert set(zip_file.namelist()) == {submission.get_download_filename() for submission in submissions}
+    with get_pdf(submissions[0]) as pdf:
+        assert zip_file.read(submissions[0].get_download_filename()) == pdf.read()
+
+    # selected forms
+    resp = admin_client.get(url, {"selected-submissions": [submissions[0].id, draft.id]})
+    zip_file = zipfile.ZipFile(io.BytesIO(b"".join(resp.streaming_content)))
+    assert set(zip_file.namelist()) == {submissions[0].get_download_filename(), draft.get_download_filename()}
+
+
+def test_pdf_form_export_too_many_submissions(settings, admin_client, pdf_form_page, pdf_form_submission):
+    settings.PDF_EXPORT_MAX_SUBMISSIONS = 1
+    for name in ["Mickey", "Minnie"]:
+        _submit(pdf_form_submission, name)
+    resp = admin_client.get(reverse("pdf_form_export", args=(pdf_form_page.id,)), follow=True)
+    assert resp.redirect_chain == [
+        (f"{reverse('wagtailforms:list_submissions', args=(pdf_form_page.id,))}?", 302)
+    ]
+    assert "Too many submissions to export at once (2)" in [str(message) for message in resp.context["messages"]][0]
+
+
+def test_pdf_form_export_permission_denied(client, pdf_form_page):
+    resp = client.get(reverse("pdf_form_export", args=(pdf_form_page.id,)))
+    assert resp.status_code == 403
+
+
+def test_export_pdf_submissions_command(tmp_path, pdf_form_page, pdf_form_submission):
+    submissions = [_submit(pdf_form_submission, name) for name in ["Mickey", "Minnie"]]
+    output = tmp_path / "export.zip"
+    out = io.StringIO()
+    call_command("export_pdf_submissions", pdf_form_page.id, str(output), workers=1, stdout=out)
+    assert out.getvalue().split("\n") == [
+        "1/2 PDFs exported", "2/2 PDFs exported", f"{pdf_form_page.title}: PDFs written to {output}", ""
+    ]
+    assert set(zipfile.ZipFile(output).namelist()) == {
+        submission.get_download_filename() for submission in submissions
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_pdfs_process_pool(pdf_form_page, pdf_form_submission):
+    submissions = [_submit(pdf_form_submission, f"Person {i}") for i in range(5)]
+    progress = []
+    with patch("home.generate_form_submission_pdf.close_caches") as close_caches:
+        exported = dict(
+            export_pdfs(
+                [submission.id for submission in submissions],
+                max_workers=2,
+                progress=lambda done, total: progress.append((done, total))
+            )
+        )
+    # cache connections are closed before forking the workers
+    close_caches.assert_called_once()
+    assert set(exported) == {submission.get_download_filename() for submission in submissions}
+    assert all(content.startswith(b"%PDF") for content in exported.values())
+    assert progress == [(i, 5) for i in range(1, 6)]
+
+
+def test_form_schema(pdf_form_page, pdf_form_submission):
+    baker.make(
+        PDFFormField, label="Info", field_type="singleline", page=pdf_form_page,
+        before_info_text="<p>Some <b>info</b></p>", after_info_text=""
+    )
+    schema = pdf_form_page.form_schema
+    assert schema.fields == ["a_field", "a_multicheckbox", "a_checkbox", "info"]
+    assert schema.label("info") == "Info"
+    assert schema.info_texts["Info"] == {"before": "<p>Some <b>info</b></p>", "after": ""}
+    assert schema.text_info_texts["Info"]["before"] == "Some **info**\n\n"
+
+    # updated when fields change
+    baker.make(PDFFormField, label="Another", field_type="singleline", page=pdf_form_page)
+    assert pdf_form_page.form_schema.fields[-1] == "another"
+
+
+def test_form_schema_invalidated_on_publish(pdf_form_page):
+    assert pdf_form_page.form_schema.labels["a_field"] == "A field"
+    # update the field without signals, as a publish does through the page's
+    # child relation
+    PDFFormField.objects.filter(page=pdf_form_page, clean_name="a_field").update(label="Renamed")
+    pdf_form_page.save_revision().publish()
+
+    page = pdf_form_page.__class__.objects.get(id=pdf_form_page.id)
+    assert page.form_schema.labels["a_field"] == "Renamed"
+
+
+def test_render_submission_queries_independent_of_fields(pdf_form_page, pdf_form_submission):
+    submission = pdf_form_submission()
+
+    def _render_queries():
+        fresh = PDFFormSubmission.objects.get(id=submission.id)
+        with CaptureQueriesContext(connection) as queries:
+            fresh.display_data()
+            generate_pdf(fresh)
+        return len(queries)
+
+    _render_queries()
+    baseline = _render_queries()
+
+    for i in range(5):
+        baker.make(
+            PDFFormField, label=f"Extra {i}", field_type="singleline", page=pdf_form_page,
+            before_info_text="<p>Info</p>"
+        )
+    submission.form_data = {**submission.form_data, **{f"extra_{i}": "x" for i in range(5)}}
+    submission.save()
+    _render_queries()
+    assert _render_queries() == baseline
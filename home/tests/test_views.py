@@ -190,3 +190,29 @@ def test_order_form_submission_list_view_write_csv(rf, admin_user, tmp_path, ord
         ['Submission date', 'name', 'email_address', 'test product', 'Email', 'Reference', 'Total (£)', 'Total items', 'Paid', 'Shipped'], 
         ['2020-01-01 00:00:00+00:00', 'Mickey Mouse', 'mickey.mouse@test.com', '2', '', submission.reference, "22.00", "2", '-', '-']
     ]
+
+
+def test_calculate_order_total_view_uses_cached_pricing(client, order_form_page, order_form_pre_submission, django_assert_num_queries):
+    order_form_page.total_available = 5
+    order_form_page.save()
+    url = reverse("orders:calculate_order_total", args=(order_form_page.id,))
+    resp = client.post(url, {"pv__test_product": 3})
+    assert "<span id='order-total'>32.00</span>" in resp.content.decode()
+
+    # pricing and stock are cached after the first call
+    with django_assert_num_queries(0):
+        resp = client.post(url, {"pv__test_product": 4})
+    assert "<span id='order-total'>42.00</span>" in resp.content.decode()
+    assert "Quantity selected is unavailable" not in resp.content.decode()
+
+    # a new order invalidates the cached stock
+    order_form_pre_submission({"pv__test_product": 2})
+    resp = client.post(url, {"pv__test_product": 4})
+    assert "Quantity selected is unavailable; select a maximum of 3 total items." in resp.content.decode()
+
+    # and a price change invalidates the cached prices
+    variant = order_form_page.product_variants.first()
+    variant.cost = 5
+    variant.save()
+    resp = client.post(url, {"pv__test_product": 1})
+    assert "<span id='order-total'>7.00</span>" in resp.content.decode()
@@ -1,21 +1,26 @@
 from django import forms
 from django.conf import settings
 from django.contrib import messages
-from django.http import FileResponse
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, HttpResponse, redirect
 from django.template.response import TemplateResponse
+from django.urls import reverse
 from django.utils.safestring import mark_safe
 
 from wagtail.admin.mail import send_mail
+from wagtail.contrib.forms.utils import get_forms_for_user
+from wagtail.contrib.forms.views import SubmissionsListFilterSet
 
-from .generate_form_submission_pdf import generate_pdf
-from .models import OrderFormPage, OrderFormSubmission, PDFFormSubmission
+from .generate_form_submission_pdf import get_pdf, stream_pdf_zip
+from .models import OrderFormSubmission, PDFFormPage, PDFFormSubmission
+from .pricing import OrderPricing
 from payments.utils import get_paypal_form
 
 
 def calculate_order_total_view(request, order_page_id):
-    order_page = get_object_or_404(OrderFormPage, pk=order_page_id)
-    variant_quantities, total, discount = order_page.get_variant_quantities_and_total(dict(request.POST))
+    pricing = OrderPricing.for_page(order_page_id)
+    variant_quantities, total, discount = pricing.price(dict(request.POST))
     discount_str = f" (discount £{discount})" if discount else ""
     resp_str = f"<span id='order-total'>{total}{discount_str}</span>"
     
@@ -29,7 +34,7 @@ def calculate_order_total_view(request, order_page_id):
         resp_str += "<div id='invalid-voucher' hx-swap-oob='true'></div>"
 
     # check quantities are allowed
-    allowed, validation_error_msg = order_page.quantity_submitted_is_valid(dict(request.POST))
+    allowed, validation_error_msg = pricing.check_stock(dict(request.POST))
     
     if not allowed:
         resp_str += f"""
@@ -149,7 +154,7 @@ def pdf_form_token_request(request, reference):
 
 def pdf_form_download(request, pk):
     submission = get_object_or_404(PDFFormSubmission, pk=pk)
-    pdf_filehandle = generate_pdf(submission)
+    pdf_filehandle = get_pdf(submission)
     
     return FileResponse(
         pdf_filehandle, 
@@ -159,5 +164,39 @@ def pdf_form_download(request, pk):
     )
 
 
+def pdf_form_export(request, page_id):
+    """
+    Zip file of PDFs for the selected submissions or, if none are selected, all
+    submitted forms matching the submissions list date filter.
+    The PDFs are rendered one at a time within the request (forking a pool of
+    workers from the web process isn't safe), so exports of more than
+    settings.PDF_EXPORT_MAX_SUBMISSIONS are refused; the export_pdf_submissions
+    command exports them instead, across processes and with progress reporting.
+    """
+    if not get_forms_for_user(request.user).filter(pk=page_id).exists():
+        raise PermissionDenied
+    page = get_object_or_404(PDFFormPage, pk=page_id)
+    selected_ids = request.GET.getlist("selected-submissions")
+    if selected_ids:
+        submissions = page.pdfformsubmission_set.filter(id__in=selected_ids)
+    else:
+        submissions = SubmissionsListFilterSet(
+            request.GET, queryset=page.pdfformsubmission_set.filter(is_draft=False)
+        ).qs
+    submission_ids = list(submissions.order_by("submit_time").values_list("id", flat=True))
+    if len(submission_ids) > settings.PDF_EXPORT_MAX_SUBMISSIONS:
+        messages.error(
+            request,
+            f"Too many submissions to export at once ({len(submission_ids)}); select at most "
+            f"{settings.PDF_EXPORT_MAX_SUBMISSIONS}, or ask an administrator to run "
+            f"'manage.py export_pdf_submissions {page.id} <output file>'."
+        )
+        return redirect(f"{reverse('wagtailforms:list_submissions', args=(page.id,))}?{request.GET.urlencode()}")
+
+    response = StreamingHttpResponse(stream_pdf_zip(submission_ids, max_workers=1), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{page.slug}-submissions.zip"'
+    return response
+
+
 def merch_info(request):
     return TemplateResponse(request, "home/merch_info.html")
@@ -234,19 +234,49 @@ SHORT_DATETIME_FORMAT = "d-M-Y H:i"
 SHORT_DATE_FORMAT = "d-M-Y"
 
 
+# "default" is shared by all processes; "local" is a small per-process cache
+# in front of it for hot, versioned entries (see common.cache.get_or_build);
+# "facebook" holds Facebook responses (including image bodies) for conditional
+# requests, kept on disk so they don't evict entries from "default"
+LOCAL_CACHE = {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    "LOCATION": "pins-local",
+    "OPTIONS": {"MAX_ENTRIES": 1000},
+}
 if TESTING or env('CI'):  # use local cache for tests
     CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
             'LOCATION': 'test-pins',
-        }
+        },
+        "local": LOCAL_CACHE,
+        "facebook": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "test-pins-facebook",
+        },
     }
 else:  # pragma: no cover
-    CACHES = {
-        "default": {
-            "BACKEND": 'django.core.cache.backends.filebased.FileBasedCache',
-            "LOCATION": root("cache"),
+    # e.g. pymemcache://127.0.0.1:11211,10.0.0.2:11211 or filecache:///path/to/cache
+    default_cache = env.cache_url("CACHE_URL", default="pymemcache://127.0.0.1:11211")
+    if default_cache["BACKEND"].endswith("PyMemcacheCache"):
+        default_cache["OPTIONS"] = {
+            "use_pooling": True,
+            "max_pool_size": env.int("CACHE_MAX_POOL_SIZE", default=8),
+            "no_delay": True,
+            "connect_timeout": 1,
+            "timeout": 1,
+            # A memcached outage is treated as cache misses rather than errors
+            "ignore_exc": True,
+            **default_cache.get("OPTIONS", {}),
         }
+    CACHES = {
+        "default": default_cache,
+        "local": LOCAL_CACHE,
+        "facebook": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": env.str("FB_HTTP_CACHE_DIR", default=os.path.join(BASE_DIR, "cache", "facebook")),
+            "OPTIONS": {"MAX_ENTRIES": env.int("FB_HTTP_CACHE_MAX_ENTRIES", default=5000)},
+        },
     }
 
 # Static files (CSS, JavaScript, Images)
@@ -332,6 +362,13 @@ SUPPORT_EMAIL = 'rebkwok@gmail.com'
 DEFAULT_ADMIN_EMAIL = "info@podencosinneed.org"
 SERVER_EMAIL = SUPPORT_EMAIL
 
+# Queue order and PDF form emails to be sent by the process_outbox command,
+# instead of sending them during the request
+EMAIL_OUTBOX = env.bool("EMAIL_OUTBOX", default=False)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# seconds; doubled after each failed attempt
+EMAIL_OUTBOX_RETRY_DELAY = 60
+
 # MAILCATCHER
 if env('USE_MAILCATCHER'):  # pragma: no cover
     EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -489,6 +526,8 @@ WAGTAILADMIN_BASE_URL = f"https://{DOMAIN}"
 
 WAGTAILIMAGES_JPEG_QUALITY = 65
 WAGTAILIMAGES_WEBP_QUALITY = 65
+# Processes used to generate dog page image renditions ahead of time
+RENDITION_WORKERS = env.int("RENDITION_WORKERS", default=2)
 
 # backup
 S3_LOG_BACKUP_PATH = "s3://backups.polefitstarlet.co.uk/pins_activitylogs"
@@ -500,6 +539,14 @@ FB_PAGE_ID = env.str("FB_PAGE_ID")
 FB_APP_SECRET = env.str("FB_APP_SECRET")
 FB_ACCESS_TOKEN = env.str("FB_ACCESS_TOKEN")
 FB_ACCESS_TOKEN_PATH = Path(PROJECT_DIR) / ".fb_access_token"
+# Threads used to fetch album photos and images during a full sync, and the
+# most requests per second made to each host
+FB_SYNC_WORKERS = env.int("FB_SYNC_WORKERS", default=4)
+FB_SYNC_REQUESTS_PER_SECOND = env.float("FB_SYNC_REQUESTS_PER_SECOND", default=5)
+# (connect, read) timeouts in seconds for Facebook requests, and how many times
+# requests that fail with a 429 or 5xx response are retried
+FB_HTTP_TIMEOUT = (5, 30)
+FB_HTTP_RETRIES = env.int("FB_HTTP_RETRIES", default=3)
 FB_ALBUM_IDS_TO_IGNORE = [
     "489076346765992",  # Mobile uploads
     "489076353432658",  # Timeline photos
@@ -546,12 +593,35 @@ PAYPAL_EMAIL = env.str("PAYPAL_EMAIL")
 PAYPAL_CUSTOM_KEY = env.str("PAYPAL_CUSTOM_KEY")
 PAYPAL_BUY_BUTTON_IMAGE = "/static/images/paypal-button.png"
 
+# Orders
+# Unpaid orders hold their stock for this many minutes; unset to hold it until
+# the order is deleted
+ORDER_RESERVATION_MINUTES = env.int("ORDER_RESERVATION_MINUTES", default=None)
+
+# Auctions
+# Seconds between auction pages' requests for the latest bid totals, and that
+# the totals are cached for (shared by everyone viewing the page)
+AUCTION_BID_TOTALS_POLL_INTERVAL = env.int("AUCTION_BID_TOTALS_POLL_INTERVAL", default=5)
+AUCTION_BID_TOTALS_CACHE_TIMEOUT = 2
+# Bids a user can submit per AUCTION_BID_RATE_PERIOD seconds
+AUCTION_BID_RATE_LIMIT = 10
+AUCTION_BID_RATE_PERIOD = 60
+
 
 # Encrypted models
 FIELD_ENCRYPTION_KEY=env.str("FIELD_ENCRYPTION_KEY")
 EJF_ENCRYPTION_KEYS = FIELD_ENCRYPTION_KEY
 
 PDF_ENCRYPTION_KEY=env.str("PDF_ENCRYPTION_KEY")
+# Change along with PDF_ENCRYPTION_KEY, so stored PDFs are regenerated with the new key
+PDF_ENCRYPTION_KEY_VERSION = env.str("PDF_ENCRYPTION_KEY_VERSION", default="1")
+# Processes used by the export_pdf_submissions command to render PDFs; defaults
+# to the number of CPUs
+PDF_EXPORT_WORKERS = env.int("PDF_EXPORT_WORKERS", default=None)
+# Most submissions exported in one request from the admin, where PDFs are
+# rendered one at a time and hold up the web worker; bigger exports would
+# outlast the web server's timeout, so use the export_pdf_submissions command
+PDF_EXPORT_MAX_SUBMISSIONS = env.int("PDF_EXPORT_MAX_SUBMISSIONS", default=50)
 
 RECIPE_SUBMISSIONS_OPEN=env.bool("RECIPE_SUBMISSIONS_OPEN", default=False)
 
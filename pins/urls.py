@@ -36,6 +36,11 @@ urlpatterns = [
         home_views.pdf_form_download, 
         name="pdf_form_download"
     ),
+    path(
+        "submitted-forms/<int:page_id>/export/", 
+        home_views.pdf_form_export, 
+        name="pdf_form_export"
+    ),
     path(
         "merchandise-information/",
         home_views.merch_info,